@@ -3,7 +3,8 @@
 # ================================================================
 
 # ========== IMPORTS ==========
-from flask import Flask, render_template, request, session, redirect, url_for, g, flash, current_app, jsonify
+from flask import (Flask, render_template, request, session, redirect, url_for, g, flash, current_app, jsonify,
+                   has_request_context, Response, stream_with_context)
 from flask_babel import Babel, _
 import sqlite3
 import os
@@ -16,7 +17,38 @@ import json
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 import time
+import logging
 import click
+from loaders import load_product_images
+from search_index import build_match_query, ensure_search_index, rebuild_search_index, search_join
+from ratings import ensure_rating_stats, rebuild_rating_stats
+from facets import get_facets
+from http_cache import cached_json
+from assets import build_manifest, init_assets
+from bundles import build_bundles, bundle_url
+from product_listing import ensure_product_listing, rebuild_product_listing
+from db_indexes import HOT_QUERIES, apply_index_migrations, full_scans
+from view_counter import ViewCounter
+from database import connection_manager
+from query_stats import finish_request_stats, start_request_stats
+from user_cache import LazyUser, profile_cache
+from orders import CheckoutError, place_order, refresh_order_stats
+from jobs import enqueue, job_counts, job_handler, list_jobs, replay, run_pending, work
+import vendor_api  # registers the payout_email job handler; the blueprint itself is not mounted
+from idempotency import idempotent, new_key, schedule_purge
+from referral_tree import add_referral, commission_rates, set_commission_rate, upline
+from referral_lists import (COMMISSION_COLUMNS, DOWNLINE_COLUMNS, commission_query, downline_query, iter_csv, page,
+                            page_size)
+from referral_stats import (level_stats, monthly_stats, rebuild_referral_stats, record_commissions, record_signup,
+                            user_stats)
+from wallet import InsufficientFunds, create_withdrawal, credit, current_balance, drifted, schedule_snapshots, take_snapshots
+from commission_engine import (commission_setting, commission_settings, set_commission_setting, settle_day,
+                               settle_orders)
+from cart_store import add_item, item_count, merge_items, price_cart, session_add, session_set, set_quantity
+from migrations import LATEST_VERSION, apply_migrations, has_table, pending_migrations, schema_version, table_columns
+from arabic_normalize import (backfill_normalized_columns, ensure_normalized_columns,
+                              product_text_keys)
+from pagination import decode_cursor, encode_cursor, keyset_condition, keyset_order_by, keyset_page
 # ========== ARABIC SUPPORT ==========
 try:
     from arabic_reshaper import reshape
@@ -28,9 +60,7 @@ except ImportError:
 
 # ========== CONFIGURATION CONSTANTS ==========
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
-REFERRAL_RATE = 0.05
 MIN_WITHDRAWAL = 10
-COMMISSION_RATE = 0.10
 MIN_WITHDRAWAL_LIMIT = 5.0
 DATABASE = 'sooqkabeer.db'
 UPLOAD_FOLDER = 'static/uploads/kyc'
@@ -48,12 +78,22 @@ DATABASE_PATH = os.path.join(basedir, MAIN_DB)
 app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DATABASE_PATH}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Every connection (raw sqlite3 and SQLAlchemy) comes from one manager
+connection_manager.path = DATABASE_PATH
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'creator': connection_manager.raw_connect}
+
 print(f"📁 Using database: {DATABASE_PATH}")
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['BABEL_DEFAULT_LOCALE'] = 'en'
 app.config['BABEL_SUPPORTED_LOCALES'] = ['en', 'ar']
 
+# Content-hashed /assets URLs (asset_url()/bundle_url() in templates; flask build-assets)
+asset_manifest = init_assets(app)
+app.add_template_global(bundle_url)
+# Hidden idempotency_key field for forms that move money (see idempotency.py)
+app.add_template_global(new_key, 'idempotency_key')
+
 # ========== BABEL CONFIGURATION ==========
 babel = Babel(app)
 from models import db
@@ -64,26 +104,55 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def get_db_connection():
-    """Create database connection"""
-    db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sooqkabeer.db')
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Check out a database connection; close() returns it to the pool"""
+    return connection_manager.connect()
 
 def get_db():
     """Get database connection with app context"""
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
+        db = g._database = connection_manager.connect()
     return db
 
+#=== SQL instrumentation ===#
+# Slow statements and N+1 warnings go to the 'sooqkabeer' loggers (stderr by
+# default); set SLOW_QUERY_LOG to also write them to a file
+if os.environ.get('SLOW_QUERY_LOG'):
+    _sql_log_handler = logging.FileHandler(os.environ['SLOW_QUERY_LOG'])
+    _sql_log_handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(message)s'))
+    logging.getLogger('sooqkabeer').addHandler(_sql_log_handler)
+
+@app.before_request
+def start_sql_stats():
+    """Collect query count and SQL time for this request"""
+    g.sql_stats = start_request_stats(request.endpoint or request.path)
+
+@app.after_request
+def add_sql_timing(response):
+    """Expose the request's SQL totals as a Server-Timing header"""
+    stats = getattr(g, 'sql_stats', None)
+    if stats is not None:
+        response.headers['Server-Timing'] = stats.server_timing()
+    return response
+
+@app.teardown_request
+def finish_sql_stats(error):
+    finish_request_stats()
+
+# Product page views are buffered and written to products.views in batches
+view_counter = ViewCounter(connection_manager.connect).register_shutdown()
+
 @app.teardown_appcontext
 def close_db(error):
     """Close database connection"""
     db = getattr(g, '_database', None)
     if db is not None:
         db.close()
+    # Connections a route opened with get_db_connection() but never closed
+    leaked = connection_manager.reclaim_thread()
+    if leaked:
+        where = request.path if has_request_context() else 'CLI command'
+        print(f"⚠️  Reclaimed {leaked} unclosed database connection(s) after {where}")
 
 def hash_password(password):
     """Hash password with salt"""
@@ -123,12 +192,6 @@ def create_upload_folder():
     if not os.path.exists(UPLOAD_FOLDER):
         os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# cache busting
-@app.context_processor
-def inject_cache_buster():
-    import time
-    return {'timestamp': int(time.time())}
-
 # ========== TEMPLATE FILTERS ==========
 @app.template_filter('datetime')
 def format_datetime(value, format="%d %b %Y, %I:%M %p"):
@@ -154,12 +217,6 @@ def format_date_only(value):
     """Format date only"""
     return format_datetime(value, "%d %B %Y")
 
-# ========== CONTEXT PROCESSORS ==========
-@app.context_processor
-def inject_timestamp():
-    """Inject timestamp to prevent browser cache issues"""
-    return {'timestamp': int(time.time())}
-
 # ========== CLASSES ==========
 class RowWrapper:
     """Wrapper for database rows to support multilingual names"""
@@ -190,6 +247,21 @@ def product_help():
     print("  flask quick-add           - Quick product add with parameters")
     print("  flask import-products     - Import products from CSV")
     print("  flask list-products       - List all products")
+    print("  flask rebuild-search-index - Rebuild product search index")
+    print("  flask normalize-products  - Recompute Arabic search/sort keys")
+    print("  flask rebuild-rating-stats - Recompute product/vendor ratings")
+    print("  flask rebuild-product-listing - Re-project the storefront listing table")
+    print("  flask rebuild-referral-stats - Recompute referral dashboard rollups")
+    print("  flask migrate             - Apply pending schema migrations")
+    print("  flask build-assets        - Build CSS/JS bundles and the hashed asset manifest")
+    print("  flask migrate-indexes     - Create pending hot-path indexes")
+    print("  flask check-query-plans   - Fail if a hot query does a full table scan")
+    print("  flask jobs-worker         - Run queued background jobs (commissions, stats, emails)")
+    print("  flask jobs-list           - Show queued/failed background jobs")
+    print("  flask jobs-replay         - Re-queue jobs by id, or --failed for all failed ones")
+    print("  flask commission-rates    - Show/set vendor, signup bonus and referral level rates")
+    print("  flask settle-commissions  - Settle a day's unsettled orders in one transaction")
+    print("  flask wallet-snapshot     - Snapshot wallet balances and check them against the ledger")
     print("  flask product-help        - Show this help")
     
     print("\n🚀 Examples:")
@@ -508,14 +580,251 @@ def setup_vendor(code, name, email, password):
         db.session.rollback()
         print(f"✗ Error: {str(e)}")
 
+@app.cli.command("normalize-products")
+def normalize_products_cli():
+    """Recompute normalized search/sort keys for all products"""
+    try:
+        db = get_db()
+        ensure_normalized_columns(db)
+        updated = backfill_normalized_columns(db, only_missing=False)
+        db.commit()
+        print(f"✅ Normalized {updated} products")
+    except Exception as e:
+        print(f"✗ Error: {str(e)}")
+
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index_cli():
+    """Rebuild the product full-text search index"""
+    try:
+        db = get_db()
+        ensure_search_index(db)
+        rebuild_search_index(db)
+        db.commit()
+        count = db.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        print(f"✅ Search index rebuilt for {count} products")
+    except Exception as e:
+        print(f"✗ Error: {str(e)}")
+
+@app.cli.command("rebuild-rating-stats")
+def rebuild_rating_stats_cli():
+    """Recompute product and vendor rating aggregates from approved reviews"""
+    try:
+        db = get_db()
+        ensure_rating_stats(db)
+        count = rebuild_rating_stats(db)
+        db.commit()
+        print(f"✅ Rating stats rebuilt for {count} products")
+    except Exception as e:
+        print(f"✗ Error: {str(e)}")
+
+@app.cli.command("rebuild-product-listing")
+def rebuild_product_listing_cli():
+    """Rebuild the denormalized product_listing table from products"""
+    try:
+        db = get_db()
+        ensure_product_listing(db)
+        count = rebuild_product_listing(db)
+        db.commit()
+        print(f"✅ Product listing rebuilt for {count} products")
+    except Exception as e:
+        print(f"✗ Error: {str(e)}")
+
+@app.cli.command("rebuild-referral-stats")
+def rebuild_referral_stats_cli():
+    """Recompute referral rollups from the referral tree, orders and commissions"""
+    try:
+        db = get_db()
+        count = rebuild_referral_stats(db)
+        db.commit()
+        print(f"✅ Referral stats rebuilt for {count} users")
+    except Exception as e:
+        print(f"✗ Error: {str(e)}")
+
+@app.cli.command("migrate")
+@click.option('--status', is_flag=True, help='List pending migrations without applying them')
+def migrate_cli(status):
+    """Apply pending schema migrations (run on every deploy)"""
+    db = get_db()
+    if status:
+        pending = pending_migrations(db)
+        print(f"Schema version {schema_version(db)} of {LATEST_VERSION}")
+        for version, name in pending:
+            print(f"  ⏳ {version:03d} {name}")
+        return
+    try:
+        applied = apply_migrations(db)
+    except sqlite3.Error as e:
+        raise click.ClickException(f"Migration failed: {e}")
+    for name in applied:
+        print(f"✅ Applied {name}")
+    print(f"✅ Schema at version {schema_version(db)}")
+
+@app.cli.command("build-assets")
+def build_assets_cli():
+    """Build the layout CSS/JS bundles, then fingerprint static files into the manifest"""
+    for path, size in build_bundles(app.static_folder).items():
+        print(f"  ✓ {path} ({size} bytes)")
+    manifest = build_manifest(app.static_folder)
+    asset_manifest.reload()
+    print(f"✅ Fingerprinted {len(manifest)} static files")
+
+@app.cli.command("migrate-indexes")
+def migrate_indexes_cli():
+    """Apply pending secondary index migrations"""
+    try:
+        db = get_db()
+        applied, skipped = apply_index_migrations(db)
+        db.commit()
+        for name in applied:
+            print(f"✅ Created {name}")
+        for name in skipped:
+            print(f"⚠️  Skipped {name} (table or columns missing)")
+        if not applied and not skipped:
+            print("✅ Indexes up to date")
+    except Exception as e:
+        print(f"✗ Error: {str(e)}")
+
+@app.cli.command("check-query-plans")
+def check_query_plans_cli():
+    """EXPLAIN every registered hot query and fail on full table scans"""
+    db = get_db()
+    problems = full_scans(db)
+    for name, detail in problems:
+        print(f"✗ {name}: {detail}")
+    if problems:
+        raise click.ClickException(f"{len(problems)} hot query plan(s) fall back to a full table scan")
+    print(f"✅ {len(HOT_QUERIES)} hot queries use indexes")
+
+@app.cli.command("jobs-worker")
+@click.option('--once', is_flag=True, help='Run the jobs that are due, then exit')
+@click.option('--poll', default=2.0, help='Seconds to sleep when the queue is empty')
+def jobs_worker_cli(once, poll):
+    """Process background jobs (run alongside the web server)"""
+    db = get_db()
+    schedule_purge(db)
+    schedule_snapshots(db)
+    db.commit()
+    if once:
+        results = run_pending(db)
+        print(f"✅ Ran {sum(results.values())} jobs: {results or 'queue empty'}")
+        return
+    print(f"👷 Job worker started (polling every {poll}s, Ctrl+C to stop)")
+    try:
+        work(db, poll_interval=poll)
+    except KeyboardInterrupt:
+        print("\n👋 Job worker stopped")
+
+@app.cli.command("jobs-list")
+@click.option('--status', type=click.Choice(['pending', 'running', 'done', 'failed']), help='Only this status')
+@click.option('--limit', default=20, help='Number of jobs to show')
+def jobs_list_cli(status, limit):
+    """List background jobs, newest first"""
+    db = get_db()
+    counts = job_counts(db)
+    print("  ".join(f"{name}: {count}" for name, count in sorted(counts.items())) or "No jobs queued")
+    for job in list_jobs(db, status, limit):
+        print(f"  #{job['id']:<6} {job['kind']:<18} {job['status']:<8} "
+              f"attempts {job['attempts']}/{job['max_attempts']}  {job['payload']}")
+        if job['last_error']:
+            print(f"          ✗ {job['last_error']}")
+
+@app.cli.command("jobs-replay")
+@click.argument('job_ids', nargs=-1, type=int)
+@click.option('--failed', is_flag=True, help='Re-queue every failed job')
+def jobs_replay_cli(job_ids, failed):
+    """Re-queue jobs so the worker runs them again (handlers are idempotent)"""
+    if not job_ids and not failed:
+        raise click.ClickException("Give one or more job ids, or --failed")
+    count = replay(get_db(), job_ids, failed=failed)
+    print(f"✅ Re-queued {count} jobs")
+
+@app.cli.command("commission-rates")
+@click.option('--set', 'set_rate', nargs=2, type=(int, float), help='LEVEL RATE, e.g. --set 4 0.005')
+@click.option('--remove', type=int, help='Stop paying referral commission at this level')
+@click.option('--vendor', 'vendor_rate', type=float, help='Vendor commission rate, e.g. 0.10')
+@click.option('--signup-bonus', type=float, help='Signup bonus paid to the direct referrer (KWD)')
+def commission_rates_cli(set_rate, remove, vendor_rate, signup_bonus):
+    """Show or change the vendor rate, signup bonus and per-level referral rates"""
+    db = get_db()
+    if set_rate:
+        level, rate = set_rate
+        if level < 1 or rate < 0:
+            raise click.ClickException("Level must be 1 or more and rate 0 or more")
+        set_commission_rate(db, level, rate)
+    if remove:
+        set_commission_rate(db, remove, None)
+    for name, value in (('vendor_rate', vendor_rate), ('signup_bonus', signup_bonus)):
+        if value is not None:
+            if value < 0:
+                raise click.ClickException(f"{name} cannot be negative")
+            set_commission_setting(db, name, value)
+    db.commit()
+    settings = commission_settings(db)
+    print(f"  Vendor: {settings.get('vendor_rate', 0) * 100:g}%")
+    print(f"  Signup bonus: {settings.get('signup_bonus', 0):g} KWD")
+    rates = commission_rates(db)
+    if not rates:
+        print("No referral commission levels configured")
+    for level, rate in rates.items():
+        print(f"  Level {level}: {rate * 100:g}%")
+
+@app.cli.command("wallet-snapshot")
+def wallet_snapshot_cli():
+    """Snapshot wallet balances now and report wallets that drifted from the ledger"""
+    db = get_db()
+    count = take_snapshots(db)
+    db.commit()
+    print(f"✅ Snapshot taken for {count} wallets")
+    problems = drifted(db)
+    for user_id, cached, ledger in problems:
+        print(f"✗ User {user_id}: wallet_balance {cached:.3f} but ledger {ledger:.3f}")
+    if problems:
+        raise click.ClickException(f"{len(problems)} wallet(s) disagree with the ledger")
+
+@app.cli.command("settle-commissions")
+@click.option('--date', 'day', default=None, help='Day to settle (YYYY-MM-DD, UTC); default today')
+def settle_commissions_cli(day):
+    """Settle every order placed on a day that has no commissions yet, in one transaction"""
+    day = day or datetime.utcnow().strftime('%Y-%m-%d')
+    try:
+        datetime.strptime(day, '%Y-%m-%d')
+    except ValueError:
+        raise click.ClickException("--date must look like 2026-01-31")
+    try:
+        orders, rows, credited = settle_day(get_db(), day)
+    except sqlite3.Error as e:
+        raise click.ClickException(f"Settlement failed: {e}")
+    profile_cache.invalidate(*credited)
+    print(f"✅ {day}: {orders} orders checked, {rows} commissions posted to {len(credited)} wallets")
+
 #=== Context Processors ===#
+def load_user_profile(user_id):
+    """Users row as a RowWrapper, through the short-TTL profile cache"""
+    def load(user_id):
+        row = get_db().execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+        return RowWrapper(row) if row else None
+    try:
+        return profile_cache.get(user_id, load)
+    except sqlite3.Error as e:
+        print(f"Error loading current user: {e}")
+        return None
+
+def get_current_user():
+    """Per-request, lazily loaded logged-in user (falsy for guests)"""
+    if 'current_user' not in g:
+        g.current_user = LazyUser(session.get('user_id'), load_user_profile)
+    return g.current_user
+
 @app.context_processor
-def utility_processor():
-    return dict(
-        get_arabic_text=fix_arabic,
-        now=datetime.now(),
-        wrap_row=lambda r: RowWrapper(r) if r else None
-    )
+def inject_template_globals():
+    """Inject helpers, the lazy current user and request flags into all templates"""
+    return {
+        'get_arabic_text': fix_arabic,
+        'wrap_row': lambda r: RowWrapper(r) if r else None,
+        'now': datetime.now(),
+        'current_user': get_current_user(),
+        'is_rtl': session.get('language') == 'ar',
+    }
 
 @app.before_request
 def before_request():
@@ -527,221 +836,16 @@ def before_request():
 #============ DATABASE INITIALIZATION =============#
 
 def init_database():
-    """Initialize database with all required tables"""
+    """Bring the database schema up to date by applying pending migrations"""
     with app.app_context():
         db = get_db()
-        cursor = db.cursor()
         print("📊 Initializing database from code...")
-        
-        try:
-            # Create users table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    email TEXT UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    phone TEXT,
-                    role TEXT DEFAULT 'customer',
-                    referral_code TEXT UNIQUE,
-                    referred_by TEXT,
-                    wallet_balance REAL DEFAULT 0,
-                    total_commission REAL DEFAULT 0,
-                    direct_referrals INTEGER DEFAULT 0,
-                    indirect_referrals INTEGER DEFAULT 0,
-                    total_orders INTEGER DEFAULT 0,
-                    total_spent REAL DEFAULT 0,
-                    is_active INTEGER DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_login TIMESTAMP
-                )
-            ''')
 
-            # Create vendors table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS vendors (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    email TEXT UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    phone TEXT,
-                    country_code TEXT DEFAULT '+965',
-                    nationality TEXT,
-                    shop_name TEXT NOT NULL,
-                    business_name TEXT,
-                    business_type TEXT,
-                    cr_number TEXT UNIQUE,
-                    vat_number TEXT,
-                    address TEXT,
-                    governorate TEXT,
-                    block TEXT,
-                    street TEXT,
-                    building TEXT,
-                    floor TEXT,
-                    unit TEXT,
-                    business_description TEXT,
-                    civil_id TEXT,
-                    civil_id_path TEXT,
-                    civil_id_back_path TEXT,
-                    commercial_license_path TEXT,
-                    vendor_code TEXT NOT NULL UNIQUE,
-                    status TEXT DEFAULT 'pending',
-                    agree_terms TEXT DEFAULT 'no',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            # Create products table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS products (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name_en TEXT NOT NULL,
-                    name_ar TEXT NOT NULL,
-                    description_en TEXT,
-                    description_ar TEXT,
-                    price REAL NOT NULL,
-                    unit TEXT DEFAULT 'kg',
-                    category TEXT,
-                    image_url TEXT,
-                    stock_quantity REAL DEFAULT 0,
-                    vendor_id INTEGER,
-                    is_active INTEGER DEFAULT 1,
-                    views INTEGER DEFAULT 0,
-                    total_sales INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (vendor_id) REFERENCES users (id)
-                )
-            ''')
-
-            # Create orders table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS orders (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    total_price REAL NOT NULL,
-                    status TEXT DEFAULT 'pending',
-                    shipping_address TEXT,
-                    notes TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-
-            # Create order_items table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS order_items (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    order_id INTEGER NOT NULL,
-                    product_id INTEGER NOT NULL,
-                    quantity REAL NOT NULL,
-                    unit_price REAL NOT NULL,
-                    total_price REAL NOT NULL,
-                    FOREIGN KEY (order_id) REFERENCES orders (id) ON DELETE CASCADE,
-                    FOREIGN KEY (product_id) REFERENCES products (id)
-                )
-            ''')
-
-            # Create referrals table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS referrals (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    referrer_id INTEGER NOT NULL,
-                    referred_id INTEGER NOT NULL,
-                    level INTEGER DEFAULT 1,
-                    commission_rate REAL DEFAULT 0.05,
-                    status TEXT DEFAULT 'active',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(referrer_id, referred_id),
-                    FOREIGN KEY (referrer_id) REFERENCES users (id),
-                    FOREIGN KEY (referred_id) REFERENCES users (id)
-                )
-            ''')
-
-            # Create commissions table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS commissions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    order_id INTEGER,
-                    referred_user_id INTEGER,
-                    amount REAL NOT NULL,
-                    commission_rate REAL NOT NULL,
-                    type TEXT,
-                    status TEXT DEFAULT 'pending',
-                    description TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    paid_at TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id),
-                    FOREIGN KEY (order_id) REFERENCES orders (id)
-                )
-            ''')
-
-            # Create withdrawals table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS withdrawals (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    amount REAL NOT NULL,
-                    method TEXT,
-                    account_details TEXT,
-                    status TEXT DEFAULT 'pending',
-                    transaction_id TEXT,
-                    notes TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    processed_at TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-
-            # Create categories table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS categories (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name_en TEXT NOT NULL,
-                    name_ar TEXT NOT NULL,
-                    description TEXT,
-                    parent_id INTEGER DEFAULT NULL,
-                    icon TEXT,
-                    image TEXT,
-                    sort_order INTEGER DEFAULT 0,
-                    status TEXT DEFAULT 'active',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            # Create admin_users table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS admin_users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    email TEXT UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    full_name TEXT NOT NULL,
-                    role TEXT DEFAULT 'admin',
-                    permissions TEXT,
-                    last_login TIMESTAMP,
-                    status TEXT DEFAULT 'active',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            # Insert default admin user (password: admin123)
-            cursor.execute('''
-                INSERT OR IGNORE INTO admin_users (username, email, password, full_name, role, status)
-                VALUES ('admin', 'admin@sooqkabeer.com',
-                        '5e884898da28047151d0e56f8dc6292773603d0d6aabbdd62a11ef721d1542d8',
-                        'Administrator', 'admin', 'active')
-            ''')
-
-            # Insert default categories
-            cursor.execute('''
-                INSERT OR IGNORE INTO categories (id, name_ar, name_en)
-                VALUES (1, "General", "General")
-            ''')
-
-            db.commit()
-            print("✅ Database initialized successfully!")
+        try:
+            applied = apply_migrations(db)
+            for name in applied:
+                print(f"  ✓ {name}")
+            print(f"✅ Database initialized successfully! (schema version {schema_version(db)})")
 
         except Exception as e:
             print(f"Database initialization error: {str(e)}")
@@ -795,26 +899,6 @@ def vendor_login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-#=== Context Processor for Global User Data ===#
-@app.context_processor
-def inject_global_data():
-    """Inject global data into all templates"""
-    user = None
-    if 'user_id' in session:
-        try:
-            db = get_db()
-            row = db.execute("SELECT * FROM users WHERE id = ?", 
-                           (session['user_id'],)).fetchone()
-            if row:
-                user = RowWrapper(row)
-        except Exception as e:
-            print(f"Error in inject_global_data: {e}")
-    
-    return {
-        'now': datetime.now(),
-        'current_user': user,
-        'is_rtl': True if session.get('language') == 'ar' else False
-    }
 #============ REFERRAL & COMMISSION FUNCTIONS =============#
 
 def process_referral_signup(new_user_id, referral_code):
@@ -835,34 +919,29 @@ def process_referral_signup(new_user_id, referral_code):
     referrer_id = referrer['id']
 
     try:
-        # 1. Add to referrals table
+        # 1. Record the direct referral
         cursor.execute('''
             INSERT INTO referrals (referrer_id, referred_id, level, commission_rate)
             VALUES (?, ?, 1, ?)
-        ''', (referrer_id, new_user_id, REFERRAL_RATE))
+        ''', (referrer_id, new_user_id, commission_rates(db).get(1, 0)))
 
-        # 2. Update referrer's counts
-        cursor.execute('''
-            UPDATE users
-            SET direct_referrals = direct_referrals + 1,
-                total_referrals = total_referrals + 1
-            WHERE id = ?
-        ''', (referrer_id,))
+        # 2. Add the whole upline to the referral tree, bump its counters and rollups
+        if add_referral(db, referrer_id, new_user_id):
+            record_signup(db, new_user_id)
 
         # 3. Update new user's referred_by field
         cursor.execute("UPDATE users SET referred_by = ? WHERE id = ?",
                       (referral_code, new_user_id))
 
         # 4. Add signup bonus
-        signup_bonus = 5.0
+        signup_bonus = commission_setting(db, 'signup_bonus')
         add_commission(referrer_id, signup_bonus, 'signup_bonus',
                       referred_user_id=new_user_id,
                       description=f"Signup bonus for new referral: {new_user_id}")
 
-        # 5. Process multi-level referral
-        process_multi_level_referral(new_user_id, referrer_id)
-
         db.commit()
+        # After the commit, or a concurrent request could re-cache the old rows
+        profile_cache.invalidate(new_user_id, *[ancestor_id for ancestor_id, _ in upline(db, new_user_id)])
         return True
 
     except Exception as e:
@@ -870,180 +949,75 @@ def process_referral_signup(new_user_id, referral_code):
         print(f"Referral error: {e}")
         return False
 
-def process_multi_level_referral(new_user_id, direct_referrer_id):
-    """Process multi-level referral network"""
-    db = get_db()
-    cursor = db.cursor()
-
-    # Level 2 (indirect)
-    cursor.execute('''
-        SELECT referrer_id FROM referrals
-        WHERE referred_id = ? AND level = 1
-    ''', (direct_referrer_id,))
-
-    level2_referrer = cursor.fetchone()
-    if level2_referrer:
-        level2_rate = REFERRAL_RATE * 0.5  # 2.5%
-        cursor.execute('''
-            INSERT INTO referrals (referrer_id, referred_id, level, commission_rate)
-            VALUES (?, ?, 2, ?)
-        ''', (level2_referrer['referrer_id'], new_user_id, level2_rate))
-
-        # Update indirect referrals count
-        cursor.execute('''
-            UPDATE users
-            SET indirect_referrals = indirect_referrals + 1,
-                total_referrals = total_referrals + 1
-            WHERE id = ?
-        ''', (level2_referrer['referrer_id'],))
-
-        # Level 3
-        cursor.execute('''
-            SELECT referrer_id FROM referrals
-            WHERE referred_id = ? AND level = 1
-        ''', (level2_referrer['referrer_id'],))
-
-        level3_referrer = cursor.fetchone()
-        if level3_referrer:
-            level3_rate = REFERRAL_RATE * 0.25  # 1.25%
-            cursor.execute('''
-                INSERT INTO referrals (referrer_id, referred_id, level, commission_rate)
-                VALUES (?, ?, 3, ?)
-            ''', (level3_referrer['referrer_id'], new_user_id, level3_rate))
-
-            cursor.execute('''
-                UPDATE users
-                SET indirect_referrals = indirect_referrals + 1,
-                    total_referrals = total_referrals + 1
-                WHERE id = ?
-            ''', (level3_referrer['referrer_id'],))
-
-def process_order_commissions(order_id):
-    """Process all commissions for an order"""
-    db = get_db()
-    cursor = db.cursor()
-
-    # Get order details
-    cursor.execute('''
-        SELECT o.id, o.user_id, o.total_price, u.referred_by
-        FROM orders o
-        JOIN users u ON o.user_id = u.id
-        WHERE o.id = ?
-    ''', (order_id,))
-
-    order = cursor.fetchone()
-    if not order:
-        return
-
-    buyer_id = order['user_id']
-    total_price = order['total_price']
-
-    # 1. Vendor commissions
-    cursor.execute('''
-        SELECT p.vendor_id, SUM(oi.total_price) as vendor_sales
-        FROM order_items oi
-        JOIN products p ON oi.product_id = p.id
-        WHERE oi.order_id = ?
-        GROUP BY p.vendor_id
-    ''', (order_id,))
-
-    vendor_sales = cursor.fetchall()
-    for vs in vendor_sales:
-        if vs['vendor_id']:
-            commission = vs['vendor_sales'] * COMMISSION_RATE
-            add_commission(vs['vendor_id'], commission, 'vendor', order_id,
-                          f"Vendor commission from order #{order_id}")
-
-    # 2. Referral commissions
-    cursor.execute('''
-        SELECT r.referrer_id, r.level, r.commission_rate
-        FROM referrals r
-        WHERE r.referred_id = ?
-        ORDER BY r.level
-    ''', (buyer_id,))
-
-    referrals = cursor.fetchall()
-    for ref in referrals:
-        commission = total_price * ref['commission_rate']
-        if commission > 0:
-            add_commission(ref['referrer_id'], commission, 'referral', order_id,
-                          f"Level {ref['level']} referral commission from order #{order_id}",
-                          referred_user_id=buyer_id)
-
-    db.commit()
-
-def add_commission(user_id, amount, commission_type, order_id=None, description="", referred_user_id=None):
-    """Add commission record"""
+#=== Background Jobs ===#
+def queue_order_jobs(db, order_id):
+    """Queue an order's follow-up work in the order's own transaction"""
+    enqueue(db, 'order_commissions', {'order_id': order_id}, dedupe_key=f'order_commissions:{order_id}')
+    enqueue(db, 'order_stats', {'order_id': order_id}, dedupe_key=f'order_stats:{order_id}')
+
+@job_handler('order_commissions')
+def order_commissions_job(db, payload):
+    """Post vendor and referral commissions (skipped if already posted)"""
+    rows, credited = settle_orders(db, [payload['order_id']])
+    return lambda: profile_cache.invalidate(*credited)
+
+@job_handler('order_stats')
+def order_stats_job(db, payload):
+    """Recount buyer order totals and product sales for an order"""
+    user_id = refresh_order_stats(db, payload['order_id'])
+    if user_id is not None:
+        return lambda: profile_cache.invalidate(user_id)
+
+def add_commission(user_id, amount, commission_type, order_id=None, description="", referred_user_id=None,
+                   commission_rate=0):
+    """Add a single commission record (signup bonuses; orders go through settle_orders)
+
+    Runs in the caller's transaction; the caller commits, then invalidates
+    the earner's cached profile.
+    """
     db = get_db()
     cursor = db.cursor()
+    after = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM commissions").fetchone()[0]
 
     cursor.execute('''
         INSERT INTO commissions (user_id, order_id, referred_user_id, amount, 
                                commission_rate, type, description, status)
         VALUES (?, ?, ?, ?, ?, ?, ?, 'pending')
-    ''', (user_id, order_id, referred_user_id, amount,
-          REFERRAL_RATE if commission_type == 'referral' else COMMISSION_RATE,
+    ''', (user_id, order_id, referred_user_id, amount, commission_rate,
           commission_type, description))
 
-    # Update user wallet
+    # Credit the wallet through the ledger (its trigger updates wallet_balance)
+    credit(db, user_id, amount, commission_type, 'commission', cursor.lastrowid)
     cursor.execute('''
         UPDATE users
-        SET wallet_balance = wallet_balance + ?,
-            total_commission = total_commission + ?
+        SET total_commission = COALESCE(total_commission, 0) + ?
         WHERE id = ?
-    ''', (amount, amount, user_id))
+    ''', (amount, user_id))
+    record_commissions(db, after)
 
     return True
 
 def get_referral_stats(user_id):
-    """Get referral statistics for user"""
+    """Get referral statistics for user (precomputed rollups, see referral_stats.py)"""
     db = get_db()
-    cursor = db.cursor()
-
-    # Main stats
-    cursor.execute('''
-        SELECT
-            COUNT(*) as total_referrals,
-            SUM(CASE WHEN level = 1 THEN 1 ELSE 0 END) as direct_referrals,
-            SUM(CASE WHEN level > 1 THEN 1 ELSE 0 END) as indirect_referrals
-        FROM referrals
-        WHERE referrer_id = ?
-    ''', (user_id,))
-
-    main_stats = cursor.fetchone()
-
-    # Level-wise stats
-    cursor.execute('''
-        SELECT
-            level,
-            COUNT(*) as referral_count
-        FROM referrals
-        WHERE referrer_id = ?
-        GROUP BY level
-        ORDER BY level
-    ''', (user_id,))
+    totals = user_stats(db, user_id)
 
-    level_stats = cursor.fetchall()
-
-    # Monthly earnings
-    cursor.execute('''
-        SELECT
-            strftime('%Y-%m', created_at) as month,
-            SUM(amount) as monthly_income,
-            COUNT(*) as transaction_count
-        FROM commissions
-        WHERE user_id = ? AND type = 'referral' AND status = 'completed'
-        GROUP BY strftime('%Y-%m', created_at)
-        ORDER BY month DESC
-        LIMIT 6
-    ''', (user_id,))
-
-    monthly_stats = cursor.fetchall()
+    main_stats = {
+        'total_referrals': totals['referrals'],
+        'direct_referrals': totals['direct_referrals'],
+        'indirect_referrals': totals['referrals'] - totals['direct_referrals'],
+    }
+    level_stats_rows = [{'level': row['level'], 'referral_count': row['referrals'], 'orders': row['orders'],
+                         'sales': row['sales'], 'commission': row['commission']}
+                        for row in level_stats(db, user_id)]
+    monthly = [{'month': row['month'], 'monthly_income': row['commission'],
+                'transaction_count': row['commissions']}
+               for row in monthly_stats(db, user_id)]
 
     return {
-        'main': dict(main_stats) if main_stats else {},
-        'level': [dict(level) for level in level_stats],
-        'monthly': [dict(month) for month in monthly_stats]
+        'main': main_stats,
+        'level': level_stats_rows,
+        'monthly': monthly
     }
 #============ MAIN ROUTES =============#
 
@@ -1099,7 +1073,8 @@ def login():
                 if user:
                     # Simple password check (plain text for now)
                     if user[3] == password:  # password field
-                        # Set session
+                        # Set session (a guest cart is carried over)
+                        guest_cart = session.get('cart', [])
                         session.clear()
                         session['user_id'] = user[0]
                         session['username'] = user[1]
@@ -1107,6 +1082,11 @@ def login():
                         session['full_name'] = user[4] or user[1]
                         session['role'] = 'customer'
                         session['logged_in'] = True
+
+                        if guest_cart:
+                            merge_items(db, user[0], guest_cart)
+                            db.commit()
+                        session['cart_count'] = item_count(db, user[0])
                         
                         flash(f'مرحباً بعودتك، {session["full_name"]}!', 'success')
                         return redirect(url_for('home'))
@@ -1228,22 +1208,19 @@ def register():
             # Hash password
             password_hash = hash_password(password)
 
-            # Insert user
+            # Insert user with their own referral code (the referrer's
+            # code in ref_code is recorded as referred_by below)
+            user_ref_code = generate_referral_code(username)
             sql = """INSERT INTO users
                      (username, email, password, phone, role, is_active,
                       vendor_id_code, vendor_verified, referral_code, status)
                      VALUES (?, ?, ?, ?, 'customer', 1, ?, 0, ?, 'active')"""
 
             cursor.execute(sql, (username, email, password_hash, phone,
-                                vendor_custom_id, ref_code))
+                                vendor_custom_id, user_ref_code))
             
             user_id = cursor.lastrowid
             
-            # Generate referral code for new user
-            user_ref_code = generate_referral_code(username)
-            cursor.execute("UPDATE users SET referral_code = ? WHERE id = ?",
-                         (user_ref_code, user_id))
-            
             # Process referral if provided
             if ref_code:
                 process_referral_signup(user_id, ref_code)
@@ -1274,6 +1251,182 @@ def change_site_lang(lang):
         session.permanent = True
     return redirect(request.referrer or url_for('home'))
 
+def get_product_filters():
+    """Read the storefront listing filters from the query string"""
+    search_query = request.args.get('search', '')
+    return {
+        'category_id': request.args.get('category', 'all'),
+        'sub_category': request.args.get('sub_category', ''),
+        'min_price': request.args.get('min_price', type=float),
+        'max_price': request.args.get('max_price', type=float),
+        # Search results default to relevance order
+        'sort_by': request.args.get('sort_by', 'relevance' if search_query else 'newest'),
+        'search': search_query,
+        'origin': request.args.get('origin', ''),
+        'brand': request.args.get('brand', ''),
+    }
+
+def build_product_filters(filters):
+    """Build the JOIN/WHERE shared by the product listing and its count query
+
+    Returns (joins, where, params). Search goes through the FTS5 index and
+    exposes `fts.rank` (bm25) for ordering.
+    """
+    joins = ''
+    where = "WHERE p.status = 'active' AND p.stock_quantity > 0"
+    params = []
+
+    # Search filter (full-text index)
+    match = build_match_query(filters['search'])
+    if match:
+        joins += search_join('fts')
+        params.append(match)
+
+    # Category filter
+    if filters['category_id'] and filters['category_id'] != 'all':
+        where += ' AND p.category_id = ?'
+        params.append(filters['category_id'])
+
+    # Sub-category filter
+    if filters['sub_category']:
+        where += ' AND p.sub_category = ?'
+        params.append(filters['sub_category'])
+
+    # Price range filter
+    if filters['min_price'] is not None:
+        where += ' AND p.sale_price >= ?'
+        params.append(filters['min_price'])
+
+    if filters['max_price'] is not None:
+        where += ' AND p.sale_price <= ?'
+        params.append(filters['max_price'])
+
+    # Origin filter
+    if filters['origin']:
+        where += ' AND p.origin = ?'
+        params.append(filters['origin'])
+
+    # Brand filter
+    if filters['brand']:
+        where += ' AND p.brand LIKE ?'
+        params.append(f"%{filters['brand']}%")
+
+    return joins, where, params
+
+# Sorts that page by cursor: sort_by -> (key expression, descending).
+# The key is paired with p.id so every position in the order is unique.
+KEYSET_SORTS = {
+    'newest': ('p.created_at', True),
+    'price_low': ('p.sort_price', False),
+    'price_high': ('p.sort_price', True),
+    'name_asc': ('p.sort_key_{lang}', False),
+    'name_desc': ('p.sort_key_{lang}', True),
+}
+
+# Numbered page links stop here; deeper pages are reached by cursor
+MAX_OFFSET_PAGE = 10
+
+def products_page_url(**changes):
+    """URL of the current listing with pagination arguments replaced"""
+    args = request.args.to_dict()
+    args.pop('page', None)
+    args.pop('cursor', None)
+    args.update({k: v for k, v in changes.items() if v is not None})
+    return url_for('products', **args)
+
+def fetch_product_page(db, filters, lang, page=1, limit=12, cursor_token=None):
+    """Run the storefront listing query for one page
+
+    Reads the product_listing read model, so each product is a single row.
+    Shared by the products page and the JSON filter API. Returns a dict with
+    the page's products, whether a cursor was used, and
+    `next_args`/`prev_args`: the query arguments (cursor or page) of the
+    neighbouring pages, or None.
+    """
+    sort_by = filters['sort_by']
+    offset = (page - 1) * limit
+    joins, where, filter_params = build_product_filters(filters)
+    
+    # Keyset pagination for sorts with a stable key
+    keyset = KEYSET_SORTS.get(sort_by)
+    cursor = None
+    key_columns = ()
+    sort_value = ''
+    if keyset:
+        key_expr = keyset[0].format(lang='en' if lang == 'en' else 'ar')
+        key_columns = (key_expr, 'p.id')
+        sort_value = f', {key_expr} AS sort_value'
+        cursor = decode_cursor(cursor_token, sort=sort_by, columns=len(key_columns))
+    direction = cursor['direction'] if cursor else 'next'
+    
+    # Build main query with filters: one read-model row per card
+    query = 'SELECT p.*' + sort_value + ' FROM product_listing p' + joins + ' ' + where
+    
+    params = list(filter_params)
+    
+    # Sorting logic
+    sort_options = {
+        'popular': 'p.review_count DESC, p.created_at DESC',
+        'rating': 'p.product_rating DESC, p.created_at DESC',
+    }
+    if joins:
+        sort_options['relevance'] = 'fts.rank, p.created_at DESC'
+    
+    if keyset:
+        if cursor:
+            condition, condition_params = keyset_condition(
+                key_columns, keyset[1], cursor['values'], direction)
+            query += f' AND {condition}'
+            params.extend(condition_params)
+        order_by = keyset_order_by(key_columns, keyset[1], direction)
+    else:
+        order_by = sort_options.get(sort_by, 'p.created_at DESC')
+    query += f' ORDER BY {order_by}'
+    
+    # Add pagination: one extra row tells whether another page follows
+    if cursor:
+        query += ' LIMIT ?'
+        params.append(limit + 1)
+    else:
+        query += ' LIMIT ? OFFSET ?'
+        params.extend([limit + 1, offset])
+
+    cur = db.cursor()
+    cur.execute(query, params)
+    
+    # Convert to list of dictionaries for easier template handling
+    products_list, has_more = keyset_page([dict(row) for row in cur.fetchall()], limit, direction)
+    cur.close()
+
+    # Opaque next/prev cursors taken from the first and last rows
+    next_args = prev_args = None
+    if keyset and products_list:
+        if not cursor:
+            has_prev, has_next = page > 1, has_more
+        elif direction == 'next':
+            has_prev, has_next = True, has_more
+        else:
+            has_prev, has_next = has_more, True
+        first, last = products_list[0], products_list[-1]
+        if has_next:
+            next_args = {'cursor': encode_cursor(sort_by, [last['sort_value'], last['id']], 'next')}
+        if has_prev:
+            prev_args = {'cursor': encode_cursor(sort_by, [first['sort_value'], first['id']], 'prev')}
+    elif not keyset:
+        if page > 1:
+            prev_args = {'page': page - 1}
+        if has_more:
+            next_args = {'page': page + 1}
+
+    return {
+        'products': products_list,
+        'is_cursor_page': cursor is not None,
+        'next_args': next_args,
+        'prev_args': prev_args,
+        'count_query': 'SELECT COUNT(*) FROM product_listing p' + joins + ' ' + where,
+        'count_params': filter_params,
+    }
+
 @app.route('/products')
 def products():
     """Display all products with advanced filtering"""
@@ -1282,199 +1435,43 @@ def products():
         lang = session.get('language', 'ar')
         
         # Get pagination parameters
-        page = request.args.get('page', 1, type=int)
+        page = max(request.args.get('page', 1, type=int), 1)
         limit = 12  # Products per page
-        offset = (page - 1) * limit
         
         # Get all filter parameters
-        category_id = request.args.get('category', 'all')
-        sub_category = request.args.get('sub_category', '')
-        min_price = request.args.get('min_price', type=float)
-        max_price = request.args.get('max_price', type=float)
-        sort_by = request.args.get('sort_by', 'newest')
-        search_query = request.args.get('search', '')
-        origin = request.args.get('origin', '')
-        brand = request.args.get('brand', '')
-        
-        # Build main query with filters
-        query = '''
-            SELECT p.*,
-                   c.name_ar as category_name_ar,
-                   c.name_en as category_name_en,
-                   v.shop_name as vendor_name,
-                   v.rating as vendor_rating,
-                   COALESCE(pr.average_rating, 0) as product_rating,
-                   COALESCE(pr.review_count, 0) as review_count
-            FROM products p
-            LEFT JOIN categories c ON p.category_id = c.id
-            LEFT JOIN vendors v ON p.vendor_id = v.id
-            LEFT JOIN (
-                SELECT product_id,
-                       AVG(rating) as average_rating,
-                       COUNT(*) as review_count
-                FROM product_reviews
-                WHERE status = 'approved'
-                GROUP BY product_id
-            ) pr ON p.id = pr.product_id
-            WHERE p.status = 'active' AND p.stock_quantity > 0
-        '''
-        
-        params = []
-        
-        # Category filter
-        if category_id and category_id != 'all':
-            query += ' AND p.category_id = ?'
-            params.append(category_id)
-        
-        # Sub-category filter
-        if sub_category:
-            query += ' AND p.sub_category = ?'
-            params.append(sub_category)
-        
-        # Price range filter
-        if min_price is not None:
-            query += ' AND p.sale_price >= ?'
-            params.append(min_price)
-        
-        if max_price is not None:
-            query += ' AND p.sale_price <= ?'
-            params.append(max_price)
-        
-        # Search filter
-        if search_query:
-            query += ' AND (p.name_ar LIKE ? OR p.name_en LIKE ? OR p.desc_ar LIKE ? OR p.desc_en LIKE ?)'
-            search_param = f'%{search_query}%'
-            params.extend([search_param, search_param, search_param, search_param])
-        
-        # Origin filter
-        if origin:
-            query += ' AND p.origin = ?'
-            params.append(origin)
-        
-        # Brand filter
-        if brand:
-            query += ' AND p.brand LIKE ?'
-            params.append(f'%{brand}%')
-        
-        # Sorting logic
-        sort_options = {
-            'newest': 'p.created_at DESC',
-            'price_low': 'p.sale_price ASC',
-            'price_high': 'p.sale_price DESC',
-            'popular': 'pr.review_count DESC, p.created_at DESC',
-            'rating': 'pr.average_rating DESC, p.created_at DESC',
-            'name_asc': 'p.name_ar ASC' if lang == 'ar' else 'p.name_en ASC',
-            'name_desc': 'p.name_ar DESC' if lang == 'ar' else 'p.name_en DESC'
-        }
-        
-        order_by = sort_options.get(sort_by, 'p.created_at DESC')
-        query += f' ORDER BY {order_by}'
+        filters = get_product_filters()
+        category_id = filters['category_id']
+        sub_category = filters['sub_category']
+        min_price = filters['min_price']
+        max_price = filters['max_price']
+        sort_by = filters['sort_by']
+        search_query = filters['search']
+        origin = filters['origin']
+        brand = filters['brand']
         
-        # Add pagination
-        query += ' LIMIT ? OFFSET ?'
-        params.extend([limit, offset])
-
         db = get_db()
-        cur = db.cursor()
-        cur.execute(query, params)
-        
-        # SQLite returns rows that can be accessed like dictionaries
-        rows = cur.fetchall()
-        products = [dict(row) for row in rows]
-        # Convert to list of dictionaries for easier template handling
-        products_list = []
-        for product in products:
-            product_dict = dict(zip([col[0] for col in cur.description], product))
-            
-            # Calculate discount percentage if any
-            if product_dict.get('retail_price') and product_dict.get('sale_price'):
-                retail = float(product_dict['retail_price'])
-                sale = float(product_dict['sale_price'])
-                if retail > sale and retail > 0:
-                    product_dict['discount_percent'] = int(((retail - sale) / retail) * 100)
-                else:
-                    product_dict['discount_percent'] = 0
-            
-            # Get product images
-            cur.execute('SELECT image_url FROM product_images WHERE product_id = ? ORDER BY is_main DESC', 
-                       (product_dict['id'],))
-            images = cur.fetchall()
-            product_dict['images'] = [img[0] for img in images]
-            
-            products_list.append(product_dict)
-        
-        # Get total count for pagination
-        count_query = '''
-            SELECT COUNT(*)
-            FROM products p
-            WHERE p.status = 'active' AND p.stock_quantity > 0
-        '''
-        count_params = []
-        
-        # Apply same filters to count query
-        if category_id and category_id != 'all':
-            count_query += ' AND p.category_id = ?'
-            count_params.append(category_id)
-        
-        if sub_category:
-            count_query += ' AND p.sub_category = ?'
-            count_params.append(sub_category)
-        
-        if min_price is not None:
-            count_query += ' AND p.sale_price >= ?'
-            count_params.append(min_price)
-        
-        if max_price is not None:
-            count_query += ' AND p.sale_price <= ?'
-            count_params.append(max_price)
+        listing = fetch_product_page(db, filters, lang, page, limit, request.args.get('cursor'))
+        products_list = listing['products']
+        next_url = products_page_url(**listing['next_args']) if listing['next_args'] else None
+        prev_url = products_page_url(**listing['prev_args']) if listing['prev_args'] else None
         
-        if search_query:
-            count_query += ' AND (p.name_ar LIKE ? OR p.name_en LIKE ?)'
-            search_param = f'%{search_query}%'
-            count_params.extend([search_param, search_param])
-        
-        cur.execute(count_query, count_params)
+        # Get total count for pagination (same predicate as the listing)
+        cur = db.cursor()
+        cur.execute(listing['count_query'], listing['count_params'])
         total_products = cur.fetchone()[0]
         total_pages = (total_products + limit - 1) // limit
         
-        # Get active categories
-        cur.execute('SELECT id, name_ar, name_en, icon FROM categories WHERE status = "active" ORDER BY name_ar')
-        categories = cur.fetchall()
-        
-        # Get sub-categories for the selected category
+        # Filter lists with counts (cached until the catalog changes)
+        facets = get_facets(db, lang)
+        categories = facets['categories']
         sub_categories = []
         if category_id and category_id != 'all':
-            cur.execute('''
-                SELECT DISTINCT sub_category
-                FROM products
-                WHERE category_id = ? AND sub_category IS NOT NULL AND sub_category != ''
-                ORDER BY sub_category
-            ''', (category_id,))
-            sub_categories = [sc[0] for sc in cur.fetchall()]
-        
-        # Get unique origins for filter
-        cur.execute('''
-            SELECT DISTINCT origin
-            FROM products
-            WHERE origin IS NOT NULL AND origin != '' AND status = 'active'
-            ORDER BY origin
-        ''')
-        origins = [origin[0] for origin in cur.fetchall()]
-        
-        # Get unique brands for filter
-        cur.execute('''
-            SELECT DISTINCT brand
-            FROM products
-            WHERE brand IS NOT NULL AND brand != '' AND status = 'active'
-            ORDER BY brand
-        ''')
-        brands = [brand[0] for brand in cur.fetchall()]
+            sub_categories = facets['sub_categories'].get(str(category_id), [])
+        origins = facets['origins']
+        brands = facets['brands']
         
-        # Get cart count for logged-in customers
-        cart_count = 0
-        if 'user_id' in session and session.get('role') == 'customer':
-            cur.execute('SELECT COUNT(*) FROM cart WHERE user_id = ?', (session['user_id'],))
-            cart_count = cur.fetchone()[0]
+        # Cart badge count is kept in the session by the cart routes
+        cart_count = session.get('cart_count', 0)
         
         # Get wishlist count
         wishlist_count = 0
@@ -1506,6 +1503,10 @@ def products():
                              wishlist_count=wishlist_count,
                              page=page,
                              total_pages=total_pages,
+                             max_offset_page=MAX_OFFSET_PAGE,
+                             is_cursor_page=listing['is_cursor_page'],
+                             next_url=next_url,
+                             prev_url=prev_url,
                              total_products=total_products,
                              current_category=category_id,
                              current_sub_category=sub_category,
@@ -1528,9 +1529,42 @@ def products():
 def filter_products():
     """API endpoint for AJAX filtering"""
     try:
-        # Similar filtering logic but return JSON
-        # ... (implementation for AJAX calls)
-        pass
+        lang = session.get('language', 'ar')
+        page = max(request.args.get('page', 1, type=int), 1)
+        limit = min(max(request.args.get('limit', 12, type=int), 1), 48)
+
+        db = get_db()
+        listing = fetch_product_page(db, get_product_filters(), lang, page, limit,
+                                     request.args.get('cursor'))
+
+        # Only what a product card shows
+        name_key = 'name_ar' if lang == 'ar' else 'name_en'
+        cards = []
+        for product in listing['products']:
+            cards.append({
+                'id': product['id'],
+                'name': product.get(name_key) or product.get('name_en') or product.get('name_ar'),
+                'vendor': product.get('vendor_name'),
+                'price': product.get('sale_price'),
+                'retail_price': product.get('retail_price'),
+                'discount_percent': product.get('discount_percent', 0),
+                'stock': product.get('stock_quantity'),
+                'image': product['main_image'] or product['image'],
+                'rating': round(product['product_rating'], 1),
+                'reviews': product['review_count'],
+                'url': url_for('product_detail', product_id=product['id']),
+            })
+
+        response = cached_json({
+            'success': True,
+            'lang': lang,
+            'products': cards,
+            'next': listing['next_args'],
+            'prev': listing['prev_args'],
+        })
+        # Language comes from the session
+        response.vary.add('Cookie')
+        return response
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -1553,9 +1587,8 @@ def product_detail(product_id):
         flash('Product not found', 'danger')
         return redirect(url_for('products'))
 
-    # Increment views count
-    cursor.execute("UPDATE products SET views = views + 1 WHERE id = ?", (product_id,))
-    db.commit()
+    # Increment views count (flushed in batches, see view_counter.py)
+    view_counter.record(product_id)
 
     wrapped_product = RowWrapper(product_row)
 
@@ -1980,18 +2013,24 @@ def vendor_add_product():
         video_path = save_file(video_file, 'videos') if video_file else ""
         video_type = 'file' if video_path else 'none'
 
+        # Normalized search/sort keys
+        keys = product_text_keys({'name_en': name_en, 'name_ar': name_ar,
+                                  'description_en': desc_en, 'description_ar': desc_ar})
+
         # ৩. ডাটাবেস ইনসার্ট (নতুন কলামসহ)
         cursor = db.cursor()
         sql = """INSERT INTO products
                  (name_en, name_ar, description_en, description_ar, sku, 
                   price, b2b_price, cost_price, stock_quantity, 
-                  image_url, video_url, video_type, vendor_id, status) 
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending')"""
+                  image_url, video_url, video_type, vendor_id, status,
+                  search_text, sort_key_ar, sort_key_en) 
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending', ?, ?, ?)"""
         
         cursor.execute(sql, (
             name_en, name_ar, desc_en, desc_ar, sku,
             price, b2b_price, cost_price, stock,
-            image_path, video_path, video_type, vendor_id
+            image_path, video_path, video_type, vendor_id,
+            keys['search_text'], keys['sort_key_ar'], keys['sort_key_en']
         ))
         
         db.commit()
@@ -2034,15 +2073,24 @@ def vendor_edit_product(product_id):
             image_url = request.form.get('image_url', '')
             is_active = 1 if request.form.get('is_active') else 0
 
+            cursor.execute("SELECT * FROM products WHERE id = ?", (product_id,))
+            fields = dict(cursor.fetchone())
+            fields.update(name_en=name_en, name_ar=name_ar,
+                          description_en=description_en, description_ar=description_ar)
+            keys = product_text_keys(fields)
+
             cursor.execute('''
                 UPDATE products
                 SET name_en = ?, name_ar = ?, description_en = ?, description_ar = ?,
                     price = ?, unit = ?, category = ?, stock_quantity = ?,
-                    image_url = ?, is_active = ?
+                    image_url = ?, is_active = ?,
+                    search_text = ?, sort_key_ar = ?, sort_key_en = ?
                 WHERE id = ? AND vendor_id = ?
             ''', (name_en, name_ar, description_en, description_ar,
                   price, unit, category, stock_quantity,
-                  image_url, is_active, product_id, session['user_id']))
+                  image_url, is_active,
+                  keys['search_text'], keys['sort_key_ar'], keys['sort_key_en'],
+                  product_id, session['user_id']))
 
             db.commit()
             flash('Product updated successfully', 'success')
@@ -2194,6 +2242,7 @@ def vendor_create_profile():
                 flash('Vendor profile created successfully!', 'success')
             
             db.commit()
+            profile_cache.invalidate(user_id)
             
             # Set vendor session
             session['vendor_id'] = current_vendor_id
@@ -2326,23 +2375,13 @@ def vendor_earnings():
 
 # Vendor Wallet Route
 @app.route('/vendor/wallet', methods=['GET', 'POST'])
+@vendor_required
+@idempotent(result_endpoint='vendor_wallet')
 def vendor_wallet():
-    # Check if user is logged in
-    if 'user_id' not in session:
-        flash('Please login first', 'danger')
-        return redirect(url_for('login'))
-    
-    # Check if user is vendor
+    """Vendor wallet balance and withdrawal requests"""
     user_id = session['user_id']
-    user = User.query.get(user_id)
-    
-    if not user or not user.is_vendor:
-        flash('Access denied. Vendor account required.', 'danger')
-        return redirect(url_for('index'))
-    
-    # Get vendor's current balance
-    balance = user.balance
-    
+    db = get_db()
+
     if request.method == 'POST':
         try:
             amount = float(request.form.get('amount'))
@@ -2352,46 +2391,39 @@ def vendor_wallet():
             # Validate amount
             if amount <= 0:
                 flash('Please enter a valid amount', 'danger')
-            elif amount > balance:
-                flash('Insufficient balance', 'danger')
-            elif amount < 5.000:
-                flash('Minimum withdrawal amount is KWD 5.000', 'danger')
+            elif amount < MIN_WITHDRAWAL_LIMIT:
+                flash(f'Minimum withdrawal amount is KWD {MIN_WITHDRAWAL_LIMIT:.3f}', 'danger')
             elif not method:
                 flash('Please select a payment method', 'danger')
             elif not details:
                 flash('Please provide account details', 'danger')
             else:
-                # Create withdrawal record
-                withdrawal = Withdrawal(
-                    vendor_id=user_id,
-                    amount=amount,
-                    method=method,
-                    account_details=details,
-                    status='pending'
-                )
-                
-                # Update vendor balance (temporarily hold the amount)
-                user.balance -= amount
-                
-                db.session.add(withdrawal)
-                db.session.commit()
+                # Withdrawal row plus a balance-guarded ledger debit (holds the amount)
+                create_withdrawal(db, user_id, amount, method, details)
+                db.commit()
+                profile_cache.invalidate(user_id)
                 
                 flash(f'Withdrawal request of KWD {amount:.3f} submitted successfully!', 'success')
                 return redirect(url_for('vendor_wallet'))
                 
-        except ValueError:
+        except (TypeError, ValueError):
             flash('Please enter a valid amount', 'danger')
+        except InsufficientFunds:
+            db.rollback()
+            flash('Insufficient balance', 'danger')
         except Exception as e:
-            db.session.rollback()
+            db.rollback()
             flash(f'Error: {str(e)}', 'danger')
     
-    return render_template('vendor/wallet.html', balance=balance)
+    return render_template('vendor/wallet.html', balance=current_balance(db, user_id))
 
 @app.route('/vendor/withdraw', methods=['GET', 'POST'])
 @vendor_required
+@idempotent(result_endpoint='vendor_wallet')
 def vendor_withdraw():
     """Vendor withdrawal"""
     vendor_id = session['user_id']
+    db = get_db()
 
     if request.method == 'POST':
         amount = float(request.form['amount'])
@@ -2399,43 +2431,21 @@ def vendor_withdraw():
         # Validation
         if amount < MIN_WITHDRAWAL_LIMIT:
             flash(f'Minimum withdrawal: {MIN_WITHDRAWAL_LIMIT} KWD', 'warning')
-            return render_template('vendor/withdraw.html')
-
-        db = get_db_connection()
-        balance = db.execute(
-            'SELECT available_balance FROM vendor_balances WHERE id > 0 OR vendor_id = ?',
-            (vendor_id,)
-        ).fetchone()
-
-        if balance and balance['available_balance'] >= amount:
-            # Create withdrawal request
-            withdrawal_id = db.execute(
-                'INSERT INTO withdrawals (vendor_id, amount, status) VALUES (?, ?, ?)',
-                (vendor_id, amount, 'pending')
-            ).lastrowid
-
-            # Deduct from balance
-            db.execute(
-                'UPDATE vendor_balances SET available_balance = available_balance - ?, '
-                'pending_withdrawals = pending_withdrawals + ?, last_updated = CURRENT_TIMESTAMP '
-                'WHERE id > 0 OR vendor_id = ?',
-                (amount, amount, vendor_id)
-            )
+            return render_template('vendor/wallet.html', balance=current_balance(db, vendor_id))
 
+        try:
+            withdrawal_id = create_withdrawal(db, vendor_id, amount,
+                                              request.form.get('method'), request.form.get('details'))
             db.commit()
-            db.close()
+            profile_cache.invalidate(vendor_id)
             flash(f'Withdrawal request {amount} KWD submitted! (ID: #{withdrawal_id})', 'success')
             return redirect(url_for('vendor_dashboard'))
-
-        flash('Insufficient balance!', 'danger')
-        db.close()
+        except InsufficientFunds:
+            db.rollback()
+            flash('Insufficient balance!', 'danger')
 
     # Show withdrawal form
-    db = get_db_connection()
-    balance = db.execute('SELECT * FROM vendor_balances WHERE id > 0 OR vendor_id = ?', (vendor_id,)).fetchone()
-    db.close()
-
-    return render_template('vendor/withdraw.html', balance=balance)
+    return render_template('vendor/wallet.html', balance=current_balance(db, vendor_id))
 
 @app.route('/vendor/financials')
 @vendor_required
@@ -2561,24 +2571,14 @@ def admin_users():
     cursor = db.cursor()
 
     try:
-        # Dynamic column selection
-        cursor.execute("PRAGMA table_info(users)")
-        columns_info = cursor.fetchall()
-        column_names = [col[1] for col in columns_info]
-
-        # Select all available columns
-        select_columns = ', '.join(column_names)
+        # Columns come from the cached schema description (see migrations.py)
+        column_names = list(table_columns(db, 'users'))
 
-        # Determine order by column
-        order_column = 'created_at' if 'created_at' in column_names else 'id'
-
-        query = f'''
-            SELECT {select_columns}
+        cursor.execute('''
+            SELECT *
             FROM users
-            ORDER BY {order_column} DESC
-        '''
-
-        cursor.execute(query)
+            ORDER BY created_at DESC
+        ''')
         users = cursor.fetchall()
 
         return render_template('admin/users.html',
@@ -2598,8 +2598,7 @@ def admin_vendors():
 
     try:
         # Check if vendors table exists
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='vendors'")
-        if not cursor.fetchone():
+        if not has_table(db, 'vendors'):
             return render_template('admin/vendors.html', vendors=[], total=0, licensed=0, pending=0)
 
         # Get vendor data
@@ -2649,6 +2648,8 @@ def approve_vendor(v_id):
     ''', (v_id,))
 
     db.commit()
+    # After the commit, or a concurrent request could re-cache the old role
+    profile_cache.clear()
     flash('Vendor approved successfully!', 'success')
     return redirect(url_for('admin_vendors'))
 
@@ -2735,11 +2736,17 @@ def add_product():
             filename = image.filename
             image.save(f"static/uploads/{filename}")
 
+        # Normalized search/sort keys
+        keys = product_text_keys({'name_en': name_en, 'name_ar': name_ar,
+                                  'desc_en': short_desc_en, 'desc_ar': short_desc_ar})
+
         # Save to database
         db.execute('''INSERT INTO products
-            (name_en, name_ar, price, b2b_price, stock, category_id, vendor_id, image, sku, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-            (name_en, name_ar, price, b2b_price, stock, category_id, vendor_id, filename, sku, status))
+            (name_en, name_ar, price, b2b_price, stock, category_id, vendor_id, image, sku, status,
+             search_text, sort_key_ar, sort_key_en)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            (name_en, name_ar, price, b2b_price, stock, category_id, vendor_id, filename, sku, status,
+             keys['search_text'], keys['sort_key_ar'], keys['sort_key_en']))
         db.commit()
         return redirect(url_for('admin_dashboard'))
 
@@ -2783,14 +2790,21 @@ def edit_product(product_id):
                 image_name = secure_filename(image_file.filename)
                 image_file.save(os.path.join('static/images/products', image_name))
 
+            # Normalized search/sort keys for the new names
+            fields = dict(product)
+            fields.update(name_ar=name_ar, name_en=name_en)
+            keys = product_text_keys(fields)
+
             # Update database
             db.execute("""
                 UPDATE products SET
                 name_ar=?, name_en=?, category_id=?, price=?, b2b_price=?,
-                stock=?, unit=?, min_qty=?, admin_commission=?, image=?
+                stock=?, unit=?, min_qty=?, admin_commission=?, image=?,
+                search_text=?, sort_key_ar=?, sort_key_en=?
                 WHERE id=?
             """, (name_ar, name_en, category_id, price, b2b_price,
-                  stock, unit, min_qty, admin_commission, image_name, product_id))
+                  stock, unit, min_qty, admin_commission, image_name,
+                  keys['search_text'], keys['sort_key_ar'], keys['sort_key_en'], product_id))
 
             db.commit()
             flash('تم التحديث بنجاح (Product Updated!)', 'success')
@@ -2826,24 +2840,13 @@ def admin_orders():
     db = get_db()
     cursor = db.cursor()
 
-    # Check if created_at exists
-    cursor.execute("PRAGMA table_info(orders)")
-    order_columns = [col[1] for col in cursor.fetchall()]
-
-    if 'created_at' in order_columns:
-        cursor.execute('''
-            SELECT o.*, u.username as customer_name
-            FROM orders o
-            LEFT JOIN users u ON o.user_id = u.id
-            ORDER BY o.created_at DESC
-        ''')
-    else:
-        cursor.execute('''
-            SELECT o.*, u.username as customer_name
-            FROM orders o
-            LEFT JOIN users u ON o.user_id = u.id
-            ORDER BY o.id DESC
-        ''')
+    # orders.created_at is guaranteed by migration 2
+    cursor.execute('''
+        SELECT o.*, u.username as customer_name
+        FROM orders o
+        LEFT JOIN users u ON o.user_id = u.id
+        ORDER BY o.created_at DESC
+    ''')
 
     orders = cursor.fetchall()
 
@@ -2959,18 +2962,12 @@ def process_withdrawal(withdrawal_id):
         ).fetchone()
 
         if withdrawal:
+            # The amount left the wallet (ledger debit) when it was requested
             cursor.execute('''
                 UPDATE withdrawals
                 SET status = 'completed', processed_at = CURRENT_TIMESTAMP
                 WHERE id = ?
             ''', (withdrawal_id,))
-
-            cursor.execute('''
-                UPDATE users
-                SET wallet_balance = wallet_balance - ?
-                WHERE id = ?
-            ''', (withdrawal['amount'], withdrawal['user_id']))
-
             db.commit()
 
     except Exception as e:
@@ -3072,36 +3069,33 @@ def force_admin():
 
 #============ ORDER & CART SYSTEM =============#
 
+def cart_owner():
+    """users.id whose stored cart is used, or None for the guest session cart"""
+    if session.get('role') == 'customer':
+        return session.get('user_id')
+    return None
+
+def set_cart_count(db, user_id):
+    """Recount the cart into session['cart_count'], which the badges read"""
+    if user_id is None:
+        session['cart_count'] = len(session.get('cart', []))
+    else:
+        session['cart_count'] = item_count(db, user_id)
+
 @app.route('/cart')
-@login_required
 def cart():
     """View shopping cart"""
-    cart_items = session.get('cart', [])
-
     db = get_db()
-    cursor = db.cursor()
-
-    cart_details = []
-    total = 0
-
-    for item in cart_items:
-        cursor.execute("SELECT * FROM products WHERE id = ?", (item['product_id'],))
-        product = cursor.fetchone()
+    user_id = cart_owner()
 
-        if product:
-            item_total = item['quantity'] * product['price']
-            total += item_total
-
-            cart_details.append({
-                'product': dict(product),
-                'quantity': item['quantity'],
-                'item_total': item_total
-            })
+    # Price and stock-check every line with one query
+    cart_details, total = price_cart(db, user_id=user_id,
+                                     items=session.get('cart', []) if user_id is None else None)
+    session['cart_count'] = len(cart_details)
 
     return render_template('cart.html', cart_items=cart_details, total=total)
 
 @app.route('/add_to_cart/<int:product_id>', methods=['POST'])
-@login_required
 def add_to_cart(product_id):
     """Add product to cart"""
     quantity = float(request.form.get('quantity', 1))
@@ -3116,55 +3110,38 @@ def add_to_cart(product_id):
         flash('Insufficient stock', 'danger')
         return redirect(url_for('product_detail', product_id=product_id))
 
-    # Add to cart
-    cart = session.get('cart', [])
-
-    # Check if product already in cart
-    found = False
-    for item in cart:
-        if item['product_id'] == product_id:
-            item['quantity'] += quantity
-            found = True
-            break
-    
-    if not found:
-        cart.append({
-            'product_id': product_id,
-            'quantity': quantity
-        })
-
-    session['cart'] = cart
-    session.modified = True
+    # Logged-in customers keep their cart server-side; guests in the session
+    user_id = cart_owner()
+    if user_id is None:
+        session['cart'] = session_add(session.get('cart', []), product_id, quantity)
+    else:
+        add_item(db, user_id, product_id, quantity)
+        db.commit()
+    set_cart_count(db, user_id)
 
     flash('Product added to cart', 'success')
     return redirect(url_for('cart'))
 
 @app.route('/update_cart/<int:product_id>', methods=['POST'])
-@login_required
 def update_cart(product_id):
     """Update cart item quantity"""
     quantity = float(request.form.get('quantity', 0))
 
-    cart = session.get('cart', [])
-
-    if quantity <= 0:
-        # Remove item
-        cart = [item for item in cart if item['product_id'] != product_id]
+    db = get_db()
+    user_id = cart_owner()
+    if user_id is None:
+        session['cart'] = session_set(session.get('cart', []), product_id, quantity)
     else:
-        # Update quantity
-        for item in cart:
-            if item['product_id'] == product_id:
-                item['quantity'] = quantity
-                break
-
-    session['cart'] = cart
-    session.modified = True
+        set_quantity(db, user_id, product_id, quantity)
+        db.commit()
+    set_cart_count(db, user_id)
 
     flash('Cart updated', 'success')
     return redirect(url_for('cart'))
 
 @app.route('/checkout', methods=['GET', 'POST'])
 @login_required
+@idempotent(result_endpoint='order_history')
 def checkout():
     """Checkout process"""
     if request.method == 'POST':
@@ -3172,78 +3149,23 @@ def checkout():
         notes = request.form.get('notes', '')
 
         db = get_db()
-        cursor = db.cursor()
 
-        # Calculate total from cart
-        cart_items = session.get('cart', [])
-        if not cart_items:
-            flash('Cart is empty', 'danger')
+        # One BEGIN IMMEDIATE transaction: the whole order or nothing.
+        # Commissions and sales counters follow via the job worker.
+        user_id = cart_owner()
+        try:
+            order_id, total_price = place_order(
+                db, session['user_id'], shipping_address, notes,
+                items=session.get('cart', []) if user_id is None else None,
+                on_placed=lambda order_id: queue_order_jobs(db, order_id))
+        except CheckoutError as e:
+            flash(str(e), 'danger')
             return redirect(url_for('cart'))
 
-        total_price = 0
-        order_items = []
-
-        for item in cart_items:
-            cursor.execute("SELECT id, price, stock_quantity FROM products WHERE id = ?",
-                         (item['product_id'],))
-            product = cursor.fetchone()
-
-            if not product:
-                continue
-
-            if product['stock_quantity'] < item['quantity']:
-                flash(f"Insufficient stock for product ID: {product['id']}", 'danger')
-                return redirect(url_for('cart'))
+        profile_cache.invalidate(session['user_id'])
 
-            item_total = item['quantity'] * product['price']
-            total_price += item_total
-
-            order_items.append({
-                'product_id': product['id'],
-                'quantity': item['quantity'],
-                'unit_price': product['price'],
-                'total_price': item_total
-            })
-
-        # Create order
-        cursor.execute('''
-            INSERT INTO orders (user_id, total_price, shipping_address, notes, status)
-            VALUES (?, ?, ?, ?, 'pending')
-        ''', (session['user_id'], total_price, shipping_address, notes))
-
-        order_id = cursor.lastrowid
-
-        # Add order items
-        for item in order_items:
-            cursor.execute('''
-                INSERT INTO order_items (order_id, product_id, quantity, unit_price, total_price)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (order_id, item['product_id'], item['quantity'],
-                  item['unit_price'], item['total_price']))
-
-            # Update product stock
-            cursor.execute('''
-                UPDATE products
-                SET stock_quantity = stock_quantity - ?,
-                    total_sales = total_sales + 1
-                WHERE id = ?
-            ''', (item['quantity'], item['product_id']))
-
-        # Update user stats
-        cursor.execute('''
-            UPDATE users
-            SET total_orders = total_orders + 1,
-                total_spent = total_spent + ?
-            WHERE id = ?
-        ''', (total_price, session['user_id']))
-
-        # Process commissions
-        process_order_commissions(order_id)
-
-        db.commit()
-
-        # Clear cart
         session.pop('cart', None)
+        session['cart_count'] = 0
 
         flash('Order placed successfully!', 'success')
         return redirect(url_for('order_history'))
@@ -3305,7 +3227,10 @@ def order_detail(order_id):
         JOIN products p ON oi.product_id = p.id
         WHERE oi.order_id = ?
     ''', (order_id,))
-    items = cursor.fetchall()
+    items = [dict(row) for row in cursor.fetchall()]
+
+    # Product images for all items in one query
+    load_product_images(db, items, key='product_id')
 
     return render_template('order_detail.html', order=order_info, items=items)
 
@@ -3323,59 +3248,37 @@ def referral_dashboard():
     cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
     current_user = cursor.fetchone()
 
-    # Get referral stats
-    cursor.execute("""
-        SELECT
-            COUNT(*) as total_refs,
-            SUM(CASE WHEN is_active = 1 THEN 1 ELSE 0 END) as active_refs,
-            SUM(total_spent) as total_sales,
-            SUM(total_commission) as total_earned
-        FROM users
-        WHERE referred_by = ?
-    """, (current_user['referral_code'],))
-
-    stats_data = cursor.fetchone()
+    # Get referral stats (one precomputed row)
+    totals = user_stats(db, user_id)
     referral_stats = {
-        'total_referrals': stats_data[0] if stats_data[0] else 0,
-        'active_referrals': stats_data[1] if stats_data[1] else 0,
-        'total_referred_sales': stats_data[2] if stats_data[2] else 0,
-        'total_earned': stats_data[3] if stats_data[3] else 0,
+        'total_referrals': totals['direct_referrals'],
+        'active_referrals': totals['active_referrals'],
+        'total_referred_sales': totals['direct_sales'],
+        'total_earned': totals['commission'],
         'available_balance': current_user['wallet_balance']
     }
 
-    # Get referrals list
-    cursor.execute("""
-        SELECT username, email, created_at, is_active, total_orders, total_spent
-        FROM users
-        WHERE referred_by = ?
-        ORDER BY created_at DESC
-    """, (current_user['referral_code'],))
-    referrals = cursor.fetchall()
+    # First page of direct referrals; the rest load from /api/referral/downline
+    referrals = page(db, downline_query(user_id, level=1), 'downline', limit=20)
 
     # Get commission history
-    cursor.execute("""
-        SELECT c.*, u.username as referred_user_name
-        FROM commissions c
-        LEFT JOIN users u ON c.referred_user_id = u.id
-        WHERE c.user_id = ? AND c.type = 'referral'
-        ORDER BY c.created_at DESC
-        LIMIT 15
-    """, (user_id,))
-    commissions = cursor.fetchall()
+    commissions = page(db, commission_query(user_id, 'referral'), 'commissions', limit=15)['items']
 
     referral_url = f"{request.host_url}register?ref={current_user['referral_code']}"
 
     return render_template('referral_dashboard.html',
                          user=current_user,
                          referral_stats=referral_stats,
-                         referrals=referrals,
+                         referrals=referrals['items'],
+                         referrals_next=referrals['next_cursor'],
                          commissions=commissions,
                          referral_url=referral_url,
-                         referral_rate=REFERRAL_RATE,
+                         referral_rate=commission_rates(db).get(1, 0),
                          min_withdrawal=MIN_WITHDRAWAL)
 
 @app.route('/referral/withdraw', methods=['GET', 'POST'])
 @login_required
+@idempotent(result_endpoint='referral_dashboard')
 def withdraw_earnings():
     """Withdraw referral earnings"""
     if request.method == 'POST':
@@ -3388,35 +3291,20 @@ def withdraw_earnings():
             return redirect(url_for('withdraw_earnings'))
 
         db = get_db()
-        cursor = db.cursor()
-
-        # Check balance
-        cursor.execute("SELECT wallet_balance FROM users WHERE id = ?", (session['user_id'],))
-        user = cursor.fetchone()
-
-        if amount > user['wallet_balance']:
-            flash('Insufficient balance', 'danger')
-            return redirect(url_for('withdraw_earnings'))
 
         try:
-            # Create withdrawal record
-            cursor.execute('''
-                INSERT INTO withdrawals (user_id, amount, method, account_details, status)
-                VALUES (?, ?, ?, ?, 'pending')
-            ''', (session['user_id'], amount, method, account))
-
-            # Update wallet balance
-            cursor.execute('''
-                UPDATE users
-                SET wallet_balance = wallet_balance - ?
-                WHERE id = ?
-            ''', (amount, session['user_id']))
-
+            # Withdrawal row plus a balance-guarded ledger debit
+            create_withdrawal(db, session['user_id'], amount, method, account)
             db.commit()
+            profile_cache.invalidate(session['user_id'])
 
             flash('Withdrawal request submitted successfully', 'success')
             return redirect(url_for('referral_dashboard'))
 
+        except InsufficientFunds:
+            db.rollback()
+            flash('Insufficient balance', 'danger')
+            return redirect(url_for('withdraw_earnings'))
         except Exception as e:
             db.rollback()
             flash(f'Withdrawal failed: {str(e)}', 'danger')
@@ -3433,6 +3321,7 @@ def withdraw_earnings():
 
 @app.route('/referral/withdraw', methods=['POST'])
 @login_required
+@idempotent(result_endpoint='referral_dashboard')
 def request_withdrawal():
     """Request withdrawal of referral earnings (API)"""
     user_id = session.get('user_id')
@@ -3448,41 +3337,34 @@ def request_withdrawal():
     except ValueError:
         return jsonify({'success': False, 'error': 'Invalid amount'})
 
-    db = get_db()
-    cursor = db.cursor()
-
-    # Check user balance
-    cursor.execute("SELECT wallet_balance FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
-
-    if not user or user['wallet_balance'] < amount:
-        return jsonify({'success': False, 'error': 'Insufficient balance'})
-
     if amount < MIN_WITHDRAWAL:
         return jsonify({'success': False, 'error': f'Minimum withdrawal is {MIN_WITHDRAWAL} KD'})
 
-    try:
-        # Create withdrawal request
-        cursor.execute("""
-            INSERT INTO withdrawals (user_id, amount, method, account_details, status)
-            VALUES (?, ?, ?, ?, 'pending')
-        """, (user_id, amount, method, account_details))
-
-        # Deduct from wallet
-        cursor.execute("""
-            UPDATE users
-            SET wallet_balance = wallet_balance - ?
-            WHERE id = ?
-        """, (amount, user_id))
+    db = get_db()
 
+    try:
+        create_withdrawal(db, user_id, amount, method, account_details)
         db.commit()
+        profile_cache.invalidate(user_id)
         return jsonify({'success': True, 'message': 'Withdrawal request submitted'})
+    except InsufficientFunds:
+        db.rollback()
+        return jsonify({'success': False, 'error': 'Insufficient balance'})
     except Exception as e:
         db.rollback()
         return jsonify({'success': False, 'error': str(e)})
 
 #============ API ROUTES =============#
 
+@app.route('/api/admin/db_stats')
+@admin_required
+def api_db_stats():
+    """API: Connection pool statistics and long-held connections"""
+    return jsonify({
+        'pool': connection_manager.stats(),
+        'leaks': connection_manager.leaks(),
+    })
+
 @app.route('/api/user_stats')
 @login_required
 def api_user_stats():
@@ -3517,8 +3399,40 @@ def api_referral_stats():
 
     return jsonify(stats)
 
+@app.route('/api/referral/downline')
+@login_required
+def api_referral_downline():
+    """API: One keyset page of the downline (?level=, ?limit=, ?cursor=)"""
+    query = downline_query(session['user_id'], request.args.get('level', type=int))
+    return jsonify(page(get_db(), query, 'downline', request.args.get('cursor'),
+                        page_size(request.args.get('limit'))))
+
+@app.route('/api/referral/commissions')
+@login_required
+def api_referral_commissions():
+    """API: One keyset page of commission history (?type=, ?limit=, ?cursor=)"""
+    query = commission_query(session['user_id'], request.args.get('type'))
+    return jsonify(page(get_db(), query, 'commissions', request.args.get('cursor'),
+                        page_size(request.args.get('limit'))))
+
+@app.route('/referral/export/<kind>.csv')
+@login_required
+def export_referrals(kind):
+    """Stream the whole downline or commission history as CSV"""
+    user_id = session['user_id']
+    if kind == 'downline':
+        query, columns = downline_query(user_id, request.args.get('level', type=int)), DOWNLINE_COLUMNS
+    elif kind == 'commissions':
+        query, columns = commission_query(user_id, request.args.get('type')), COMMISSION_COLUMNS
+    else:
+        return jsonify({'error': 'Unknown export'}), 404
+
+    return Response(stream_with_context(iter_csv(get_db(), query, columns)), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=sooqkabeer-{kind}.csv'})
+
 @app.route('/api/withdraw', methods=['POST'])
 @login_required
+@idempotent()
 def api_withdraw():
     """API: Request withdrawal"""
     data = request.json
@@ -3533,39 +3447,23 @@ def api_withdraw():
         })
 
     db = get_db()
-    cursor = db.cursor()
-
-    # Check balance
-    cursor.execute("SELECT wallet_balance FROM users WHERE id = ?", (session['user_id'],))
-    user = cursor.fetchone()
-
-    if amount > user['wallet_balance']:
-        return jsonify({
-            'success': False,
-            'message': 'Insufficient balance'
-        })
 
     try:
-        # Create withdrawal
-        cursor.execute('''
-            INSERT INTO withdrawals (user_id, amount, method, account_details, status)
-            VALUES (?, ?, ?, ?, 'pending')
-        ''', (session['user_id'], amount, method, account))
-
-        # Update balance
-        cursor.execute('''
-            UPDATE users
-            SET wallet_balance = wallet_balance - ?
-            WHERE id = ?
-        ''', (amount, session['user_id']))
-
+        create_withdrawal(db, session['user_id'], amount, method, account)
         db.commit()
+        profile_cache.invalidate(session['user_id'])
 
         return jsonify({
             'success': True,
             'message': 'Withdrawal request submitted'
         })
 
+    except InsufficientFunds:
+        db.rollback()
+        return jsonify({
+            'success': False,
+            'message': 'Insufficient balance'
+        })
     except Exception as e:
         db.rollback()
         return jsonify({
@@ -3605,31 +3503,6 @@ def admin_update_stock(product_id):
 
 #============ UTILITY ROUTES =============#
 
-@app.route('/fix-database-columns')
-def fix_database_columns():
-    """Add missing columns to database"""
-    db = get_db()
-    cursor = db.cursor()
-
-    try:
-        # Add created_at to users table
-        cursor.execute('''
-            ALTER TABLE users
-            ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        ''')
-
-        # Add created_at to orders table
-        cursor.execute('''
-            ALTER TABLE orders
-            ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        ''')
-
-        db.commit()
-        return "✅ Database columns added successfully!"
-
-    except Exception as e:
-        return f"Error: {str(e)}"
-
 @app.route('/test-categories')
 def test_categories():
     """Test categories"""
@@ -3648,9 +3521,7 @@ def test_categories():
 @app.route('/admin/products-debug')
 def admin_products_debug():
     """Debug products"""
-    import sqlite3
-    conn = sqlite3.connect('sooqkabeer.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db_connection()
     cursor = conn.cursor()
 
     cursor.execute("""
@@ -3764,61 +3635,5 @@ if __name__ == '__main__':
 import cli
 
 def init_db():
-    import sqlite3
-    conn = sqlite3.connect('sooqkabeer.db')
-    cursor = conn.cursor()
-    
-    # Create the vendors table with HKO-001 requirements
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS vendors (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            phone TEXT,
-            country_code TEXT DEFAULT '+965',
-            nationality TEXT,
-            shop_name TEXT NOT NULL,
-            business_name TEXT,
-            business_type TEXT,
-            cr_number TEXT UNIQUE,
-            vat_number TEXT,
-            address TEXT,
-            governorate TEXT,
-            block TEXT,
-            street TEXT,
-            building TEXT,
-            floor TEXT,
-            unit TEXT,
-            business_description TEXT,
-            civil_id TEXT,
-            civil_id_path TEXT,
-            civil_id_back_path TEXT,
-            commercial_license_path TEXT,
-            vendor_code TEXT NOT NULL UNIQUE,
-            status TEXT DEFAULT 'pending',
-            agree_terms TEXT DEFAULT 'no',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Create products table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name_en TEXT NOT NULL,
-            name_ar TEXT NOT NULL,
-            price REAL NOT NULL,
-            stock INTEGER DEFAULT 0,
-            vendor_id INTEGER NOT NULL,
-            main_image TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (vendor_id) REFERENCES vendors(id) ON DELETE CASCADE
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    print("✅ Database Reset and Initialized Successfully!")
-
+    """Deprecated alias: the schema is owned by migrations.py"""
+    init_database()
@@ -0,0 +1,102 @@
+"""
+Arabic Text Normalization for SooqKabeer
+Filename: arabic_normalize.py
+Folds spelling variants so search and sorting treat them as the same word.
+Keys are computed once at write time and stored in indexed columns.
+"""
+
+import re
+import unicodedata
+
+# Harakat, superscript alef and Quranic marks
+_DIACRITICS = re.compile('[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED]')
+_TATWEEL = '\u0640'
+_WHITESPACE = re.compile(r'\s+')
+
+_LETTER_FOLDS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',   # alef with hamza / madda / wasla
+    'ى': 'ي',                                  # alef maksura
+    'ة': 'ه',                                  # taa marbuta
+    'ؤ': 'و',
+    'ئ': 'ي',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+})
+
+# Product columns that feed the search key (both naming schemes are in use)
+SEARCH_FIELDS = ('name_ar', 'name_en', 'desc_ar', 'desc_en',
+                 'description_ar', 'description_en', 'brand')
+
+# Normalized columns stored on products
+NORMALIZED_COLUMNS = ('search_text', 'sort_key_ar', 'sort_key_en')
+
+COLLATION_NAME = 'ARABIC'
+
+
+def normalize_arabic(text):
+    """Normalize Arabic (and Latin) text for matching"""
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', str(text))
+    text = _DIACRITICS.sub('', text).replace(_TATWEEL, '')
+    text = text.translate(_LETTER_FOLDS).casefold()
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def sort_key(text):
+    """Sort key for names; binary order of keys is the ARABIC collation order"""
+    return normalize_arabic(text)
+
+
+def product_text_keys(fields):
+    """Compute the normalized columns for a product from its text fields"""
+    parts = [normalize_arabic(fields.get(name)) for name in SEARCH_FIELDS]
+    return {
+        'search_text': ' '.join(part for part in parts if part),
+        'sort_key_ar': sort_key(fields.get('name_ar') or fields.get('name_en')),
+        'sort_key_en': sort_key(fields.get('name_en') or fields.get('name_ar')),
+    }
+
+
+def collate_arabic(left, right):
+    """SQLite collation matching sort_key()"""
+    left, right = sort_key(left), sort_key(right)
+    return (left > right) - (left < right)
+
+
+def register_arabic_collation(conn):
+    """Register the ARABIC collation on a sqlite3 connection"""
+    conn.create_collation(COLLATION_NAME, collate_arabic)
+    return conn
+
+
+def ensure_normalized_columns(db):
+    """Add the normalized columns and their indexes to products"""
+    existing = {row[1] for row in db.execute("PRAGMA table_info(products)")}
+    for col in NORMALIZED_COLUMNS:
+        if col not in existing:
+            db.execute(f"ALTER TABLE products ADD COLUMN {col} TEXT")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_products_sort_key_ar ON products(sort_key_ar, id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_products_sort_key_en ON products(sort_key_en, id)")
+
+
+def backfill_normalized_columns(db, only_missing=True):
+    """Compute normalized columns for existing products; returns rows updated"""
+    existing = {row[1] for row in db.execute("PRAGMA table_info(products)")}
+    columns = ', '.join(['id'] + [col for col in SEARCH_FIELDS if col in existing])
+    query = f"SELECT {columns} FROM products"
+    if only_missing:
+        query += " WHERE search_text IS NULL OR sort_key_ar IS NULL OR sort_key_en IS NULL"
+
+    cursor = db.execute(query)
+    names = [col[0] for col in cursor.description]
+    updates = []
+    for row in cursor.fetchall():
+        keys = product_text_keys(dict(zip(names, row)))
+        updates.append((keys['search_text'], keys['sort_key_ar'], keys['sort_key_en'], row[0]))
+
+    db.executemany(
+        "UPDATE products SET search_text = ?, sort_key_ar = ?, sort_key_en = ? WHERE id = ?",
+        updates
+    )
+    return len(updates)
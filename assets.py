@@ -0,0 +1,158 @@
+"""
+Static Asset Fingerprinting for SooqKabeer
+Filename: assets.py
+Builds a manifest mapping static files to content-hashed names, emits
+hashed URLs for templates and serves them with immutable caching
+"""
+
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+
+from flask import abort, current_app, request, send_from_directory, url_for
+
+MANIFEST_NAME = 'asset-manifest.json'
+
+# Fingerprinted file types; everything else keeps its plain /static URL
+ASSET_EXTENSIONS = ('.css', '.js', '.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg', '.ico',
+                    '.woff', '.woff2', '.ttf')
+
+# Upload targets: files there can be replaced under the same name, so they
+# are never fingerprinted
+SKIP_DIRS = ('uploads', 'images/products')
+
+HASH_LENGTH = 10
+
+# A hashed URL never changes content, so caches may keep it for a year
+IMMUTABLE_MAX_AGE = 31536000
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def hashed_name(filename, digest):
+    """css/style.css -> css/style.<digest>.css"""
+    root, ext = os.path.splitext(filename)
+    return f'{root}.{digest}{ext}'
+
+
+def scan_static(static_folder):
+    """{relative path: hashed relative path} for every fingerprintable file"""
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(static_folder):
+        rel_dir = os.path.relpath(dirpath, static_folder)
+        dirnames[:] = [d for d in dirnames
+                       if os.path.normpath(os.path.join(rel_dir, d)).replace(os.sep, '/') not in SKIP_DIRS]
+        for name in filenames:
+            if not name.lower().endswith(ASSET_EXTENSIONS):
+                continue
+            path = os.path.join(dirpath, name)
+            if not os.path.isfile(path):
+                continue  # dangling symlink
+            rel = os.path.normpath(os.path.join(rel_dir, name)).replace(os.sep, '/')
+            manifest[rel] = hashed_name(rel, file_hash(path))
+    return dict(sorted(manifest.items()))
+
+
+def build_manifest(static_folder):
+    """Fingerprint static files and write the manifest; returns it"""
+    manifest = scan_static(static_folder)
+    path = os.path.join(static_folder, MANIFEST_NAME)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+    return manifest
+
+
+class AssetManifest:
+    """Lazily loaded manifest plus the reverse lookup used when serving
+
+    Reads static/asset-manifest.json written by `flask build-assets`. When
+    it is missing (development) the static folder is scanned in memory once.
+    """
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self._forward = None
+        self._reverse = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._forward is not None:
+            return
+        with self._lock:
+            if self._forward is not None:
+                return
+            path = os.path.join(self.static_folder, MANIFEST_NAME)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    forward = json.load(f)
+            except (OSError, ValueError):
+                forward = scan_static(self.static_folder)
+            self._reverse = {hashed: source for source, hashed in forward.items()}
+            self._forward = forward
+
+    def reload(self):
+        with self._lock:
+            self._forward = self._reverse = None
+
+    def hashed(self, filename):
+        self._load()
+        return self._forward.get(filename.lstrip('/'))
+
+    def source(self, hashed):
+        self._load()
+        return self._reverse.get(hashed)
+
+    def __len__(self):
+        self._load()
+        return len(self._forward)
+
+
+def asset_url(filename):
+    """url_for('static', ...) replacement emitting the fingerprinted URL when known"""
+    manifest = current_app.extensions['asset_manifest']
+    hashed = manifest.hashed(filename) if filename else None
+    if hashed is None:
+        return url_for('static', filename=filename)
+    return url_for('serve_asset', filename=hashed)
+
+
+def serve_asset(filename):
+    """Send a fingerprinted file with immutable far-future caching
+
+    A precompressed <file>.gz written by the bundle build is sent instead
+    when the client accepts gzip.
+    """
+    manifest = current_app.extensions['asset_manifest']
+    source = manifest.source(filename)
+    if source is None:
+        abort(404)
+    precompressed = source + '.gz'
+    if 'gzip' in request.accept_encodings and os.path.isfile(os.path.join(manifest.static_folder, precompressed)):
+        response = send_from_directory(manifest.static_folder, precompressed, max_age=IMMUTABLE_MAX_AGE,
+                                       mimetype=mimetypes.guess_type(source)[0])
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers.pop('Content-Disposition', None)
+    else:
+        response = send_from_directory(manifest.static_folder, source, max_age=IMMUTABLE_MAX_AGE)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_assets(app, url_prefix='/assets'):
+    """Register the manifest, the /assets route and the asset_url template helper"""
+    app.extensions['asset_manifest'] = AssetManifest(app.static_folder)
+    app.add_url_rule(f'{url_prefix}/<path:filename>', 'serve_asset', serve_asset)
+    app.add_template_global(asset_url)
+    return app.extensions['asset_manifest']
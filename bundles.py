@@ -0,0 +1,224 @@
+"""
+CSS/JS Bundles for SooqKabeer
+Filename: bundles.py
+Concatenates and minifies each layout's stylesheets and scripts into one
+file per layout (LTR and RTL stylesheet variants) under static/dist, with
+precompressed .gz copies next to them
+"""
+
+import gzip
+import os
+import re
+import threading
+
+from flask import current_app, request, session
+
+from assets import asset_url
+
+DIST_DIR = 'dist'
+
+# Source files per layout, relative to the static folder, in cascade order
+BUNDLES = {
+    'storefront': {'css': ('style.css',), 'js': ('language.js',)},
+    'vendor': {'css': ('css/style.css',), 'js': ('language.js',)},
+    'admin': {'css': ('admin_styles.css', 'admin_mobile.css'), 'js': ('admin_actions.js',)},
+}
+
+DIRECTIONS = ('ltr', 'rtl')
+
+# Serialises the development fallback build in bundle_url
+_build_lock = threading.Lock()
+
+
+#=== CSS minification ===#
+_CSS_TOKENS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/', re.S)
+
+
+def minify_css(css):
+    """Drop comments and redundant whitespace, leaving strings untouched"""
+    strings = []
+
+    def stash(match):
+        if match.group(1) is None:
+            return ' '
+        strings.append(match.group(1))
+        return f'\x00{len(strings) - 1}\x00'
+
+    css = _CSS_TOKENS.sub(stash, css)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    css = css.replace(';}', '}').strip()
+    return re.sub(r'\x00(\d+)\x00', lambda m: strings[int(m.group(1))], css)
+
+
+def split_rules(css):
+    """[(prelude, body)] for the top-level blocks of minified CSS"""
+    rules, depth, start, prelude = [], 0, 0, None
+    quote = None
+    for i, ch in enumerate(css):
+        if quote:
+            if ch == quote and css[i - 1] != '\\':
+                quote = None
+        elif ch in '"\'':
+            quote = ch
+        elif ch == '{':
+            if depth == 0:
+                prelude, start = css[start:i].strip(), i + 1
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                rules.append((prelude, css[start:i]))
+                start = i + 1
+        elif ch == ';' and depth == 0:
+            # @import / @charset statements
+            rules.append((css[start:i].strip(), None))
+            start = i + 1
+    return rules
+
+
+#=== RTL / LTR variants ===#
+_DIR_SELECTOR = re.compile(r'^(?:html|body|:root)?\[dir=["\']?(rtl|ltr)["\']?\]')
+_SIDE = re.compile(r'\b(left|right)\b')
+_FLIP_KEYWORD_PROPS = ('float', 'clear', 'text-align')
+_FOUR_VALUE_PROPS = ('margin', 'padding', 'border-width', 'border-color', 'border-style', 'inset')
+
+
+def _swap_sides(text):
+    return _SIDE.sub(lambda m: 'right' if m.group(1) == 'left' else 'left', text)
+
+
+def flip_declaration(declaration):
+    """margin-left:4px -> margin-right:4px, float:left -> float:right, ..."""
+    prop, sep, value = declaration.partition(':')
+    if not sep or 'url(' in value:
+        return declaration
+    prop = prop.strip()
+    flipped_prop = _swap_sides(prop)
+    if prop in _FLIP_KEYWORD_PROPS:
+        value = _swap_sides(value)
+    elif prop in _FOUR_VALUE_PROPS:
+        important = value.endswith('!important')
+        parts = value[:-len('!important')].split() if important else value.split()
+        if len(parts) == 4:
+            parts[1], parts[3] = parts[3], parts[1]
+            value = ' '.join(parts) + ('!important' if important else '')
+    elif prop == 'border-radius':
+        parts = value.split()
+        if len(parts) == 4:
+            value = ' '.join((parts[1], parts[0], parts[3], parts[2]))
+    elif prop == 'direction':
+        value = {'ltr': 'rtl', 'rtl': 'ltr'}.get(value.strip(), value)
+    return f'{flipped_prop}:{value}'
+
+
+def _flip_body(body):
+    return ';'.join(flip_declaration(d) for d in body.split(';'))
+
+
+def direction_variant(css, direction):
+    """Minified CSS for one text direction
+
+    Rules scoped to the other direction with [dir=...] are dropped. In the
+    RTL variant every unscoped rule has left/right mirrored; rules already
+    scoped to [dir=rtl] are kept as written.
+    """
+    out = []
+    for prelude, body in split_rules(css):
+        if body is None:
+            out.append(prelude + ';')
+        elif prelude.startswith(('@media', '@supports')):
+            inner = direction_variant(body, direction)
+            if inner:
+                out.append(f'{prelude}{{{inner}}}')
+        elif prelude.startswith('@'):
+            out.append(f'{prelude}{{{body}}}')
+        else:
+            generic, scoped = [], []
+            for selector in prelude.split(','):
+                match = _DIR_SELECTOR.match(selector)
+                if match is None:
+                    generic.append(selector)
+                elif match.group(1) == direction:
+                    scoped.append(selector)
+            if generic:
+                rule_body = _flip_body(body) if direction == 'rtl' else body
+                out.append(f"{','.join(generic)}{{{rule_body}}}")
+            if scoped:
+                out.append(f"{','.join(scoped)}{{{body}}}")
+    return ''.join(out)
+
+
+#=== JS ===#
+def minify_js(js):
+    """Conservative: drop whole-line // comments, indentation and blank lines"""
+    lines = []
+    for line in js.splitlines():
+        line = line.strip()
+        if line and not line.startswith('//'):
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+#=== Build ===#
+def _read(static_folder, name):
+    with open(os.path.join(static_folder, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def _replace(path, data):
+    # Write beside the target and rename, so a concurrent reader never sees
+    # a half-written bundle
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _write(path, text):
+    data = text.encode('utf-8')
+    _replace(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+    _replace(path, data)
+    return len(data)
+
+
+def bundle_path(name, kind='css', direction='ltr'):
+    """Static-relative path of a built bundle"""
+    if kind == 'css':
+        return f'{DIST_DIR}/{name}.{direction}.css'
+    return f'{DIST_DIR}/{name}.js'
+
+
+def build_bundles(static_folder, bundles=None):
+    """Write every bundle (and its .gz); returns {relative path: bytes}"""
+    dist = os.path.join(static_folder, DIST_DIR)
+    os.makedirs(dist, exist_ok=True)
+    written = {}
+    for name, sources in (bundles or BUNDLES).items():
+        if sources.get('css'):
+            css = ''.join(minify_css(_read(static_folder, src)) for src in sources['css'])
+            for direction in DIRECTIONS:
+                path = bundle_path(name, 'css', direction)
+                written[path] = _write(os.path.join(static_folder, path),
+                                       direction_variant(css, direction))
+        if sources.get('js'):
+            js = '\n;'.join(minify_js(_read(static_folder, src)) for src in sources['js'])
+            path = bundle_path(name, 'js')
+            written[path] = _write(os.path.join(static_folder, path), js + '\n')
+    return written
+
+
+def bundle_url(name, kind='css', rtl=None):
+    """Hashed URL of a layout bundle, picking the RTL stylesheet for Arabic"""
+    if rtl is None:
+        rtl = getattr(request, 'is_rtl', session.get('language') == 'ar')
+    path = bundle_path(name, kind, 'rtl' if rtl else 'ltr')
+    if not os.path.exists(os.path.join(current_app.static_folder, path)):
+        # Development checkout without `flask build-assets`: build once, then
+        # rescan so the new files get hashed URLs
+        with _build_lock:
+            if not os.path.exists(os.path.join(current_app.static_folder, path)):
+                build_bundles(current_app.static_folder)
+                current_app.extensions['asset_manifest'].reload()
+    return asset_url(path)
@@ -0,0 +1,141 @@
+"""
+Server-Side Cart Store for SooqKabeer
+Filename: cart_store.py
+Persistent cart_items rows for logged-in customers, the session list
+used for guests, and one joined query that prices and stock-checks a
+whole cart
+"""
+
+
+def ensure_cart_items(db):
+    """Create cart_items and carry over rows from the legacy cart table"""
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS cart_items (
+            user_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity REAL NOT NULL CHECK (quantity > 0),
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, product_id)
+        ) WITHOUT ROWID
+    ''')
+    legacy = db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cart'").fetchone()
+    if legacy:
+        db.execute('''
+            INSERT INTO cart_items (user_id, product_id, quantity)
+            SELECT user_id, product_id, SUM(quantity) FROM cart
+            WHERE user_id IS NOT NULL AND product_id IS NOT NULL AND quantity > 0
+            GROUP BY user_id, product_id
+            ON CONFLICT (user_id, product_id) DO NOTHING
+        ''')
+
+
+#=== Logged-in customers ===#
+def cart_items(db, user_id):
+    """[{'product_id', 'quantity'}] in the order they were added"""
+    rows = db.execute('''
+        SELECT product_id, quantity FROM cart_items
+        WHERE user_id = ? ORDER BY added_at, product_id
+    ''', (user_id,))
+    return [{'product_id': row[0], 'quantity': row[1]} for row in rows]
+
+
+def add_item(db, user_id, product_id, quantity):
+    db.execute('''
+        INSERT INTO cart_items (user_id, product_id, quantity) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, product_id)
+        DO UPDATE SET quantity = quantity + excluded.quantity, updated_at = CURRENT_TIMESTAMP
+    ''', (user_id, product_id, quantity))
+
+
+def set_quantity(db, user_id, product_id, quantity):
+    """Replace a line's quantity; zero or less removes it"""
+    if quantity <= 0:
+        db.execute("DELETE FROM cart_items WHERE user_id = ? AND product_id = ?", (user_id, product_id))
+    else:
+        db.execute('''
+            UPDATE cart_items SET quantity = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = ? AND product_id = ?
+        ''', (quantity, user_id, product_id))
+
+
+def clear_cart(db, user_id):
+    db.execute("DELETE FROM cart_items WHERE user_id = ?", (user_id,))
+
+
+def merge_items(db, user_id, items):
+    """Fold a guest's session cart into the customer's stored cart at login"""
+    db.executemany('''
+        INSERT INTO cart_items (user_id, product_id, quantity) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, product_id)
+        DO UPDATE SET quantity = quantity + excluded.quantity, updated_at = CURRENT_TIMESTAMP
+    ''', [(user_id, item['product_id'], item['quantity']) for item in items if item['quantity'] > 0])
+
+
+def item_count(db, user_id):
+    return db.execute("SELECT COUNT(*) FROM cart_items WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+#=== Guests (session list) ===#
+def session_add(items, product_id, quantity):
+    """Return a new session cart list with `quantity` more of `product_id`"""
+    items = [dict(item) for item in items]
+    for item in items:
+        if item['product_id'] == product_id:
+            item['quantity'] += quantity
+            return items
+    items.append({'product_id': product_id, 'quantity': quantity})
+    return items
+
+
+def session_set(items, product_id, quantity):
+    if quantity <= 0:
+        return [item for item in items if item['product_id'] != product_id]
+    return [dict(item, quantity=quantity) if item['product_id'] == product_id else item for item in items]
+
+
+#=== Pricing ===#
+_PRICED_COLUMNS = '''
+    p.*, c.quantity AS cart_quantity, c.quantity * p.price AS line_total,
+    COALESCE(p.stock_quantity, 0) >= c.quantity AS in_stock
+'''
+
+
+def price_cart(db, user_id=None, items=None):
+    """Price and stock-check a whole cart in one query
+
+    Reads the stored cart of `user_id`, or the given session `items`.
+    Returns (lines, total) where each line is {'product', 'quantity',
+    'item_total', 'in_stock'}; products that no longer exist are dropped.
+    """
+    if user_id is not None:
+        rows = db.execute(f'''
+            SELECT {_PRICED_COLUMNS}
+            FROM cart_items c JOIN products p ON p.id = c.product_id
+            WHERE c.user_id = ?
+            ORDER BY c.added_at, c.product_id
+        ''', (user_id,)).fetchall()
+    else:
+        items = [item for item in (items or []) if item['quantity'] > 0]
+        if not items:
+            return [], 0
+        values = ', '.join('(?, ?, ?)' for _ in items)
+        params = [value for position, item in enumerate(items)
+                  for value in (position, item['product_id'], item['quantity'])]
+        rows = db.execute(f'''
+            WITH c(position, product_id, quantity) AS (VALUES {values})
+            SELECT {_PRICED_COLUMNS}
+            FROM c JOIN products p ON p.id = c.product_id
+            ORDER BY c.position
+        ''', params).fetchall()
+
+    lines, total = [], 0
+    for row in rows:
+        product = dict(row)
+        quantity = product.pop('cart_quantity')
+        item_total = product.pop('line_total') or 0
+        in_stock = bool(product.pop('in_stock'))
+        total += item_total
+        lines.append({'product': product, 'quantity': quantity,
+                      'item_total': item_total, 'in_stock': in_stock})
+    return lines, total
@@ -0,0 +1,142 @@
+"""
+Commission Engine for SooqKabeer
+Filename: commission_engine.py
+Settles vendor and referral commissions for a set of orders with one
+INSERT ... SELECT into commissions, one matching INSERT into the wallet
+ledger, one grouped update of users.total_commission and the referral
+rollups (referral_stats.py). Vendor rate and signup bonus come from commission_settings; per-level referral
+rates from commission_rates (referral_tree.py).
+"""
+
+import json
+
+from referral_stats import record_settlement
+from wallet import credit_commissions
+
+# name -> (default value, what it is)
+DEFAULT_SETTINGS = {
+    'vendor_rate': (0.10, 'Share of each vendor\'s order lines paid as vendor commission'),
+    'signup_bonus': (5.0, 'KWD credited to the direct referrer when a referred user signs up'),
+}
+
+
+def ensure_commission_settings(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS commission_settings (
+            name TEXT PRIMARY KEY,
+            value REAL NOT NULL CHECK (value >= 0),
+            description TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    db.executemany("INSERT OR IGNORE INTO commission_settings (name, value, description) VALUES (?, ?, ?)",
+                   [(name, value, description) for name, (value, description) in DEFAULT_SETTINGS.items()])
+
+
+def commission_settings(db):
+    """{name: value}"""
+    return dict(db.execute("SELECT name, value FROM commission_settings ORDER BY name").fetchall())
+
+
+def commission_setting(db, name):
+    row = db.execute("SELECT value FROM commission_settings WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else DEFAULT_SETTINGS[name][0]
+
+
+def set_commission_setting(db, name, value):
+    if name not in DEFAULT_SETTINGS:
+        raise KeyError(name)
+    db.execute('''
+        INSERT INTO commission_settings (name, value, description) VALUES (?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP
+    ''', (name, value, DEFAULT_SETTINGS[name][1]))
+
+
+#=== Settlement ===#
+# Orders that have no commission rows yet. Jobs deliver at least once and
+# a daily batch may overlap them, so settled orders are always skipped.
+_UNSETTLED = '''
+    unsettled AS (
+        SELECT o.id, o.user_id, o.total_price FROM orders o
+        WHERE o.id IN (SELECT value FROM json_each(:order_ids))
+          AND NOT EXISTS (SELECT 1 FROM commissions c WHERE c.order_id = o.id)
+    )
+'''
+
+_INSERT_COMMISSIONS = f'''
+    INSERT INTO commissions (user_id, order_id, referred_user_id, amount, commission_rate,
+                             type, description, status)
+    WITH {_UNSETTLED},
+    vendor_rate AS (
+        SELECT COALESCE((SELECT value FROM commission_settings WHERE name = 'vendor_rate'), :vendor_rate) AS rate
+    )
+    SELECT p.vendor_id, u.id, NULL, SUM(oi.total_price) * v.rate, v.rate,
+           'vendor', 'Vendor commission from order #' || u.id, 'pending'
+    FROM unsettled u
+    JOIN order_items oi ON oi.order_id = u.id
+    JOIN products p ON p.id = oi.product_id
+    CROSS JOIN vendor_rate v
+    WHERE p.vendor_id IS NOT NULL
+    GROUP BY u.id, p.vendor_id
+    UNION ALL
+    SELECT t.ancestor_id, u.id, u.user_id, u.total_price * r.rate, r.rate,
+           'referral', 'Level ' || t.depth || ' referral commission from order #' || u.id, 'pending'
+    FROM unsettled u
+    JOIN referral_tree t ON t.descendant_id = u.user_id
+    JOIN commission_rates r ON r.level = t.depth
+    WHERE u.total_price * r.rate > 0
+'''
+
+# Add the new rows (ids above :after) to every earner's total in one pass
+_CREDIT_TOTALS = '''
+    UPDATE users
+    SET total_commission = COALESCE(total_commission, 0) + (
+            SELECT SUM(amount) FROM commissions WHERE id > :after AND user_id = users.id)
+    WHERE id IN (SELECT user_id FROM commissions WHERE id > :after)
+'''
+
+
+def settle_orders(db, order_ids):
+    """Post commissions for `order_ids` inside the caller's write transaction
+
+    Returns (number of commission rows, ids of users whose wallet changed).
+    Orders that already have commissions are left alone.
+    """
+    order_ids = [int(order_id) for order_id in order_ids]
+    if not order_ids:
+        return 0, []
+    after = db.execute("SELECT COALESCE(MAX(id), 0) FROM commissions").fetchone()[0]
+    cursor = db.execute(_INSERT_COMMISSIONS, {'order_ids': json.dumps(order_ids),
+                                              'vendor_rate': DEFAULT_SETTINGS['vendor_rate'][0]})
+    if not cursor.rowcount:
+        return 0, []
+    credit_commissions(db, after)
+    db.execute(_CREDIT_TOTALS, {'after': after})
+    record_settlement(db, after)
+    credited = [row[0] for row in db.execute(
+        "SELECT DISTINCT user_id FROM commissions WHERE id > ?", (after,))]
+    return cursor.rowcount, credited
+
+
+def day_order_ids(db, day):
+    """Ids of orders created on `day` (YYYY-MM-DD, UTC like CURRENT_TIMESTAMP)"""
+    return [row[0] for row in db.execute('''
+        SELECT id FROM orders WHERE created_at >= date(?) AND created_at < date(?, '+1 day')
+    ''', (day, day))]
+
+
+def settle_day(db, day):
+    """Settle every unsettled order from `day` in one BEGIN IMMEDIATE transaction
+
+    Returns (orders considered, commission rows, credited user ids).
+    """
+    db.commit()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        order_ids = day_order_ids(db, day)
+        rows, credited = settle_orders(db, order_ids)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return len(order_ids), rows, credited
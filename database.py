@@ -0,0 +1,201 @@
+"""
+SQLite Connection Manager for SooqKabeer
+Filename: database.py
+One place that opens database connections: per-thread reuse, pragmas
+applied once per connection, checkout tracking for leak detection and
+pool statistics. Used by get_db(), get_db_connection(), the CLI,
+vendor_api.py and as the Flask-SQLAlchemy engine creator. Statements on
+every connection are timed (see query_stats.py).
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import weakref
+
+from arabic_normalize import register_arabic_collation
+from query_stats import InstrumentedConnection
+
+DATABASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sooqkabeer.db')
+
+# Applied to every new connection, in order
+DEFAULT_PRAGMAS = (
+    ('journal_mode', 'WAL'),        # readers no longer block the writer
+    ('busy_timeout', 5000),         # wait up to 5s for the write lock
+    ('synchronous', 'NORMAL'),      # durable at checkpoints; safe with WAL
+    ('cache_size', -16000),         # 16 MB page cache
+    ('mmap_size', 134217728),       # 128 MB memory-mapped reads
+    ('temp_store', 'MEMORY'),
+)
+
+
+class PooledConnection(InstrumentedConnection):
+    """Timed sqlite3 connection whose close() hands it back to its manager"""
+
+    _manager = None
+
+    def close(self):
+        if self._manager is not None:
+            self._manager.release(self)
+        else:
+            super().close()
+
+    def really_close(self):
+        sqlite3.Connection.close(self)
+
+
+class ConnectionManager:
+    """Per-thread SQLite connection reuse with checkout tracking
+
+    connect() returns an idle connection owned by the calling thread, or
+    opens a new one. Calling close() on it returns it to the thread's idle
+    list (rolling back anything uncommitted). Connections still checked out
+    when reclaim_thread() runs, or garbage-collected without close(), are
+    counted as leaks.
+    """
+
+    def __init__(self, path=DATABASE_PATH, pragmas=DEFAULT_PRAGMAS, max_idle_per_thread=2,
+                 leak_seconds=30.0, track_stacks=False):
+        self.path = path
+        self.pragmas = pragmas
+        self.max_idle_per_thread = max_idle_per_thread
+        self.leak_seconds = leak_seconds
+        self.track_stacks = track_stacks
+        self._local = threading.local()
+        # Re-entrant: the weakref callback may run during GC inside a locked block
+        self._lock = threading.RLock()
+        self._checkouts = {}
+        self._stats = {'opened': 0, 'reused': 0, 'checkouts': 0, 'released': 0,
+                       'closed': 0, 'leaked': 0, 'peak_checked_out': 0}
+
+    #=== Opening ===#
+    def configure(self, conn):
+        """Apply pragmas and helpers to a freshly opened connection"""
+        for name, value in self.pragmas:
+            conn.execute(f"PRAGMA {name} = {value}")
+        register_arabic_collation(conn)
+        return conn
+
+    def raw_connect(self):
+        """Configured, unpooled connection (Flask-SQLAlchemy engine creator)"""
+        conn = sqlite3.connect(self.path, check_same_thread=False, factory=InstrumentedConnection)
+        with self._lock:
+            self._stats['opened'] += 1
+        return self.configure(conn)
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, factory=PooledConnection)
+        self.configure(conn)
+        conn._manager = self
+        with self._lock:
+            self._stats['opened'] += 1
+        return conn
+
+    def _idle(self):
+        idle = getattr(self._local, 'idle', None)
+        if idle is None:
+            idle = self._local.idle = []
+        return idle
+
+    #=== Checkout / release ===#
+    def connect(self):
+        """Check out a connection for the current thread"""
+        idle = self._idle()
+        if idle:
+            conn = idle.pop()
+            reused = True
+        else:
+            conn = self._open()
+            reused = False
+        conn.row_factory = sqlite3.Row
+
+        key = id(conn)
+        stack = traceback.format_stack(limit=8)[:-1] if self.track_stacks else None
+        ref = weakref.ref(conn, lambda _, key=key: self._collected(key))
+        with self._lock:
+            self._checkouts[key] = {'ref': ref, 'since': time.monotonic(),
+                                    'thread': threading.get_ident(), 'stack': stack}
+            self._stats['checkouts'] += 1
+            if reused:
+                self._stats['reused'] += 1
+            self._stats['peak_checked_out'] = max(self._stats['peak_checked_out'], len(self._checkouts))
+        return conn
+
+    def release(self, conn):
+        """Return a connection to its thread's idle list (or close it)"""
+        with self._lock:
+            entry = self._checkouts.pop(id(conn), None)
+            if entry is not None:
+                self._stats['released'] += 1
+        if entry is None:
+            return
+
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.really_close()
+            self._count('closed')
+            return
+
+        idle = self._idle()
+        if entry['thread'] == threading.get_ident() and len(idle) < self.max_idle_per_thread:
+            idle.append(conn)
+        else:
+            conn.really_close()
+            self._count('closed')
+
+    def _collected(self, key):
+        # A checked-out connection was garbage-collected without close()
+        with self._lock:
+            if self._checkouts.pop(key, None) is not None:
+                self._stats['leaked'] += 1
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def reclaim_thread(self):
+        """Return connections the current thread forgot to close; returns the count
+
+        Called at the end of each request so a route that leaks a connection
+        on an error path cannot hold it past the request.
+        """
+        thread = threading.get_ident()
+        with self._lock:
+            leaked = [entry['ref']() for entry in self._checkouts.values() if entry['thread'] == thread]
+        leaked = [conn for conn in leaked if conn is not None]
+        for conn in leaked:
+            self.release(conn)
+        if leaked:
+            with self._lock:
+                self._stats['leaked'] += len(leaked)
+        return len(leaked)
+
+    def close_idle(self):
+        """Close the current thread's idle connections"""
+        idle = self._idle()
+        while idle:
+            idle.pop().really_close()
+            self._count('closed')
+
+    #=== Introspection ===#
+    def leaks(self, older_than=None):
+        """Checkouts held longer than `older_than` (default leak_seconds)"""
+        limit = self.leak_seconds if older_than is None else older_than
+        now = time.monotonic()
+        with self._lock:
+            return [{'age': now - entry['since'], 'thread': entry['thread'], 'stack': entry['stack']}
+                    for entry in self._checkouts.values() if now - entry['since'] >= limit]
+
+    def stats(self):
+        """Counters plus the number of connections currently checked out"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['checked_out'] = len(self._checkouts)
+        return stats
+
+
+connection_manager = ConnectionManager()
@@ -0,0 +1,161 @@
+"""
+Secondary Index Migrations for SooqKabeer
+Filename: db_indexes.py
+Versioned CREATE INDEX steps for the hot query paths, plus an
+EXPLAIN QUERY PLAN check that flags any registered query doing a full scan
+"""
+
+import re
+import sqlite3
+
+# (version, index name, table, columns). Applied in version order and
+# recorded in index_migrations; a step whose table or columns do not exist
+# yet is skipped and retried on the next run.
+INDEX_MIGRATIONS = (
+    (1, 'idx_order_items_order', 'order_items', ('order_id',)),
+    (2, 'idx_order_items_product', 'order_items', ('product_id',)),
+    (3, 'idx_orders_user_created', 'orders', ('user_id', 'created_at')),
+    (4, 'idx_orders_created', 'orders', ('created_at',)),
+    (5, 'idx_products_vendor', 'products', ('vendor_id',)),
+    (6, 'idx_products_status_category', 'products', ('status', 'category_id', 'sale_price', 'created_at')),
+    (7, 'idx_referrals_referred_level', 'referrals', ('referred_id', 'level')),
+    (8, 'idx_referrals_referrer_level', 'referrals', ('referrer_id', 'level')),
+    (9, 'idx_commissions_user_type', 'commissions', ('user_id', 'type', 'status', 'created_at')),
+    (10, 'idx_commissions_created', 'commissions', ('created_at',)),
+    (11, 'idx_users_referred_by', 'users', ('referred_by', 'created_at')),
+    (12, 'idx_withdrawals_user', 'withdrawals', ('user_id', 'created_at')),
+    (13, 'idx_withdrawals_created', 'withdrawals', ('created_at',)),
+    (14, 'idx_cart_user', 'cart', ('user_id',)),
+    (15, 'idx_wishlist_user', 'wishlist', ('user_id',)),
+    (16, 'idx_commissions_order', 'commissions', ('order_id',)),
+    (17, 'idx_commissions_user', 'commissions', ('user_id',)),
+)
+
+# Representative statements from the routes, by where they run
+HOT_QUERIES = {
+    'products:listing': (
+        "SELECT p.* FROM product_listing p WHERE p.status = 'active' AND p.stock_quantity > 0 "
+        "AND p.category_id = ? ORDER BY p.created_at DESC, p.id DESC LIMIT 13"),
+    'products:count': (
+        "SELECT COUNT(*) FROM product_listing p WHERE p.status = 'active' AND p.stock_quantity > 0 "
+        "AND p.category_id = ?"),
+    'cart:priced': (
+        "SELECT p.*, c.quantity FROM cart_items c JOIN products p ON p.id = c.product_id "
+        "WHERE c.user_id = ? ORDER BY c.added_at, c.product_id"),
+    'products:wishlist_count': "SELECT COUNT(*) FROM wishlist WHERE user_id = ?",
+    'process_commissions:vendor_sales': (
+        "SELECT p.vendor_id, SUM(oi.total_price) FROM order_items oi "
+        "JOIN products p ON oi.product_id = p.id WHERE oi.order_id = ? GROUP BY p.vendor_id"),
+    'process_commissions:posted': "SELECT 1 FROM commissions WHERE order_id = ? LIMIT 1",
+    'settle_day:orders': "SELECT id FROM orders WHERE created_at >= date(?) AND created_at < date(?, '+1 day')",
+    'settle_orders:credited': "SELECT DISTINCT user_id FROM commissions WHERE id > ?",
+    'referral_tree:paid_upline': (
+        "SELECT t.ancestor_id, t.depth, r.rate FROM referral_tree t "
+        "JOIN commission_rates r ON r.level = t.depth WHERE t.descendant_id = ? ORDER BY t.depth"),
+    'referral_tree:add': (
+        "SELECT ancestor_id, ?, depth + 1 FROM referral_tree WHERE descendant_id = ? AND ancestor_id != ?"),
+    'referral_tree:downline_counts': (
+        "SELECT depth, COUNT(*) FROM referral_tree WHERE ancestor_id = ? GROUP BY depth ORDER BY depth"),
+    'referral_tree:subtree_sales': (
+        "SELECT COUNT(o.id), COALESCE(SUM(o.total_price), 0) FROM referral_tree t "
+        "JOIN orders o ON o.user_id = t.descendant_id WHERE t.ancestor_id = ? AND t.depth <= COALESCE(?, t.depth)"),
+    'referral_stats:user': "SELECT * FROM referral_user_stats WHERE user_id = ?",
+    'referral_stats:levels': "SELECT * FROM referral_level_stats WHERE user_id = ? ORDER BY level",
+    'referral_stats:monthly': (
+        "SELECT month, commission, commissions FROM referral_monthly_stats "
+        "WHERE user_id = ? ORDER BY month DESC LIMIT 6"),
+    'vendor_dashboard:orders': (
+        "SELECT o.* FROM orders o JOIN order_items oi ON o.id = oi.order_id "
+        "JOIN products p ON oi.product_id = p.id WHERE p.vendor_id = ? "
+        "GROUP BY o.id ORDER BY o.created_at DESC LIMIT 5"),
+    'vendor_dashboard:products': "SELECT * FROM products WHERE vendor_id = ?",
+    'admin_dashboard:recent_orders': (
+        "SELECT o.*, u.username FROM orders o LEFT JOIN users u ON o.user_id = u.id "
+        "ORDER BY o.created_at DESC LIMIT 5"),
+    'admin_order_detail:items': "SELECT * FROM order_items WHERE order_id = ?",
+    'admin_commissions:list': "SELECT * FROM commissions ORDER BY created_at DESC LIMIT 50",
+    'admin_withdrawals:list': (
+        "SELECT w.*, u.username FROM withdrawals w JOIN users u ON w.user_id = u.id "
+        "ORDER BY w.created_at DESC LIMIT 50"),
+    'orders:list': (
+        "SELECT o.*, (SELECT COUNT(*) FROM order_items WHERE order_id = o.id) FROM orders o "
+        "WHERE o.user_id = ? ORDER BY o.created_at DESC"),
+    'order_detail:items': (
+        "SELECT oi.*, p.name_en FROM order_items oi JOIN products p ON oi.product_id = p.id "
+        "WHERE oi.order_id = ?"),
+    'referral_lists:downline': (
+        "SELECT u.id, u.username, t.depth FROM referral_tree t JOIN users u ON u.id = t.descendant_id "
+        "WHERE t.ancestor_id = ? AND t.descendant_id < ? ORDER BY t.descendant_id DESC LIMIT 51"),
+    'referral_lists:downline_level': (
+        "SELECT u.id, u.username, t.depth FROM referral_tree t JOIN users u ON u.id = t.descendant_id "
+        "WHERE t.ancestor_id = ? AND t.depth = ? AND t.descendant_id < ? ORDER BY t.descendant_id DESC LIMIT 51"),
+    'referral_lists:commissions': (
+        "SELECT c.*, u.username FROM commissions c LEFT JOIN users u ON c.referred_user_id = u.id "
+        "WHERE c.user_id = ? AND c.id < ? ORDER BY c.id DESC LIMIT 51"),
+    'wallet:withdrawals': "SELECT * FROM withdrawals WHERE user_id = ? ORDER BY created_at DESC",
+    'wallet:snapshot': (
+        "SELECT balance FROM wallet_snapshots WHERE user_id = ? ORDER BY ledger_id DESC LIMIT 1"),
+    'wallet:tail': "SELECT SUM(amount) FROM wallet_ledger WHERE user_id = ? AND id > ?",
+    'jobs:claim': (
+        "SELECT * FROM jobs WHERE (status = 'pending' AND run_after <= ?) "
+        "OR (status = 'running' AND locked_until < ?) ORDER BY run_after, id LIMIT 1"),
+}
+
+# "SCAN t" with no index is a full table scan; "SCAN t USING [COVERING] INDEX"
+# walks an index in order and is accepted
+_FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+
+def _table_columns(db, table):
+    return {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+
+
+def applied_index_versions(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS index_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    return {row[0] for row in db.execute("SELECT version FROM index_migrations")}
+
+
+def apply_index_migrations(db):
+    """Create pending indexes; returns (applied, skipped) lists of index names"""
+    done = applied_index_versions(db)
+    applied, skipped = [], []
+    for version, name, table, columns in INDEX_MIGRATIONS:
+        if version in done:
+            continue
+        if not set(columns) <= _table_columns(db, table):
+            skipped.append(name)
+            continue
+        db.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({', '.join(columns)})")
+        db.execute("INSERT INTO index_migrations (version, name) VALUES (?, ?)", (version, name))
+        applied.append(name)
+    return applied, skipped
+
+
+def query_plan(db, sql):
+    """EXPLAIN QUERY PLAN detail lines, binding NULL for every parameter"""
+    params = (None,) * sql.count('?')
+    return [row[3] for row in db.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def full_scans(db, queries=None):
+    """[(query name, plan line)] for every registered query that scans a table
+
+    A query that no longer compiles against the schema is reported too.
+    """
+    problems = []
+    for name, sql in (queries or HOT_QUERIES).items():
+        try:
+            plan = query_plan(db, sql)
+        except sqlite3.OperationalError as e:
+            problems.append((name, f'error: {e}'))
+            continue
+        for detail in plan:
+            if _FULL_SCAN.match(detail):
+                problems.append((name, detail))
+    return problems
@@ -0,0 +1,115 @@
+"""
+Storefront Facet Cache for SooqKabeer
+Filename: facets.py
+Category, sub-category, origin and brand filter lists with product counts,
+cached per language and invalidated by a catalog version that triggers bump
+on every category write and every facet-relevant product write
+"""
+
+import sqlite3
+import threading
+
+from arabic_normalize import sort_key
+
+CATALOG_VERSION = 'catalog'
+
+# Product columns whose changes alter facet lists or counts
+FACET_COLUMNS = ('status', 'category_id', 'sub_category', 'origin', 'brand')
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def ensure_facet_triggers(db):
+    """Create the version table and the triggers that bump it"""
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    db.execute("INSERT OR IGNORE INTO cache_versions (name, version) VALUES (?, 0)",
+               (CATALOG_VERSION,))
+
+    bump = f"UPDATE cache_versions SET version = version + 1 WHERE name = '{CATALOG_VERSION}';"
+    events = {
+        'products_facets_ai': 'AFTER INSERT ON products',
+        'products_facets_ad': 'AFTER DELETE ON products',
+        'products_facets_au': f"AFTER UPDATE OF {', '.join(FACET_COLUMNS)} ON products",
+        'categories_facets_ai': 'AFTER INSERT ON categories',
+        'categories_facets_ad': 'AFTER DELETE ON categories',
+        'categories_facets_au': 'AFTER UPDATE ON categories',
+    }
+    for name, event in events.items():
+        db.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {bump} END")
+
+
+def catalog_version(db):
+    """Current catalog version, or None when the version table is missing"""
+    try:
+        row = db.execute("SELECT version FROM cache_versions WHERE name = ?",
+                         (CATALOG_VERSION,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def invalidate_facets():
+    """Drop every cached facet set (e.g. after restoring a database file)"""
+    with _lock:
+        _cache.clear()
+
+
+def _facet_list(counts):
+    """[{'value', 'count'}] sorted with the Arabic-aware key"""
+    return [{'value': value, 'count': count}
+            for value, count in sorted(counts.items(), key=lambda item: (sort_key(item[0]), item[0]))]
+
+
+def load_facets(db, lang='ar'):
+    """Build facet lists from one grouped pass over active products"""
+    category_counts, sub_categories, origins, brands = {}, {}, {}, {}
+    rows = db.execute('''
+        SELECT category_id, sub_category, origin, brand, COUNT(*)
+        FROM products
+        WHERE status = 'active'
+        GROUP BY category_id, sub_category, origin, brand
+    ''')
+    for category_id, sub_category, origin, brand, count in rows:
+        category_counts[category_id] = category_counts.get(category_id, 0) + count
+        if sub_category:
+            subs = sub_categories.setdefault(str(category_id), {})
+            subs[sub_category] = subs.get(sub_category, 0) + count
+        if origin:
+            origins[origin] = origins.get(origin, 0) + count
+        if brand:
+            brands[brand] = brands.get(brand, 0) + count
+
+    name_column = 'name_ar' if lang == 'ar' else 'name_en'
+    categories = []
+    for row in db.execute('SELECT id, name_ar, name_en, icon FROM categories WHERE status = "active"'):
+        category = dict(zip(('id', 'name_ar', 'name_en', 'icon'), row))
+        category['product_count'] = category_counts.get(category['id'], 0)
+        categories.append(category)
+    categories.sort(key=lambda c: (sort_key(c[name_column]), c['id']))
+
+    return {
+        'categories': categories,
+        'sub_categories': {cid: _facet_list(subs) for cid, subs in sub_categories.items()},
+        'origins': _facet_list(origins),
+        'brands': _facet_list(brands),
+    }
+
+
+def get_facets(db, lang='ar'):
+    """Cached facets for `lang`, rebuilt whenever the catalog version moves"""
+    version = catalog_version(db)
+    cached = _cache.get(lang)
+    if version is not None and cached and cached[0] == version:
+        return cached[1]
+
+    facets = load_facets(db, lang)
+    if version is not None:
+        with _lock:
+            _cache[lang] = (version, facets)
+    return facets
@@ -0,0 +1,42 @@
+"""
+HTTP Caching Helpers for SooqKabeer
+Filename: http_cache.py
+Compact JSON responses with content ETags, conditional 304s and gzip
+"""
+
+import gzip
+import hashlib
+import json
+
+from flask import current_app, request
+
+# Bodies smaller than this are not worth compressing
+GZIP_MIN_SIZE = 500
+
+
+def accepts_gzip():
+    """True when the client advertises gzip in Accept-Encoding"""
+    return 'gzip' in request.accept_encodings
+
+
+def cached_json(payload, max_age=0, private=True):
+    """JSON response with an ETag, answering If-None-Match with 304
+
+    The ETag hashes the uncompressed body; gzip responses get a suffixed tag
+    so caches never hand a compressed body to a client that cannot read it.
+    """
+    body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    etag = hashlib.sha1(body).hexdigest()[:20]
+
+    response = current_app.response_class(body, mimetype='application/json')
+    if len(body) >= GZIP_MIN_SIZE and accepts_gzip():
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+        etag += '-gz'
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.max_age = max_age
+    response.cache_control.must_revalidate = True
+    if private:
+        response.cache_control.private = True
+    return response.make_conditional(request)
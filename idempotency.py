@@ -0,0 +1,234 @@
+"""
+Idempotency Keys for SooqKabeer
+Filename: idempotency.py
+Money-moving POST routes accept an Idempotency-Key header (or a hidden
+idempotency_key form field). The first response for a key is stored for
+IDEMPOTENCY_TTL and replayed on repeats, so retries and double clicks
+never place a second order or withdrawal.
+"""
+
+import hashlib
+import json
+import time
+import uuid
+from functools import wraps
+
+from flask import current_app, flash, jsonify, redirect, request, session, url_for
+
+from database import connection_manager
+from jobs import enqueue, job_handler
+
+HEADER = 'Idempotency-Key'
+FORM_FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 255
+
+# Stored responses are replayed for a day
+IDEMPOTENCY_TTL = 24 * 3600
+
+# A request still marked in progress after this long is assumed to have
+# died, and the next request with its key runs again
+IN_PROGRESS_SECONDS = 60
+
+# A repeated form post (double click) waits this long for the first
+# request's response before falling back to a redirect
+REPLAY_WAIT = 10
+REPLAY_POLL = 0.1
+
+# How often the purge_idempotency_keys job runs
+PURGE_INTERVAL = 3600
+
+# Never replayed: the session cookie belongs to the request being answered
+_SKIP_HEADERS = {'set-cookie', 'content-length'}
+
+
+def ensure_idempotency_keys(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            owner TEXT NOT NULL,
+            key TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'in_progress',
+            response_status INTEGER,
+            response_headers TEXT,
+            response_body BLOB,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (owner, key)
+        ) WITHOUT ROWID
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at)")
+
+
+def new_key():
+    """Fresh key for a form's hidden idempotency_key field"""
+    return uuid.uuid4().hex
+
+
+def request_key():
+    """The client's idempotency key for this request, or None"""
+    key = request.headers.get(HEADER) or request.form.get(FORM_FIELD)
+    return key[:MAX_KEY_LENGTH] if key else None
+
+
+def request_fingerprint():
+    """Hash of what the request asks for; a key reused for anything else is refused"""
+    digest = hashlib.sha256(f'{request.method} {request.path}\n'.encode('utf-8'))
+    digest.update(request.get_data(cache=True, parse_form_data=True))
+    for name, value in sorted(request.form.items(multi=True)):
+        if name != FORM_FIELD:
+            digest.update(f'\n{name}={value}'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+#=== Store ===#
+def reserve(db, owner, key, fingerprint, now=None):
+    """Claim `key` for a new request; returns None, or the row it collides with
+
+    An expired row (finished past its TTL, or stuck in progress) is taken
+    over as if it did not exist.
+    """
+    now = time.time() if now is None else now
+    cursor = db.execute('''
+        INSERT INTO idempotency_keys (owner, key, fingerprint, created_at, expires_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (owner, key) DO UPDATE SET
+            fingerprint = excluded.fingerprint, status = 'in_progress', response_status = NULL,
+            response_headers = NULL, response_body = NULL,
+            created_at = excluded.created_at, expires_at = excluded.expires_at
+        WHERE idempotency_keys.expires_at <= excluded.created_at
+    ''', (owner, key, fingerprint, now, now + IN_PROGRESS_SECONDS))
+    if cursor.rowcount:
+        db.commit()
+        return None
+    row = db.execute("SELECT * FROM idempotency_keys WHERE owner = ? AND key = ?", (owner, key)).fetchone()
+    db.commit()
+    return row
+
+
+def store_response(db, owner, key, response, ttl=IDEMPOTENCY_TTL, now=None):
+    now = time.time() if now is None else now
+    headers = [(name, value) for name, value in response.headers.items()
+               if name.lower() not in _SKIP_HEADERS]
+    db.execute('''
+        UPDATE idempotency_keys
+        SET status = 'done', response_status = ?, response_headers = ?, response_body = ?, expires_at = ?
+        WHERE owner = ? AND key = ?
+    ''', (response.status_code, json.dumps(headers), response.get_data(), now + ttl, owner, key))
+    db.commit()
+
+
+def release(db, owner, key):
+    """Forget a key whose request failed, so the client can retry it"""
+    db.execute("DELETE FROM idempotency_keys WHERE owner = ? AND key = ?", (owner, key))
+    db.commit()
+
+
+def replay_response(row):
+    response = current_app.response_class(row['response_body'], status=row['response_status'],
+                                          headers=json.loads(row['response_headers']))
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def wait_for_response(db, owner, key, timeout=None):
+    """Poll until the key's first request finishes; returns its row
+
+    None means the first request failed and released the key; a row still
+    in progress means the wait timed out.
+    """
+    deadline = time.monotonic() + (REPLAY_WAIT if timeout is None else timeout)
+    while True:
+        row = db.execute("SELECT * FROM idempotency_keys WHERE owner = ? AND key = ?", (owner, key)).fetchone()
+        if row is None or row['status'] == 'done' or time.monotonic() >= deadline:
+            return row
+        time.sleep(REPLAY_POLL)
+
+
+def purge_expired(db, now=None):
+    """Delete expired keys; returns how many"""
+    cursor = db.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?",
+                        (time.time() if now is None else now,))
+    return cursor.rowcount
+
+
+#=== Decorator ===#
+def _session_user():
+    return session.get('user_id')
+
+
+def idempotent(owner=_session_user, ttl=IDEMPOTENCY_TTL, connect=None, result_endpoint=None):
+    """Replay the first stored response for a repeated idempotency key
+
+    Requests without a key (and GETs) run as before. A key reused with a
+    different request gets 422. A repeat that arrives while the first
+    request is still running gets 409 for API clients; a form post (the
+    browser shows whichever response comes last) waits for the first
+    response and replays it, or after REPLAY_WAIT redirects to
+    `result_endpoint` (default: the same URL). Server errors are not
+    stored, so the client may retry them with the same key.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request_key() if request.method == 'POST' else None
+            who = owner() if key else None
+            if who is None:
+                return view(*args, **kwargs)
+            who = str(who)
+
+            db = (connect or connection_manager.connect)()
+            try:
+                fingerprint = request_fingerprint()
+                row = reserve(db, who, key, fingerprint)
+                browser = not request.is_json
+                if (browser and row is not None and row['status'] != 'done'
+                        and row['fingerprint'] == fingerprint):
+                    row = wait_for_response(db, who, key)
+                    if row is None:
+                        # The first request failed and let the key go: run this one
+                        row = reserve(db, who, key, fingerprint)
+                if row is not None:
+                    if row['fingerprint'] != fingerprint:
+                        return jsonify({'success': False,
+                                        'error': 'Idempotency key was already used for a different request'}), 422
+                    if row['status'] != 'done':
+                        if browser:
+                            flash('Your request is still being processed', 'info')
+                            return redirect(url_for(result_endpoint) if result_endpoint else request.path, 303)
+                        response = jsonify({'success': False,
+                                            'error': 'A request with this idempotency key is in progress'})
+                        response.status_code = 409
+                        response.headers['Retry-After'] = '1'
+                        return response
+                    return replay_response(row)
+
+                try:
+                    response = current_app.make_response(view(*args, **kwargs))
+                except BaseException:
+                    release(db, who, key)
+                    raise
+                if response.status_code >= 500:
+                    release(db, who, key)
+                else:
+                    store_response(db, who, key, response, ttl)
+                return response
+            finally:
+                db.close()
+        return wrapper
+    return decorator
+
+
+#=== Cleanup ===#
+def schedule_purge(db, now=None):
+    """Queue the next purge_idempotency_keys run (once per interval slot)"""
+    now = time.time() if now is None else now
+    slot = int(now // PURGE_INTERVAL) + 1
+    enqueue(db, 'purge_idempotency_keys', dedupe_key=f'purge_idempotency_keys:{slot}',
+            delay=slot * PURGE_INTERVAL - now)
+
+
+@job_handler('purge_idempotency_keys')
+def purge_idempotency_keys_job(db, payload):
+    """Delete expired keys, then queue the next run"""
+    purge_expired(db)
+    schedule_purge(db)
@@ -0,0 +1,192 @@
+"""
+Background Job Queue for SooqKabeer
+Filename: jobs.py
+SQLite-backed queue for side effects that should not hold up a response
+(commission posting, stat updates, notification emails). Jobs are
+enqueued inside the caller's transaction, claimed with a lease, retried
+with exponential backoff and delivered at least once, so every handler
+must be idempotent.
+"""
+
+import json
+import os
+import socket
+import time
+
+# A running job whose worker has not finished within this many seconds is
+# assumed dead and handed to another worker
+LEASE_SECONDS = 300
+
+# Backoff between attempts: RETRY_BASE * 2^(attempt-1), capped at RETRY_MAX
+RETRY_BASE = 10
+RETRY_MAX = 3600
+DEFAULT_MAX_ATTEMPTS = 5
+
+HANDLERS = {}
+
+
+def job_handler(kind):
+    """Register `fn(db, payload)` as the handler for jobs of `kind`"""
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def ensure_jobs_table(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL DEFAULT '{}',
+            dedupe_key TEXT UNIQUE,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            run_after REAL NOT NULL,
+            locked_by TEXT,
+            locked_until REAL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(status, run_after)")
+
+
+def enqueue(db, kind, payload=None, dedupe_key=None, delay=0, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Queue a job in the caller's transaction; returns its id (None if deduplicated)
+
+    A job with the same dedupe_key is only ever queued once.
+    """
+    cursor = db.execute('''
+        INSERT OR IGNORE INTO jobs (kind, payload, dedupe_key, max_attempts, run_after)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (kind, json.dumps(payload or {}), dedupe_key, max_attempts, time.time() + delay))
+    return cursor.lastrowid if cursor.rowcount else None
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(db, worker, now=None):
+    """Lease the next due job to `worker`; returns the row or None"""
+    now = time.time() if now is None else now
+    db.commit()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        job = db.execute('''
+            SELECT * FROM jobs
+            WHERE (status = 'pending' AND run_after <= ?)
+               OR (status = 'running' AND locked_until < ?)
+            ORDER BY run_after, id LIMIT 1
+        ''', (now, now)).fetchone()
+        if job is not None:
+            db.execute('''
+                UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                                locked_by = ?, locked_until = ?
+                WHERE id = ?
+            ''', (worker, now + LEASE_SECONDS, job['id']))
+            job = db.execute("SELECT * FROM jobs WHERE id = ?", (job['id'],)).fetchone()
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return job
+
+
+def retry_delay(attempts):
+    return min(RETRY_BASE * 2 ** max(attempts - 1, 0), RETRY_MAX)
+
+
+def run_job(db, job, worker=None):
+    """Run one claimed job; returns its new status
+
+    The handler's writes and the 'done' marker commit together, so database
+    side effects land once per job. On an error they roll back and the job
+    is rescheduled, or marked failed once max_attempts is reached. A handler
+    may return a callable, run only after that commit (e.g. dropping cached
+    copies of the rows it changed).
+    """
+    handler = HANDLERS.get(job['kind'])
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for job kind '{job['kind']}'")
+        db.execute("BEGIN")
+        after_commit = handler(db, json.loads(job['payload']))
+        cursor = db.execute('''
+            UPDATE jobs SET status = 'done', locked_by = NULL, locked_until = NULL,
+                            last_error = NULL, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'running' AND locked_by IS ?
+        ''', (job['id'], worker or job['locked_by']))
+        if cursor.rowcount == 0:
+            # The lease ran out and another worker took the job over; drop
+            # this run's writes and let that worker's run count
+            db.rollback()
+            return 'lost'
+        db.commit()
+        if callable(after_commit):
+            after_commit()
+        return 'done'
+    except Exception as e:
+        if db.in_transaction:
+            db.rollback()
+        status = 'failed' if job['attempts'] >= job['max_attempts'] else 'pending'
+        db.execute('''
+            UPDATE jobs SET status = ?, run_after = ?, locked_by = NULL, locked_until = NULL,
+                            last_error = ?
+            WHERE id = ?
+        ''', (status, time.time() + retry_delay(job['attempts']), f'{type(e).__name__}: {e}', job['id']))
+        db.commit()
+        print(f"✗ Job {job['id']} ({job['kind']}) attempt {job['attempts']} failed: {str(e)}")
+        return status
+
+
+def run_pending(db, worker=None, limit=None):
+    """Run due jobs until none are left (or `limit` ran); returns {status: count}"""
+    worker = worker or worker_name()
+    results = {}
+    while limit is None or sum(results.values()) < limit:
+        job = claim(db, worker)
+        if job is None:
+            break
+        status = run_job(db, job, worker)
+        results[status] = results.get(status, 0) + 1
+    return results
+
+
+def work(db, poll_interval=2.0, stop=None):
+    """Worker loop: drain due jobs, then sleep; runs until stop() is true"""
+    worker = worker_name()
+    while not (stop and stop()):
+        if not run_pending(db, worker):
+            time.sleep(poll_interval)
+
+
+#=== Inspection ===#
+def list_jobs(db, status=None, limit=20):
+    if status:
+        return db.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?",
+                          (status, limit)).fetchall()
+    return db.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+
+
+def job_counts(db):
+    return dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+def replay(db, job_ids=None, failed=False):
+    """Queue jobs again from a fresh attempt count; returns how many"""
+    if failed:
+        cursor = db.execute('''
+            UPDATE jobs SET status = 'pending', attempts = 0, run_after = ?, finished_at = NULL
+            WHERE status = 'failed'
+        ''', (time.time(),))
+    else:
+        cursor = db.executemany('''
+            UPDATE jobs SET status = 'pending', attempts = 0, run_after = ?, finished_at = NULL
+            WHERE id = ? AND status != 'running'
+        ''', [(time.time(), job_id) for job_id in job_ids or ()])
+    db.commit()
+    return cursor.rowcount
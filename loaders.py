@@ -0,0 +1,86 @@
+"""
+Batched Relationship Loaders for SooqKabeer
+Filename: loaders.py
+Fetch child rows for a whole page of parent rows with one IN (...) query
+instead of one query per row
+"""
+
+# SQLite limits bound parameters per statement; stay well below it
+MAX_IN_PARAMS = 500
+
+
+def _chunks(values, size=MAX_IN_PARAMS):
+    """Split a list into parameter-sized chunks"""
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _unique(values):
+    """Unique, non-null values preserving order"""
+    seen = set()
+    result = []
+    for value in values:
+        if value is not None and value not in seen:
+            seen.add(value)
+            result.append(value)
+    return result
+
+
+def fetch_by_ids(db, table, ids, columns='*', id_column='id'):
+    """Fetch rows of `table` for many ids at once, keyed by id"""
+    ids = _unique(ids)
+    found = {}
+    for chunk in _chunks(ids):
+        placeholders = ', '.join('?' * len(chunk))
+        rows = db.execute(
+            f"SELECT {columns} FROM {table} WHERE {id_column} IN ({placeholders})",
+            chunk
+        ).fetchall()
+        for row in rows:
+            found[row[id_column]] = row
+    return found
+
+
+def load_related(db, rows, table, foreign_key, attach_as, columns='*',
+                 order_by=None, key='id', transform=None):
+    """Attach child rows from `table` to each parent row (a dict)
+
+    All children for the page are loaded with one query per
+    MAX_IN_PARAMS parents. Each parent gets a list under `attach_as`,
+    empty when it has no children. `transform` maps a child row to the
+    value stored in that list (defaults to a plain dict).
+    """
+    for row in rows:
+        row[attach_as] = []
+    if not rows:
+        return rows
+
+    by_key = {}
+    for row in rows:
+        by_key.setdefault(row.get(key), []).append(row)
+
+    select_columns = columns if columns == '*' else f"{foreign_key}, {columns}"
+    order_clause = f" ORDER BY {order_by}" if order_by else ""
+    transform = transform or dict
+
+    for chunk in _chunks(_unique(by_key.keys())):
+        placeholders = ', '.join('?' * len(chunk))
+        children = db.execute(
+            f"SELECT {select_columns} FROM {table} "
+            f"WHERE {foreign_key} IN ({placeholders}){order_clause}",
+            chunk
+        ).fetchall()
+        for child in children:
+            value = transform(child)
+            for parent in by_key.get(child[foreign_key], []):
+                parent[attach_as].append(value)
+    return rows
+
+
+def load_product_images(db, products, key='id'):
+    """Attach an `images` list of URLs (main image first) to each product"""
+    return load_related(db, products, 'product_images', 'product_id', 'images',
+                        columns='image_url',
+                        order_by='is_main DESC',
+                        key=key,
+                        transform=lambda child: child['image_url'])
@@ -0,0 +1,366 @@
+"""
+Schema Migrations for SooqKabeer
+Filename: migrations.py
+Ordered, versioned schema changes recorded in schema_migrations and applied
+at deploy time (flask migrate / init_database), plus a cached description
+of the resulting tables so request handlers never introspect the schema
+"""
+
+import sqlite3
+import threading
+
+from arabic_normalize import backfill_normalized_columns, ensure_normalized_columns
+from cart_store import ensure_cart_items
+from commission_engine import ensure_commission_settings
+from db_indexes import apply_index_migrations
+from facets import ensure_facet_triggers
+from idempotency import ensure_idempotency_keys
+from jobs import ensure_jobs_table
+from product_listing import ensure_product_listing
+from ratings import ensure_rating_stats
+from referral_stats import ensure_referral_stats
+from referral_tree import ensure_referral_tree
+from search_index import ensure_search_index
+from wallet import ensure_wallet_ledger
+
+#=== Baseline tables (previously created inline by init_database/init_db) ===#
+BASELINE_TABLES = (
+    '''CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        phone TEXT,
+        role TEXT DEFAULT 'customer',
+        referral_code TEXT UNIQUE,
+        referred_by TEXT,
+        wallet_balance REAL DEFAULT 0,
+        total_commission REAL DEFAULT 0,
+        direct_referrals INTEGER DEFAULT 0,
+        indirect_referrals INTEGER DEFAULT 0,
+        total_orders INTEGER DEFAULT 0,
+        total_spent REAL DEFAULT 0,
+        is_active INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_login TIMESTAMP
+    )''',
+    '''CREATE TABLE IF NOT EXISTS vendors (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        phone TEXT,
+        country_code TEXT DEFAULT '+965',
+        nationality TEXT,
+        shop_name TEXT NOT NULL,
+        business_name TEXT,
+        business_type TEXT,
+        cr_number TEXT UNIQUE,
+        vat_number TEXT,
+        address TEXT,
+        governorate TEXT,
+        block TEXT,
+        street TEXT,
+        building TEXT,
+        floor TEXT,
+        unit TEXT,
+        business_description TEXT,
+        civil_id TEXT,
+        civil_id_path TEXT,
+        civil_id_back_path TEXT,
+        commercial_license_path TEXT,
+        vendor_code TEXT NOT NULL UNIQUE,
+        status TEXT DEFAULT 'pending',
+        agree_terms TEXT DEFAULT 'no',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''',
+    '''CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name_en TEXT NOT NULL,
+        name_ar TEXT NOT NULL,
+        description_en TEXT,
+        description_ar TEXT,
+        price REAL NOT NULL,
+        unit TEXT DEFAULT 'kg',
+        category TEXT,
+        image_url TEXT,
+        stock_quantity REAL DEFAULT 0,
+        vendor_id INTEGER,
+        is_active INTEGER DEFAULT 1,
+        views INTEGER DEFAULT 0,
+        total_sales INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (vendor_id) REFERENCES users (id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        total_price REAL NOT NULL,
+        status TEXT DEFAULT 'pending',
+        shipping_address TEXT,
+        notes TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS order_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity REAL NOT NULL,
+        unit_price REAL NOT NULL,
+        total_price REAL NOT NULL,
+        FOREIGN KEY (order_id) REFERENCES orders (id) ON DELETE CASCADE,
+        FOREIGN KEY (product_id) REFERENCES products (id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS referrals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        referrer_id INTEGER NOT NULL,
+        referred_id INTEGER NOT NULL,
+        level INTEGER DEFAULT 1,
+        commission_rate REAL DEFAULT 0.05,
+        status TEXT DEFAULT 'active',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(referrer_id, referred_id),
+        FOREIGN KEY (referrer_id) REFERENCES users (id),
+        FOREIGN KEY (referred_id) REFERENCES users (id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS commissions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        order_id INTEGER,
+        referred_user_id INTEGER,
+        amount REAL NOT NULL,
+        commission_rate REAL NOT NULL,
+        type TEXT,
+        status TEXT DEFAULT 'pending',
+        description TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        paid_at TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        FOREIGN KEY (order_id) REFERENCES orders (id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS withdrawals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        method TEXT,
+        account_details TEXT,
+        status TEXT DEFAULT 'pending',
+        transaction_id TEXT,
+        notes TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        processed_at TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS categories (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name_en TEXT NOT NULL,
+        name_ar TEXT NOT NULL,
+        description TEXT,
+        parent_id INTEGER DEFAULT NULL,
+        icon TEXT,
+        image TEXT,
+        sort_order INTEGER DEFAULT 0,
+        status TEXT DEFAULT 'active',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''',
+    '''CREATE TABLE IF NOT EXISTS admin_users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        full_name TEXT NOT NULL,
+        role TEXT DEFAULT 'admin',
+        permissions TEXT,
+        last_login TIMESTAMP,
+        status TEXT DEFAULT 'active',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''',
+)
+
+
+def _columns(db, table):
+    return {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_missing_columns(db, table, columns):
+    existing = _columns(db, table)
+    for name, decl in columns:
+        if name not in existing:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+
+#=== Migration steps ===#
+def _baseline(db):
+    for statement in BASELINE_TABLES:
+        db.execute(statement)
+    # Default admin user (password: admin123) and the fallback category
+    db.execute('''
+        INSERT OR IGNORE INTO admin_users (username, email, password, full_name, role, status)
+        VALUES ('admin', 'admin@sooqkabeer.com',
+                '5e884898da28047151d0e56f8dc6292773603d0d6aabbdd62a11ef721d1542d8',
+                'Administrator', 'admin', 'active')
+    ''')
+    db.execute("INSERT OR IGNORE INTO categories (id, name_ar, name_en) VALUES (1, 'General', 'General')")
+
+
+def _created_at_columns(db):
+    # Older databases predate users/orders.created_at. ALTER TABLE cannot add
+    # a CURRENT_TIMESTAMP default, so existing rows are stamped instead.
+    for table in ('users', 'orders'):
+        if 'created_at' not in _columns(db, table):
+            db.execute(f"ALTER TABLE {table} ADD COLUMN created_at TIMESTAMP")
+            db.execute(f"UPDATE {table} SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+
+
+def _product_stock_and_image(db):
+    # Columns the old second init_db() products table had and the routes use
+    _add_missing_columns(db, 'products', (('stock', 'INTEGER DEFAULT 0'), ('main_image', 'TEXT')))
+
+
+def _normalized_text_keys(db):
+    ensure_normalized_columns(db)
+    backfill_normalized_columns(db)
+
+
+def _secondary_indexes(db):
+    apply_index_migrations(db)
+
+
+def _jobs(db):
+    ensure_jobs_table(db)
+    # idx_commissions_order backs the posted-already check in the commission job
+    apply_index_migrations(db)
+
+
+def _wishlist(db):
+    # The products page counts the user's wishlist; nothing created the table
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS wishlist (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (user_id, product_id),
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        )
+    ''')
+    # idx_wishlist_user was skipped until now
+    apply_index_migrations(db)
+
+
+# (version, name, step). Append only: never renumber or edit a released step,
+# add a new one instead. Steps must tolerate databases that already have the
+# change (every pre-migration install ran the ensure_* helpers at startup).
+MIGRATIONS = (
+    (1, 'baseline_tables', _baseline),
+    (2, 'users_orders_created_at', _created_at_columns),
+    (3, 'products_stock_main_image', _product_stock_and_image),
+    (4, 'normalized_text_keys', _normalized_text_keys),
+    (5, 'search_index', ensure_search_index),
+    (6, 'rating_stats', ensure_rating_stats),
+    (7, 'facet_triggers', ensure_facet_triggers),
+    (8, 'product_listing', ensure_product_listing),
+    (9, 'secondary_indexes', _secondary_indexes),
+    (10, 'cart_items', ensure_cart_items),
+    (11, 'jobs', _jobs),
+    (12, 'idempotency_keys', ensure_idempotency_keys),
+    (13, 'referral_tree', ensure_referral_tree),
+    (14, 'commission_settings', ensure_commission_settings),
+    (15, 'wallet_ledger', ensure_wallet_ledger),
+    (16, 'referral_stats', ensure_referral_stats),
+    (17, 'vendor_rating_moves', ensure_rating_stats),
+    (18, 'wishlist', _wishlist),
+)
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+#=== Runner ===#
+def applied_versions(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    return {row[0] for row in db.execute("SELECT version FROM schema_migrations")}
+
+
+def schema_version(db):
+    """Highest applied migration version (0 for an empty database)"""
+    done = applied_versions(db)
+    return max(done) if done else 0
+
+
+def pending_migrations(db):
+    done = applied_versions(db)
+    return [(version, name) for version, name, _ in MIGRATIONS if version not in done]
+
+
+def apply_migrations(db, target=None):
+    """Apply pending steps up to `target`, each in its own transaction
+
+    Returns the names applied. BEGIN IMMEDIATE takes the write lock up front
+    so two deploys racing on the same database apply each step once.
+    """
+    db.commit()
+    applied = []
+    for version, name, step in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if version in applied_versions(db):
+                db.rollback()
+                continue
+            step(db)
+            db.execute("INSERT INTO schema_migrations (version, name) VALUES (?, ?)", (version, name))
+            db.commit()
+        except sqlite3.Error:
+            db.rollback()
+            raise
+        applied.append(name)
+    refresh_schema(db)
+    return applied
+
+
+#=== Cached schema description ===#
+_schema = None
+_schema_lock = threading.Lock()
+
+
+def describe_schema(db):
+    """{table: (column, ...)} for every table and view, read from the database"""
+    names = [row[0] for row in db.execute(
+        "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') "
+        "AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+    return {name: tuple(row[1] for row in db.execute(f'PRAGMA table_info("{name}")')) for name in names}
+
+
+def refresh_schema(db):
+    """Re-read the schema description (after migrations)"""
+    global _schema
+    description = describe_schema(db)
+    with _schema_lock:
+        _schema = description
+    return description
+
+
+def get_schema(db):
+    """Cached schema description; read from the database once per process"""
+    if _schema is None:
+        return refresh_schema(db)
+    return _schema
+
+
+def has_table(db, table):
+    return table in get_schema(db)
+
+
+def table_columns(db, table):
+    """Cached column names of `table` (empty tuple when it does not exist)"""
+    return get_schema(db).get(table, ())
@@ -5,9 +5,11 @@ Standardized with proper relationships and password hashing
 """
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 import secrets
+from arabic_normalize import product_text_keys
 
 db = SQLAlchemy()
 
@@ -127,6 +129,11 @@ class Product(db.Model):
     barcode = db.Column(db.String(100))
     image = db.Column(db.String(200), default='default_product.jpg')
     status = db.Column(db.String(20), default='active')
+
+    # Normalized search/sort keys (see arabic_normalize.py)
+    search_text = db.Column(db.Text)
+    sort_key_ar = db.Column(db.String(200))
+    sort_key_en = db.Column(db.String(200))
     
     # Foreign Keys
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
@@ -156,6 +163,20 @@ class Product(db.Model):
             return self.description_bn
         return self.description_ar
 
+@event.listens_for(Product, 'before_insert')
+@event.listens_for(Product, 'before_update')
+def set_product_text_keys(mapper, connection, target):
+    """Compute normalized search/sort keys whenever product text is written"""
+    keys = product_text_keys({
+        'name_ar': target.name_ar,
+        'name_en': target.name_en,
+        'description_ar': target.description_ar,
+        'description_en': target.description_en,
+    })
+    target.search_text = keys['search_text']
+    target.sort_key_ar = keys['sort_key_ar']
+    target.sort_key_en = keys['sort_key_en']
+
 class Vendor(db.Model):
     """Vendor Model"""
     __tablename__ = 'vendors'
@@ -0,0 +1,98 @@
+"""
+Order Placement for SooqKabeer
+Filename: orders.py
+Turns a cart into an order inside one BEGIN IMMEDIATE transaction:
+batched inserts, conditional stock decrements checked by rowcount, and
+all-or-nothing rollback when any line cannot be filled. Buyer and product
+sales counters are recounted afterwards by the order_stats job.
+"""
+
+from cart_store import clear_cart, price_cart
+
+
+class CheckoutError(Exception):
+    """The order was rejected and nothing was written"""
+
+
+class OutOfStock(CheckoutError):
+    """One or more cart lines exceed the stock left"""
+
+    def __init__(self, product_ids):
+        self.product_ids = list(product_ids)
+        super().__init__(f"Insufficient stock for product ID: {', '.join(map(str, self.product_ids))}")
+
+
+def place_order(db, user_id, shipping_address, notes='', items=None, on_placed=None):
+    """Create an order for `user_id` from their cart; returns (order_id, total)
+
+    With items=None the customer's stored cart_items are used (and emptied);
+    otherwise `items` is a session cart list. `on_placed(order_id)` runs
+    inside the same transaction (it queues the follow-up jobs), so a failure
+    there rolls the whole order back too.
+    """
+    db.commit()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        lines, total = price_cart(db, user_id=user_id if items is None else None, items=items)
+        if not lines:
+            raise CheckoutError('Cart is empty')
+
+        short = [line['product']['id'] for line in lines if not line['in_stock']]
+        if short:
+            raise OutOfStock(short)
+
+        # The write lock is held, but the decrement still refuses to go
+        # below zero; a rowcount short of the line count rejects the order
+        cursor = db.executemany('''
+            UPDATE products
+            SET stock_quantity = stock_quantity - ?
+            WHERE id = ? AND stock_quantity >= ?
+        ''', [(line['quantity'], line['product']['id'], line['quantity']) for line in lines])
+        if cursor.rowcount != len(lines):
+            raise OutOfStock(line['product']['id'] for line in lines)
+
+        order_id = db.execute('''
+            INSERT INTO orders (user_id, total_price, shipping_address, notes, status)
+            VALUES (?, ?, ?, ?, 'pending')
+        ''', (user_id, total, shipping_address, notes)).lastrowid
+
+        db.executemany('''
+            INSERT INTO order_items (order_id, product_id, quantity, unit_price, total_price)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(order_id, line['product']['id'], line['quantity'], line['product']['price'],
+               line['item_total']) for line in lines])
+
+        if items is None:
+            clear_cart(db, user_id)
+        if on_placed is not None:
+            on_placed(order_id)
+
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return order_id, total
+
+
+def refresh_order_stats(db, order_id):
+    """Recount the buyer's order totals and the ordered products' sales
+
+    Counts are rebuilt from orders/order_items rather than incremented, so
+    running this twice for the same order changes nothing. Returns the
+    buyer's user id (None if the order is gone).
+    """
+    order = db.execute("SELECT user_id FROM orders WHERE id = ?", (order_id,)).fetchone()
+    if order is None:
+        return None
+    db.execute('''
+        UPDATE users
+        SET total_orders = (SELECT COUNT(*) FROM orders WHERE user_id = users.id),
+            total_spent = (SELECT COALESCE(SUM(total_price), 0) FROM orders WHERE user_id = users.id)
+        WHERE id = ?
+    ''', (order['user_id'],))
+    db.execute('''
+        UPDATE products
+        SET total_sales = (SELECT COUNT(*) FROM order_items WHERE product_id = products.id)
+        WHERE id IN (SELECT product_id FROM order_items WHERE order_id = ?)
+    ''', (order_id,))
+    return order['user_id']
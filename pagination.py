@@ -0,0 +1,77 @@
+"""
+Keyset (Seek) Pagination Helpers for SooqKabeer
+Filename: pagination.py
+Cursor tokens and SQL fragments for paging by (sort key, id) instead of OFFSET
+"""
+
+import base64
+import binascii
+import json
+
+
+def encode_cursor(sort, values, direction='next'):
+    """Opaque cursor token for the row holding `values` under sort `sort`"""
+    payload = json.dumps({'s': sort, 'v': list(values), 'd': direction},
+                         separators=(',', ':'), ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, sort=None, columns=None):
+    """Decode a cursor token; None when missing, malformed or for another sort
+
+    Values must be scalars, and exactly `columns` of them when given, so
+    they always bind cleanly into keyset_condition().
+    """
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        values = data['v']
+        direction = data.get('d', 'next')
+    except (ValueError, KeyError, TypeError, binascii.Error, UnicodeError):
+        return None
+    if not isinstance(values, list) or direction not in ('next', 'prev'):
+        return None
+    if columns is not None and len(values) != columns:
+        return None
+    if not all(value is None or isinstance(value, (str, int, float)) for value in values):
+        return None
+    if sort is not None and data.get('s') != sort:
+        return None
+    return {'sort': data.get('s'), 'values': values, 'direction': direction}
+
+
+def _descending(descending, direction):
+    # Walking backwards reverses the scan order
+    return descending != (direction == 'prev')
+
+
+def keyset_condition(columns, descending, values, direction='next'):
+    """Row-value predicate selecting rows after (or before) the cursor row
+
+    Returns (sql, params). `columns` must end with a unique column (the id)
+    and all columns share one sort direction.
+    """
+    op = '<' if _descending(descending, direction) else '>'
+    placeholders = ', '.join('?' * len(columns))
+    return f"({', '.join(columns)}) {op} ({placeholders})", list(values)
+
+
+def keyset_order_by(columns, descending, direction='next'):
+    """ORDER BY list matching keyset_condition()"""
+    order = 'DESC' if _descending(descending, direction) else 'ASC'
+    return ', '.join(f"{col} {order}" for col in columns)
+
+
+def keyset_page(rows, limit, direction='next'):
+    """Trim a `limit + 1` fetch to one page in display order
+
+    Returns (rows, has_more) where has_more says whether rows exist beyond
+    this page in the direction that was walked.
+    """
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == 'prev':
+        rows.reverse()
+    return rows, has_more
@@ -0,0 +1,214 @@
+"""
+Product Listing Read Model for SooqKabeer
+Filename: product_listing.py
+Denormalized product_listing table holding one ready-to-render card per
+product, kept in sync by triggers on products, categories, vendors,
+product_images and product_rating_stats
+"""
+
+from arabic_normalize import ensure_normalized_columns
+from ratings import ensure_rating_stats
+
+LISTING_TABLE = 'product_listing'
+
+# (column, type, expression over products p / categories c / vendors v /
+# product_rating_stats pr). Filter and sort columns come first, then the card.
+LISTING_COLUMNS = (
+    ('id', 'INTEGER PRIMARY KEY', 'p.id'),
+    ('status', 'TEXT', 'p.status'),
+    ('stock_quantity', 'REAL', 'p.stock_quantity'),
+    ('category_id', 'INTEGER', 'p.category_id'),
+    ('sub_category', 'TEXT', 'p.sub_category'),
+    ('origin', 'TEXT', 'p.origin'),
+    ('brand', 'TEXT', 'p.brand'),
+    ('vendor_id', 'INTEGER', 'p.vendor_id'),
+    ('created_at', 'TIMESTAMP', 'p.created_at'),
+    ('sort_key_ar', 'TEXT', "COALESCE(p.sort_key_ar, '')"),
+    ('sort_key_en', 'TEXT', "COALESCE(p.sort_key_en, '')"),
+    ('sort_price', 'REAL', 'COALESCE(p.sale_price, 0)'),
+    ('name_ar', 'TEXT', 'p.name_ar'),
+    ('name_en', 'TEXT', 'p.name_en'),
+    ('description_ar', 'TEXT', 'substr(COALESCE(p.description_ar, p.desc_ar), 1, 100)'),
+    ('description_en', 'TEXT', 'substr(COALESCE(p.description_en, p.desc_en), 1, 100)'),
+    ('unit', 'TEXT', 'p.unit'),
+    ('stock', 'INTEGER', 'p.stock'),
+    ('price', 'REAL', 'p.price'),
+    ('sale_price', 'REAL', 'p.sale_price'),
+    ('retail_price', 'REAL', 'p.retail_price'),
+    ('discount_price', 'REAL', 'p.discount_price'),
+    ('b2b_price', 'REAL', 'p.b2b_price'),
+    ('discount_percent', 'INTEGER', '''CASE WHEN p.retail_price > p.sale_price AND p.sale_price > 0
+                                        THEN CAST(((p.retail_price - p.sale_price) * 1.0 / p.retail_price) * 100 AS INTEGER)
+                                        ELSE 0 END'''),
+    ('image', 'TEXT', 'p.image'),
+    ('main_image', 'TEXT', '''(SELECT image_url FROM product_images
+                                WHERE product_id = p.id ORDER BY is_main DESC, id LIMIT 1)'''),
+    ('category_name_ar', 'TEXT', 'c.name_ar'),
+    ('category_name_en', 'TEXT', 'c.name_en'),
+    ('vendor_name', 'TEXT', 'v.shop_name'),
+    ('vendor_rating', 'REAL', 'v.rating'),
+    ('product_rating', 'REAL', 'COALESCE(pr.average_rating, 0)'),
+    ('review_count', 'INTEGER', 'COALESCE(pr.review_count, 0)'),
+)
+
+# products columns read above, with the type to add them as when missing
+SOURCE_COLUMNS = {
+    'status': 'TEXT', 'stock_quantity': 'REAL', 'category_id': 'INTEGER',
+    'sub_category': 'TEXT', 'origin': 'TEXT', 'brand': 'TEXT',
+    'price': 'REAL', 'sale_price': 'REAL', 'retail_price': 'REAL', 'discount_price': 'REAL',
+    'b2b_price': 'REAL', 'description_ar': 'TEXT', 'description_en': 'TEXT',
+    'desc_ar': 'TEXT', 'desc_en': 'TEXT', 'unit': 'TEXT', 'stock': 'INTEGER',
+    'image': 'TEXT',
+}
+
+# Storefront predicate; the partial indexes below only cover these rows
+VISIBLE = "status = 'active' AND stock_quantity > 0"
+
+LISTING_INDEXES = {
+    'idx_listing_newest': 'created_at, id',
+    'idx_listing_category_newest': 'category_id, created_at, id',
+    'idx_listing_price': 'sort_price, id',
+    'idx_listing_category_price': 'category_id, sort_price, id',
+    'idx_listing_name_ar': 'sort_key_ar, id',
+    'idx_listing_name_en': 'sort_key_en, id',
+}
+
+LISTING_TRIGGERS = (
+    'products_listing_ai', 'products_listing_au', 'products_listing_ad',
+    'categories_listing_ai', 'categories_listing_au', 'categories_listing_ad',
+    'vendors_listing_ai', 'vendors_listing_au', 'vendors_listing_ad',
+    'rating_stats_listing_ai', 'rating_stats_listing_au', 'rating_stats_listing_ad',
+    'product_images_listing_ai', 'product_images_listing_au', 'product_images_listing_ad',
+)
+
+
+def _listing_select(where=''):
+    """SELECT producing product_listing rows, optionally for one product"""
+    expressions = ',\n               '.join(expr for _, _, expr in LISTING_COLUMNS)
+    return f'''
+        SELECT {expressions}
+        FROM products p
+        LEFT JOIN categories c ON c.id = p.category_id
+        LEFT JOIN vendors v ON v.id = p.vendor_id
+        LEFT JOIN product_rating_stats pr ON pr.product_id = p.id
+        {where}
+    '''
+
+
+def _refresh_sql(product_id):
+    """Statement re-projecting one product"""
+    columns = ', '.join(name for name, _, _ in LISTING_COLUMNS)
+    return (f"INSERT OR REPLACE INTO {LISTING_TABLE} ({columns})"
+            + _listing_select(f'WHERE p.id = {product_id}') + ';')
+
+
+def _main_image_sql(product_id):
+    return f'''
+        UPDATE {LISTING_TABLE} SET main_image = (
+            SELECT image_url FROM product_images
+            WHERE product_id = {product_id} ORDER BY is_main DESC, id LIMIT 1
+        ) WHERE id = {product_id};
+    '''
+
+
+def drop_product_listing(db):
+    """Drop the read model and its triggers"""
+    for trigger in LISTING_TRIGGERS:
+        db.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    db.execute(f"DROP TABLE IF EXISTS {LISTING_TABLE}")
+
+
+def _ensure_sources(db):
+    """Create/extend the source tables the projection reads"""
+    ensure_normalized_columns(db)
+    ensure_rating_stats(db)
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS product_images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL,
+            image_url TEXT NOT NULL,
+            is_main INTEGER DEFAULT 0
+        )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_product_images_product ON product_images(product_id, is_main)")
+    existing = {row[1] for row in db.execute("PRAGMA table_info(products)")}
+    for col, col_type in SOURCE_COLUMNS.items():
+        if col not in existing:
+            db.execute(f"ALTER TABLE products ADD COLUMN {col} {col_type}")
+
+
+def ensure_product_listing(db):
+    """Create the read model, its indexes and sync triggers, filling it on first run
+
+    A table built with a different column set is dropped and rebuilt.
+    """
+    _ensure_sources(db)
+
+    existing = tuple(row[1] for row in db.execute(f"PRAGMA table_info({LISTING_TABLE})"))
+    expected = tuple(name for name, _, _ in LISTING_COLUMNS)
+    if existing and existing != expected:
+        drop_product_listing(db)
+        existing = ()
+
+    column_defs = ',\n            '.join(f'{name} {col_type}' for name, col_type, _ in LISTING_COLUMNS)
+    db.execute(f"CREATE TABLE IF NOT EXISTS {LISTING_TABLE} (\n            {column_defs}\n        )")
+    for name, columns in LISTING_INDEXES.items():
+        db.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {LISTING_TABLE}({columns}) WHERE {VISIBLE}")
+
+    # Products: re-project the row when any projected column changes, so
+    # view counters and other untracked columns never rewrite it
+    watched = ', '.join(c for c in ('name_ar', 'name_en', 'sort_key_ar', 'sort_key_en', 'vendor_id',
+                                    'created_at', *SOURCE_COLUMNS))
+    triggers = {
+        'products_listing_ai': ('AFTER INSERT ON products', _refresh_sql('new.id')),
+        'products_listing_au': (f'AFTER UPDATE OF {watched} ON products', _refresh_sql('new.id')),
+        'products_listing_ad': ('AFTER DELETE ON products',
+                                f'DELETE FROM {LISTING_TABLE} WHERE id = old.id;'),
+    }
+
+    # Categories and vendors: copy the display fields onto their products
+    for source, key, fields in (('categories', 'category_id', {'category_name_ar': 'name_ar',
+                                                               'category_name_en': 'name_en'}),
+                                ('vendors', 'vendor_id', {'vendor_name': 'shop_name',
+                                                          'vendor_rating': 'rating'})):
+        copy = ', '.join(f'{target} = new.{col}' for target, col in fields.items())
+        clear = ', '.join(f'{target} = NULL' for target in fields)
+        triggers[f'{source}_listing_ai'] = (
+            f'AFTER INSERT ON {source}',
+            f'UPDATE {LISTING_TABLE} SET {copy} WHERE {key} = new.id;')
+        triggers[f'{source}_listing_au'] = (
+            f"AFTER UPDATE OF {', '.join(fields.values())} ON {source}",
+            f'UPDATE {LISTING_TABLE} SET {copy} WHERE {key} = new.id;')
+        triggers[f'{source}_listing_ad'] = (
+            f'AFTER DELETE ON {source}',
+            f'UPDATE {LISTING_TABLE} SET {clear} WHERE {key} = old.id;')
+
+    # Review aggregates (themselves trigger-maintained, see ratings.py)
+    copy_rating = (f'UPDATE {LISTING_TABLE} SET product_rating = new.average_rating, '
+                   f'review_count = new.review_count WHERE id = new.product_id;')
+    triggers['rating_stats_listing_ai'] = ('AFTER INSERT ON product_rating_stats', copy_rating)
+    triggers['rating_stats_listing_au'] = ('AFTER UPDATE ON product_rating_stats', copy_rating)
+    triggers['rating_stats_listing_ad'] = (
+        'AFTER DELETE ON product_rating_stats',
+        f'UPDATE {LISTING_TABLE} SET product_rating = 0, review_count = 0 WHERE id = old.product_id;')
+
+    # Main image
+    triggers['product_images_listing_ai'] = ('AFTER INSERT ON product_images', _main_image_sql('new.product_id'))
+    triggers['product_images_listing_au'] = (
+        'AFTER UPDATE ON product_images',
+        _main_image_sql('old.product_id') + _main_image_sql('new.product_id'))
+    triggers['product_images_listing_ad'] = ('AFTER DELETE ON product_images', _main_image_sql('old.product_id'))
+
+    for name, (event, body) in triggers.items():
+        db.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+
+    if not existing:
+        rebuild_product_listing(db)
+
+
+def rebuild_product_listing(db):
+    """Re-project every product; returns the number of rows"""
+    columns = ', '.join(name for name, _, _ in LISTING_COLUMNS)
+    db.execute(f"DELETE FROM {LISTING_TABLE}")
+    db.execute(f"INSERT INTO {LISTING_TABLE} ({columns})" + _listing_select())
+    return db.execute(f"SELECT COUNT(*) FROM {LISTING_TABLE}").fetchone()[0]
@@ -0,0 +1,149 @@
+"""
+Per-Request SQL Instrumentation for SooqKabeer
+Filename: query_stats.py
+Times every statement run through the connection manager, collects
+per-request totals, logs slow statements and flags N+1 patterns
+"""
+
+import heapq
+import logging
+import re
+import sqlite3
+import time
+from contextvars import ContextVar
+from functools import lru_cache
+
+# A single statement slower than this goes to the slow-query log
+SLOW_QUERY_MS = 100.0
+
+# The same normalized statement run more often than this in one request
+# is reported as a probable N+1
+N_PLUS_ONE_THRESHOLD = 10
+
+# How many of a request's slowest statements to keep
+SLOWEST_KEPT = 5
+
+slow_query_log = logging.getLogger('sooqkabeer.slow_sql')
+request_log = logging.getLogger('sooqkabeer.sql')
+
+_current = ContextVar('query_stats', default=None)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """Statement shape: literals become ?, IN lists collapse, whitespace folds"""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+class QueryStats:
+    """Statement counts and timings for one request"""
+
+    def __init__(self, label=''):
+        self.label = label
+        self.count = 0
+        self.total_ms = 0.0
+        self.by_statement = {}
+        self._slowest = []
+
+    def record(self, sql, elapsed_ms):
+        shape = normalize_sql(sql)
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.by_statement[shape] = self.by_statement.get(shape, 0) + 1
+        entry = (elapsed_ms, self.count, shape)
+        if len(self._slowest) < SLOWEST_KEPT:
+            heapq.heappush(self._slowest, entry)
+        else:
+            heapq.heappushpop(self._slowest, entry)
+
+    def slowest(self):
+        """[(ms, normalized sql)], slowest first"""
+        return [(ms, shape) for ms, _, shape in sorted(self._slowest, reverse=True)]
+
+    def repeated(self, threshold=None):
+        """[(normalized sql, times)] for statements run more than `threshold` times"""
+        limit = N_PLUS_ONE_THRESHOLD if threshold is None else threshold
+        return sorted(((shape, n) for shape, n in self.by_statement.items() if n > limit),
+                      key=lambda item: -item[1])
+
+    def server_timing(self):
+        """Value for a Server-Timing response header"""
+        return f'db;dur={self.total_ms:.1f};desc="{self.count} queries"'
+
+
+def start_request_stats(label=''):
+    """Begin collecting for the current request/context; returns the collector"""
+    stats = QueryStats(label)
+    _current.set(stats)
+    return stats
+
+
+def finish_request_stats():
+    """Stop collecting, warn about N+1 patterns and return the collector"""
+    stats = _current.get()
+    _current.set(None)
+    if stats is None:
+        return None
+    for shape, times in stats.repeated():
+        request_log.warning("Possible N+1 in %s: %d x %s", stats.label, times, shape)
+    return stats
+
+
+def _record(sql, started):
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    stats = _current.get()
+    if stats is not None:
+        stats.record(sql, elapsed_ms)
+    if elapsed_ms >= SLOW_QUERY_MS:
+        slow_query_log.warning("%.1f ms%s: %s", elapsed_ms,
+                               f' in {stats.label}' if stats is not None and stats.label else '',
+                               normalize_sql(sql))
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times each statement it runs"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record(sql, started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record(sql, started)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            _record(sql_script, started)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors (including execute() shortcuts) are timed"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
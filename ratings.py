@@ -0,0 +1,180 @@
+"""
+Product and Vendor Rating Aggregates for SooqKabeer
+Filename: ratings.py
+Approved-review counts and averages kept up to date by triggers on
+product_reviews (and on products.vendor_id for vendor totals), so listings read one row per product instead of
+aggregating every review on each request
+"""
+
+RATING_TRIGGERS = (
+    'product_reviews_stats_ai',
+    'product_reviews_stats_ad',
+    'product_reviews_stats_au_old',
+    'product_reviews_stats_au_new',
+    'products_vendor_rating_au',
+)
+
+
+def _add_review_sql(ref):
+    """Statements adding one approved review (`ref` is new/old) to the aggregates"""
+    return f'''
+            INSERT INTO product_rating_stats (product_id, review_count, rating_sum, average_rating)
+            VALUES ({ref}.product_id, 1, {ref}.rating, {ref}.rating)
+            ON CONFLICT(product_id) DO UPDATE SET
+                review_count = review_count + 1,
+                rating_sum = rating_sum + excluded.rating_sum,
+                average_rating = (rating_sum + excluded.rating_sum) / (review_count + 1);
+
+            INSERT INTO vendor_rating_stats (vendor_id, review_count, rating_sum)
+            SELECT vendor_id, 1, {ref}.rating FROM products
+            WHERE id = {ref}.product_id AND vendor_id IS NOT NULL
+            ON CONFLICT(vendor_id) DO UPDATE SET
+                review_count = review_count + 1,
+                rating_sum = rating_sum + excluded.rating_sum;
+    ''' + _vendor_rating_sql(ref)
+
+
+def _remove_review_sql(ref):
+    """Statements removing one approved review from the aggregates"""
+    return f'''
+            UPDATE product_rating_stats SET
+                review_count = review_count - 1,
+                rating_sum = rating_sum - {ref}.rating,
+                average_rating = CASE WHEN review_count > 1
+                                      THEN (rating_sum - {ref}.rating) / (review_count - 1)
+                                      ELSE 0 END
+            WHERE product_id = {ref}.product_id;
+
+            UPDATE vendor_rating_stats SET
+                review_count = review_count - 1,
+                rating_sum = rating_sum - {ref}.rating
+            WHERE vendor_id = (SELECT vendor_id FROM products WHERE id = {ref}.product_id);
+    ''' + _vendor_rating_sql(ref)
+
+
+def _vendor_rating_sql(ref):
+    """Copy the vendor rollup into vendors.rating"""
+    return f'''
+            UPDATE vendors SET rating = COALESCE((
+                SELECT CASE WHEN review_count > 0 THEN rating_sum / review_count ELSE 0 END
+                FROM vendor_rating_stats WHERE vendor_id = vendors.id
+            ), 0)
+            WHERE id = (SELECT vendor_id FROM products WHERE id = {ref}.product_id);
+    '''
+
+
+def ensure_rating_stats(db):
+    """Create the aggregate tables and the triggers that maintain them"""
+    vendor_columns = {row[1] for row in db.execute("PRAGMA table_info(vendors)")}
+    if 'rating' not in vendor_columns:
+        db.execute("ALTER TABLE vendors ADD COLUMN rating REAL DEFAULT 0")
+
+    # Listings already read approved reviews from here; no route creates it yet
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS product_reviews (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL,
+            user_id INTEGER,
+            rating INTEGER NOT NULL CHECK (rating BETWEEN 1 AND 5),
+            comment TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS product_rating_stats (
+            product_id INTEGER PRIMARY KEY,
+            review_count INTEGER NOT NULL DEFAULT 0,
+            rating_sum REAL NOT NULL DEFAULT 0,
+            average_rating REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS vendor_rating_stats (
+            vendor_id INTEGER PRIMARY KEY,
+            review_count INTEGER NOT NULL DEFAULT 0,
+            rating_sum REAL NOT NULL DEFAULT 0
+        )
+    ''')
+
+    db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS product_reviews_stats_ai
+        AFTER INSERT ON product_reviews WHEN new.status = 'approved' BEGIN
+            {_add_review_sql('new')}
+        END
+    ''')
+    db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS product_reviews_stats_ad
+        AFTER DELETE ON product_reviews WHEN old.status = 'approved' BEGIN
+            {_remove_review_sql('old')}
+        END
+    ''')
+    # Approval, rejection and rating edits: take the old row out, put the new one in
+    db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS product_reviews_stats_au_old
+        AFTER UPDATE OF status, rating, product_id ON product_reviews
+        WHEN old.status = 'approved' BEGIN
+            {_remove_review_sql('old')}
+        END
+    ''')
+    db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS product_reviews_stats_au_new
+        AFTER UPDATE OF status, rating, product_id ON product_reviews
+        WHEN new.status = 'approved' BEGIN
+            {_add_review_sql('new')}
+        END
+    ''')
+    # A product moving to another vendor takes its review totals with it
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_vendor_rating_au
+        AFTER UPDATE OF vendor_id ON products
+        WHEN old.vendor_id IS NOT new.vendor_id BEGIN
+            UPDATE vendor_rating_stats SET
+                review_count = review_count - COALESCE(
+                    (SELECT review_count FROM product_rating_stats WHERE product_id = new.id), 0),
+                rating_sum = rating_sum - COALESCE(
+                    (SELECT rating_sum FROM product_rating_stats WHERE product_id = new.id), 0)
+            WHERE vendor_id = old.vendor_id;
+
+            INSERT INTO vendor_rating_stats (vendor_id, review_count, rating_sum)
+            SELECT new.vendor_id, review_count, rating_sum FROM product_rating_stats
+            WHERE product_id = new.id AND new.vendor_id IS NOT NULL
+            ON CONFLICT(vendor_id) DO UPDATE SET
+                review_count = review_count + excluded.review_count,
+                rating_sum = rating_sum + excluded.rating_sum;
+
+            UPDATE vendors SET rating = COALESCE((
+                SELECT CASE WHEN review_count > 0 THEN rating_sum / review_count ELSE 0 END
+                FROM vendor_rating_stats WHERE vendor_id = vendors.id
+            ), 0)
+            WHERE id IN (old.vendor_id, new.vendor_id);
+        END
+    ''')
+
+
+def rebuild_rating_stats(db):
+    """Recompute all aggregates from product_reviews; returns products rated"""
+    db.execute("DELETE FROM product_rating_stats")
+    db.execute("DELETE FROM vendor_rating_stats")
+    db.execute('''
+        INSERT INTO product_rating_stats (product_id, review_count, rating_sum, average_rating)
+        SELECT product_id, COUNT(*), SUM(rating), AVG(rating)
+        FROM product_reviews
+        WHERE status = 'approved'
+        GROUP BY product_id
+    ''')
+    db.execute('''
+        INSERT INTO vendor_rating_stats (vendor_id, review_count, rating_sum)
+        SELECT p.vendor_id, SUM(s.review_count), SUM(s.rating_sum)
+        FROM product_rating_stats s
+        JOIN products p ON p.id = s.product_id
+        WHERE p.vendor_id IS NOT NULL
+        GROUP BY p.vendor_id
+    ''')
+    db.execute('''
+        UPDATE vendors SET rating = COALESCE((
+            SELECT CASE WHEN review_count > 0 THEN rating_sum / review_count ELSE 0 END
+            FROM vendor_rating_stats WHERE vendor_id = vendors.id
+        ), 0)
+    ''')
+    return db.execute("SELECT COUNT(*) FROM product_rating_stats").fetchone()[0]
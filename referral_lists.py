@@ -0,0 +1,109 @@
+"""
+Referral Lists for SooqKabeer
+Filename: referral_lists.py
+Keyset-paged downline and commission history for the referral dashboard
+and its JSON API, plus CSV export that streams the same queries straight
+from the cursor
+"""
+
+import csv
+import io
+
+from pagination import decode_cursor, encode_cursor, keyset_condition, keyset_order_by, keyset_page
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Rows written to the CSV buffer between yields
+EXPORT_CHUNK = 500
+
+DOWNLINE_COLUMNS = ('id', 'username', 'email', 'level', 'created_at', 'is_active', 'total_orders',
+                    'total_spent', 'total_commission')
+COMMISSION_COLUMNS = ('id', 'created_at', 'type', 'amount', 'commission_rate', 'status', 'order_id',
+                      'referred_user_id', 'referred_user_name', 'description')
+
+
+# Newest first by user id: the closure's primary key (and the
+# (ancestor, depth) index for one level) already hold rows in that order.
+# Email is only shown for direct referrals; deeper levels get NULL.
+def downline_query(user_id, level=None):
+    sql = '''
+        SELECT u.id, u.username, CASE WHEN t.depth = 1 THEN u.email END AS email, t.depth AS level, u.created_at, u.is_active, u.total_orders,
+               u.total_spent, u.total_commission
+        FROM referral_tree t JOIN users u ON u.id = t.descendant_id
+        WHERE t.ancestor_id = ?
+    '''
+    params = [user_id]
+    if level is not None:
+        sql += ' AND t.depth = ?'
+        params.append(level)
+    return sql, params, 't.descendant_id'
+
+
+def commission_query(user_id, commission_type=None):
+    sql = '''
+        SELECT c.id, c.created_at, c.type, c.amount, c.commission_rate, c.status, c.order_id,
+               c.referred_user_id, u.username AS referred_user_name, c.description
+        FROM commissions c LEFT JOIN users u ON u.id = c.referred_user_id
+        WHERE c.user_id = ?
+    '''
+    params = [user_id]
+    if commission_type:
+        sql += ' AND c.type = ?'
+        params.append(commission_type)
+    return sql, params, 'c.id'
+
+
+def page(db, query, sort, token=None, limit=DEFAULT_PAGE_SIZE):
+    """One page, newest first, of a query from downline_query/commission_query
+
+    Returns {'items': [...], 'next_cursor': token or None}. A cursor that
+    is malformed or belongs to another listing starts from the top.
+    """
+    sql, params, key = query
+    params = list(params)
+    cursor = decode_cursor(token, sort=sort, columns=1)
+    if cursor:
+        condition, condition_params = keyset_condition((key,), True, cursor['values'])
+        sql += f' AND {condition}'
+        params.extend(condition_params)
+    sql += f' ORDER BY {keyset_order_by((key,), True)} LIMIT ?'
+    params.append(limit + 1)
+    rows, has_more = keyset_page([dict(row) for row in db.execute(sql, params)], limit)
+    return {'items': rows, 'next_cursor': encode_cursor(sort, [rows[-1]['id']]) if has_more else None}
+
+
+def page_size(value):
+    """Clamp a requested page size into 1..MAX_PAGE_SIZE"""
+    try:
+        return max(1, min(int(value), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+
+
+#=== CSV export ===#
+def _cell(value):
+    # Keep spreadsheet apps from evaluating user-supplied text as a formula
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
+
+def iter_csv(db, query, columns, chunk=EXPORT_CHUNK):
+    """Yield CSV text for the whole query, `chunk` rows at a time
+
+    Rows come off the sqlite cursor as they are written, so memory stays
+    flat however long the downline is.
+    """
+    sql, params, key = query
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    rows = db.execute(f'{sql} ORDER BY {keyset_order_by((key,), True)}', params)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([_cell(row[column]) for column in columns])
+        if count % chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,184 @@
+"""
+Referral Stats for SooqKabeer
+Filename: referral_stats.py
+Rollups of referral activity, kept current as signups and commissions
+are written: one row per user, one per (user, downline level) and one
+per (user, month). Dashboards read these rows instead of aggregating
+over users, referrals and commissions on every request.
+"""
+
+# Each statement adds its grouped totals onto existing rows, so the same
+# SQL applies one signup or settlement and, over empty tables, rebuilds
+# everything. {where} narrows the source rows.
+_SIGNUP_LEVELS = '''
+    INSERT INTO referral_level_stats (user_id, level, referrals)
+    SELECT t.ancestor_id, t.depth, COUNT(*) FROM referral_tree t
+    WHERE {where}
+    GROUP BY t.ancestor_id, t.depth
+    ON CONFLICT (user_id, level) DO UPDATE SET referrals = referrals + excluded.referrals
+'''
+
+_SIGNUP_USERS = '''
+    INSERT INTO referral_user_stats (user_id, referrals, direct_referrals, active_referrals)
+    SELECT t.ancestor_id, COUNT(*), SUM(t.depth = 1), SUM(t.depth = 1 AND COALESCE(u.is_active, 1) = 1)
+    FROM referral_tree t JOIN users u ON u.id = t.descendant_id
+    WHERE {where}
+    GROUP BY t.ancestor_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        referrals = referrals + excluded.referrals,
+        direct_referrals = direct_referrals + excluded.direct_referrals,
+        active_referrals = active_referrals + excluded.active_referrals
+'''
+
+# Sales of orders whose commissions were just posted, for every upline level
+_ORDER_LEVELS = '''
+    INSERT INTO referral_level_stats (user_id, level, orders, sales)
+    SELECT t.ancestor_id, t.depth, COUNT(*), SUM(o.total_price)
+    FROM orders o JOIN referral_tree t ON t.descendant_id = o.user_id
+    WHERE o.id IN (SELECT order_id FROM commissions c WHERE {where})
+    GROUP BY t.ancestor_id, t.depth
+    ON CONFLICT (user_id, level) DO UPDATE SET
+        orders = orders + excluded.orders, sales = sales + excluded.sales
+'''
+
+_ORDER_USERS = '''
+    INSERT INTO referral_user_stats (user_id, direct_sales)
+    SELECT t.ancestor_id, SUM(o.total_price)
+    FROM orders o JOIN referral_tree t ON t.descendant_id = o.user_id AND t.depth = 1
+    WHERE o.id IN (SELECT order_id FROM commissions c WHERE {where})
+    GROUP BY t.ancestor_id
+    ON CONFLICT (user_id) DO UPDATE SET direct_sales = direct_sales + excluded.direct_sales
+'''
+
+# Commissions earned from a referred user (order commissions and signup
+# bonuses); the tree row gives the level they came from
+_EARNED = '''
+    FROM commissions c
+    JOIN referral_tree t ON t.ancestor_id = c.user_id AND t.descendant_id = c.referred_user_id
+    WHERE {where}
+'''
+
+_COMMISSION_LEVELS = f'''
+    INSERT INTO referral_level_stats (user_id, level, commission, commissions)
+    SELECT c.user_id, t.depth, SUM(c.amount), COUNT(*) {_EARNED}
+    GROUP BY c.user_id, t.depth
+    ON CONFLICT (user_id, level) DO UPDATE SET
+        commission = commission + excluded.commission, commissions = commissions + excluded.commissions
+'''
+
+_COMMISSION_MONTHS = f'''
+    INSERT INTO referral_monthly_stats (user_id, month, commission, commissions)
+    SELECT c.user_id, strftime('%Y-%m', COALESCE(c.created_at, CURRENT_TIMESTAMP)), SUM(c.amount), COUNT(*)
+    {_EARNED}
+    GROUP BY 1, 2
+    ON CONFLICT (user_id, month) DO UPDATE SET
+        commission = commission + excluded.commission, commissions = commissions + excluded.commissions
+'''
+
+_COMMISSION_USERS = f'''
+    INSERT INTO referral_user_stats (user_id, commission, commissions)
+    SELECT c.user_id, SUM(c.amount), COUNT(*) {_EARNED}
+    GROUP BY c.user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        commission = commission + excluded.commission, commissions = commissions + excluded.commissions
+'''
+
+
+def ensure_referral_stats(db):
+    fresh = db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'referral_user_stats'"
+                       ).fetchone() is None
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS referral_user_stats (
+            user_id INTEGER PRIMARY KEY,
+            referrals INTEGER NOT NULL DEFAULT 0,
+            direct_referrals INTEGER NOT NULL DEFAULT 0,
+            active_referrals INTEGER NOT NULL DEFAULT 0,
+            direct_sales REAL NOT NULL DEFAULT 0,
+            commission REAL NOT NULL DEFAULT 0,
+            commissions INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS referral_level_stats (
+            user_id INTEGER NOT NULL,
+            level INTEGER NOT NULL,
+            referrals INTEGER NOT NULL DEFAULT 0,
+            orders INTEGER NOT NULL DEFAULT 0,
+            sales REAL NOT NULL DEFAULT 0,
+            commission REAL NOT NULL DEFAULT 0,
+            commissions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, level)
+        ) WITHOUT ROWID
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS referral_monthly_stats (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            commission REAL NOT NULL DEFAULT 0,
+            commissions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, month)
+        ) WITHOUT ROWID
+    ''')
+    if 'is_active' not in {row[1] for row in db.execute("PRAGMA table_info(users)")}:
+        db.execute("ALTER TABLE users ADD COLUMN is_active INTEGER DEFAULT 1")
+    if fresh:
+        rebuild_referral_stats(db)
+
+
+def rebuild_referral_stats(db):
+    """Recompute every rollup from referral_tree, orders and commissions; returns users covered"""
+    for table in ('referral_user_stats', 'referral_level_stats', 'referral_monthly_stats'):
+        db.execute(f"DELETE FROM {table}")
+    for sql in (_SIGNUP_LEVELS, _SIGNUP_USERS):
+        db.execute(sql.format(where='1'))
+    record_settlement(db, 0)
+    return db.execute("SELECT COUNT(*) FROM referral_user_stats").fetchone()[0]
+
+
+#=== Writes ===#
+def record_signup(db, user_id):
+    """Count `user_id` in every upline member's rollups; call once, after add_referral"""
+    for sql in (_SIGNUP_LEVELS, _SIGNUP_USERS):
+        db.execute(sql.format(where='t.descendant_id = ?'), (user_id,))
+
+
+def record_commissions(db, after):
+    """Add commission rows with id above `after` to their earners' rollups"""
+    for sql in (_COMMISSION_LEVELS, _COMMISSION_MONTHS, _COMMISSION_USERS):
+        db.execute(sql.format(where='c.id > ?'), (after,))
+
+
+def record_settlement(db, after):
+    """Roll up the orders and commissions posted with ids above `after`
+
+    Same transaction as the commission insert. Settlement skips orders
+    that already have commissions, so each order is counted once.
+    """
+    for sql in (_ORDER_LEVELS, _ORDER_USERS):
+        db.execute(sql.format(where='c.id > ?'), (after,))
+    record_commissions(db, after)
+
+
+#=== Reads ===#
+def user_stats(db, user_id):
+    row = db.execute("SELECT * FROM referral_user_stats WHERE user_id = ?", (user_id,)).fetchone()
+    if row is None:
+        return {'referrals': 0, 'direct_referrals': 0, 'active_referrals': 0, 'direct_sales': 0,
+                'commission': 0, 'commissions': 0}
+    return {key: row[key] for key in row.keys() if key != 'user_id'}
+
+
+def level_stats(db, user_id):
+    """[{level, referrals, orders, sales, commission, commissions}] by level"""
+    return [dict(row) for row in db.execute('''
+        SELECT level, referrals, orders, sales, commission, commissions
+        FROM referral_level_stats WHERE user_id = ? ORDER BY level
+    ''', (user_id,))]
+
+
+def monthly_stats(db, user_id, limit=6):
+    """[{month, commission, commissions}] newest month first"""
+    return [dict(row) for row in db.execute('''
+        SELECT month, commission, commissions FROM referral_monthly_stats
+        WHERE user_id = ? ORDER BY month DESC LIMIT ?
+    ''', (user_id, limit))]
@@ -0,0 +1,142 @@
+"""
+Referral Tree for SooqKabeer
+Filename: referral_tree.py
+Closure table of the referral graph: one (ancestor, descendant, depth) row
+per upline member, so uplines, per-level downline counts and subtree sales
+are single indexed queries at any depth. Per-level referral commission
+rates live in commission_rates; its highest level is the payout depth.
+"""
+
+# Level 1 is the direct referrer; these match the old fixed 5% / 2.5% / 1.25%
+DEFAULT_COMMISSION_RATES = ((1, 0.05), (2, 0.025), (3, 0.0125))
+
+# Guards the legacy backfill against a cycle in old referrals data
+MAX_BACKFILL_DEPTH = 100
+
+
+def ensure_referral_tree(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS referral_tree (
+            ancestor_id INTEGER NOT NULL,
+            descendant_id INTEGER NOT NULL,
+            depth INTEGER NOT NULL CHECK (depth >= 1),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (ancestor_id, descendant_id)
+        ) WITHOUT ROWID
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_referral_tree_descendant "
+               "ON referral_tree(descendant_id, depth)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_referral_tree_ancestor_depth "
+               "ON referral_tree(ancestor_id, depth)")
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS commission_rates (
+            level INTEGER PRIMARY KEY CHECK (level >= 1),
+            rate REAL NOT NULL CHECK (rate >= 0),
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    if db.execute("SELECT 1 FROM commission_rates LIMIT 1").fetchone() is None:
+        db.executemany("INSERT INTO commission_rates (level, rate) VALUES (?, ?)", DEFAULT_COMMISSION_RATES)
+    backfill_referral_tree(db)
+
+
+def backfill_referral_tree(db):
+    """Expand the direct (level 1) rows of the legacy referrals table into the closure"""
+    cursor = db.execute('''
+        WITH RECURSIVE chain (ancestor_id, descendant_id, depth) AS (
+            SELECT referrer_id, referred_id, 1 FROM referrals WHERE level = 1
+            UNION ALL
+            SELECT r.referrer_id, c.descendant_id, c.depth + 1
+            FROM chain c JOIN referrals r ON r.referred_id = c.ancestor_id AND r.level = 1
+            WHERE c.depth < ?
+        )
+        INSERT OR IGNORE INTO referral_tree (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, descendant_id, MIN(depth) FROM chain
+        WHERE ancestor_id != descendant_id
+        GROUP BY ancestor_id, descendant_id
+    ''', (MAX_BACKFILL_DEPTH,))
+    return cursor.rowcount
+
+
+#=== Writes ===#
+def add_referral(db, referrer_id, user_id):
+    """Attach `user_id` under `referrer_id`; returns the number of ancestors
+
+    The new user's whole upline is the referrer plus the referrer's own
+    upline one level further away, written in one statement. Each
+    ancestor's referral counters are bumped in one more.
+    """
+    cursor = db.execute('''
+        INSERT OR IGNORE INTO referral_tree (ancestor_id, descendant_id, depth)
+        SELECT ?, ?, 1
+        UNION ALL
+        SELECT ancestor_id, ?, depth + 1 FROM referral_tree
+        WHERE descendant_id = ? AND ancestor_id != ?
+    ''', (referrer_id, user_id, user_id, referrer_id, user_id))
+    if not cursor.rowcount:
+        return 0
+    db.execute('''
+        UPDATE users
+        SET direct_referrals = COALESCE(direct_referrals, 0) + (
+                SELECT depth = 1 FROM referral_tree WHERE ancestor_id = users.id AND descendant_id = ?),
+            indirect_referrals = COALESCE(indirect_referrals, 0) + (
+                SELECT depth > 1 FROM referral_tree WHERE ancestor_id = users.id AND descendant_id = ?),
+            total_referrals = COALESCE(total_referrals, 0) + 1
+        WHERE id IN (SELECT ancestor_id FROM referral_tree WHERE descendant_id = ?)
+    ''', (user_id, user_id, user_id))
+    return cursor.rowcount
+
+
+#=== Lookups ===#
+def upline(db, user_id, max_depth=None):
+    """[(ancestor_id, depth)] nearest first, optionally cut at max_depth"""
+    return [tuple(row) for row in db.execute('''
+        SELECT ancestor_id, depth FROM referral_tree
+        WHERE descendant_id = ? AND depth <= COALESCE(?, depth)
+        ORDER BY depth
+    ''', (user_id, max_depth))]
+
+
+def paid_upline(db, user_id):
+    """[(ancestor_id, depth, rate)] for every upline level that has a commission rate"""
+    return [tuple(row) for row in db.execute('''
+        SELECT t.ancestor_id, t.depth, r.rate
+        FROM referral_tree t JOIN commission_rates r ON r.level = t.depth
+        WHERE t.descendant_id = ?
+        ORDER BY t.depth
+    ''', (user_id,))]
+
+
+def downline_counts(db, user_id):
+    """{depth: number of users} below `user_id`"""
+    return dict(db.execute('''
+        SELECT depth, COUNT(*) FROM referral_tree
+        WHERE ancestor_id = ? GROUP BY depth ORDER BY depth
+    ''', (user_id,)).fetchall())
+
+
+def subtree_sales(db, user_id, max_depth=None):
+    """(order count, sales total) placed by everyone below `user_id`"""
+    row = db.execute('''
+        SELECT COUNT(o.id), COALESCE(SUM(o.total_price), 0)
+        FROM referral_tree t JOIN orders o ON o.user_id = t.descendant_id
+        WHERE t.ancestor_id = ? AND t.depth <= COALESCE(?, t.depth)
+    ''', (user_id, max_depth)).fetchone()
+    return row[0], row[1]
+
+
+#=== Rates ===#
+def commission_rates(db):
+    """{level: rate}, level 1 being the direct referrer"""
+    return dict(db.execute("SELECT level, rate FROM commission_rates ORDER BY level").fetchall())
+
+
+def set_commission_rate(db, level, rate):
+    """Set one level's rate; rate=None stops paying that level"""
+    if rate is None:
+        db.execute("DELETE FROM commission_rates WHERE level = ?", (level,))
+    else:
+        db.execute('''
+            INSERT INTO commission_rates (level, rate) VALUES (?, ?)
+            ON CONFLICT (level) DO UPDATE SET rate = excluded.rate, updated_at = CURRENT_TIMESTAMP
+        ''', (level, rate))
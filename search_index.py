@@ -0,0 +1,131 @@
+"""
+Full-Text Product Search for SooqKabeer
+Filename: search_index.py
+SQLite FTS5 index over the bilingual product text, kept in sync by triggers
+"""
+
+import re
+
+from arabic_normalize import normalize_arabic
+
+FTS_TABLE = 'products_fts'
+
+# Indexed product columns, in FTS column order. search_text holds the
+# normalized text (see arabic_normalize.py) that user queries match against.
+FTS_COLUMNS = ('name_ar', 'name_en', 'desc_ar', 'desc_en', 'brand', 'search_text')
+
+# bm25 column weights: names matter most, then brand, then descriptions
+BM25_WEIGHTS = (10.0, 10.0, 2.0, 2.0, 5.0, 4.0)
+
+FTS_TRIGGERS = ('products_fts_ai', 'products_fts_ad', 'products_fts_au')
+
+# remove_diacritics only folds Latin-script accents ("café" matches "cafe").
+# Arabic harakat are not folded here: "تَمر" matches "تمر" through the
+# normalized search_text column, built by arabic_normalize.py.
+FTS_TOKENIZER = 'unicode61 remove_diacritics 2'
+
+
+def _column_list(prefix=''):
+    return ', '.join(f"{prefix}{col}" for col in FTS_COLUMNS)
+
+
+def _ensure_source_columns(db):
+    """Make sure every indexed column exists on products"""
+    existing = {row[1] for row in db.execute("PRAGMA table_info(products)")}
+    for col in FTS_COLUMNS:
+        if col not in existing:
+            db.execute(f"ALTER TABLE products ADD COLUMN {col} TEXT")
+
+
+def _indexed_columns(db):
+    return tuple(row[1] for row in db.execute(f"PRAGMA table_info({FTS_TABLE})"))
+
+
+def drop_search_index(db):
+    """Drop the FTS table and its triggers"""
+    for trigger in FTS_TRIGGERS:
+        db.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    db.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def ensure_search_index(db):
+    """Create the FTS table and its sync triggers, building it on first run
+
+    An index built with a different column set is dropped and rebuilt.
+    """
+    columns = _indexed_columns(db)
+    if columns and columns != FTS_COLUMNS:
+        drop_search_index(db)
+        columns = ()
+
+    _ensure_source_columns(db)
+
+    db.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+            {_column_list()},
+            content='products', content_rowid='id',
+            tokenize="{FTS_TOKENIZER}"
+        )
+    ''')
+
+    # External-content FTS: every change to products is mirrored here.
+    # The update trigger only fires for indexed columns, so stock and view
+    # counter updates never touch the index.
+    db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, {_column_list()})
+            VALUES (new.id, {_column_list('new.')});
+        END
+    ''')
+    db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_column_list()})
+            VALUES ('delete', old.id, {_column_list('old.')});
+        END
+    ''')
+    db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF {_column_list()} ON products BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_column_list()})
+            VALUES ('delete', old.id, {_column_list('old.')});
+            INSERT INTO {FTS_TABLE}(rowid, {_column_list()})
+            VALUES (new.id, {_column_list('new.')});
+        END
+    ''')
+
+    if not columns:
+        rebuild_search_index(db)
+
+
+def rebuild_search_index(db):
+    """Rebuild the whole index from the products table"""
+    db.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def build_match_query(text):
+    """Turn free user input into a safe FTS5 MATCH expression
+
+    Every word is normalized and becomes a quoted prefix term, so FTS
+    operators typed by the user are matched literally instead of raising
+    a syntax error. All words must match. Returns None when nothing is
+    searchable.
+    """
+    text = normalize_arabic(text)
+    if not text:
+        return None
+    terms = []
+    for word in re.split(r'\s+', text):
+        word = word.replace('"', '').strip()
+        if word:
+            terms.append(f'"{word}"*')
+    return ' '.join(terms) or None
+
+
+def search_join(alias='fts'):
+    """JOIN clause that restricts products to matches and exposes a bm25 rank
+
+    Takes one parameter: the MATCH expression from build_match_query().
+    """
+    weights = ', '.join(str(w) for w in BM25_WEIGHTS)
+    return (f" JOIN (SELECT rowid, bm25({FTS_TABLE}, {weights}) AS rank"
+            f" FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ?) {alias}"
+            f" ON {alias}.rowid = p.id")
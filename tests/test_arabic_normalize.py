@@ -0,0 +1,43 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import unittest
+
+from arabic_normalize import (backfill_normalized_columns, ensure_normalized_columns,
+                              normalize_arabic, product_text_keys, register_arabic_collation)
+
+
+class TestArabicNormalize(unittest.TestCase):
+    def test_spelling_variants_fold_together(self):
+        self.assertEqual(normalize_arabic('أحمد'), normalize_arabic('احمد'))
+        self.assertEqual(normalize_arabic('إسلام'), normalize_arabic('اسلام'))
+        self.assertEqual(normalize_arabic('قهوة'), normalize_arabic('قهوه'))
+        self.assertEqual(normalize_arabic('مستشفى'), normalize_arabic('مستشفي'))
+        self.assertEqual(normalize_arabic('قَهْوَة'), 'قهوه')
+        self.assertEqual(normalize_arabic('تمـــر'), 'تمر')
+        self.assertEqual(normalize_arabic('  Dates   ١٢ '), 'dates 12')
+
+    def test_product_keys(self):
+        keys = product_text_keys({'name_ar': 'أرز', 'name_en': 'Rice', 'brand': 'Tilda'})
+        self.assertEqual(keys['search_text'], 'ارز rice tilda')
+        self.assertEqual(keys['sort_key_ar'], 'ارز')
+        self.assertEqual(keys['sort_key_en'], 'rice')
+
+    def test_collation_matches_stored_keys(self):
+        db = register_arabic_collation(sqlite3.connect(':memory:'))
+        db.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, name_ar TEXT, name_en TEXT)")
+        db.executemany("INSERT INTO products (name_ar, name_en) VALUES (?, ?)",
+                       [('إبريق', 'Kettle'), ('آلة', 'Machine'), ('بن', 'Beans'), ('ابريق', 'Jug')])
+        ensure_normalized_columns(db)
+        self.assertEqual(backfill_normalized_columns(db), 4)
+
+        by_key = [r[0] for r in db.execute("SELECT id FROM products ORDER BY sort_key_ar, id")]
+        by_collation = [r[0] for r in db.execute("SELECT id FROM products ORDER BY name_ar COLLATE ARABIC, id")]
+        self.assertEqual(by_key, by_collation)
+        self.assertEqual(by_key, [1, 4, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask, render_template_string
+
+from assets import MANIFEST_NAME, build_manifest, init_assets
+
+
+class TestAssets(unittest.TestCase):
+    def setUp(self):
+        self.static = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static)
+        os.makedirs(os.path.join(self.static, 'css'))
+        os.makedirs(os.path.join(self.static, 'uploads'))
+        self.write('css/style.css', 'body{color:red}')
+        self.write('uploads/avatar.png', 'png')
+
+        self.app = Flask(__name__, static_folder=self.static, static_url_path='/static')
+        self.manifest = init_assets(self.app)
+
+    def write(self, name, content):
+        with open(os.path.join(self.static, name), 'w') as f:
+            f.write(content)
+
+    def test_manifest_fingerprints_but_skips_uploads(self):
+        manifest = build_manifest(self.static)
+        self.assertRegex(manifest['css/style.css'], r'^css/style\.[0-9a-f]{10}\.css$')
+        self.assertNotIn('uploads/avatar.png', manifest)
+        self.assertTrue(os.path.exists(os.path.join(self.static, MANIFEST_NAME)))
+
+    def test_hash_follows_content(self):
+        before = build_manifest(self.static)['css/style.css']
+        self.write('css/style.css', 'body{color:blue}')
+        self.assertNotEqual(build_manifest(self.static)['css/style.css'], before)
+
+    def test_helper_and_immutable_route(self):
+        with self.app.test_request_context():
+            url = render_template_string("{{ asset_url('css/style.css') }}")
+            plain = render_template_string("{{ asset_url('uploads/avatar.png') }}")
+        self.assertTrue(url.startswith('/assets/css/style.'))
+        self.assertEqual(plain, '/static/uploads/avatar.png')
+
+        response = self.app.test_client().get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'body{color:red}')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', response.headers['Cache-Control'])
+        response.close()
+
+        self.assertEqual(self.app.test_client().get('/assets/css/style.0000000000.css').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
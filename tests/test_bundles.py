@@ -0,0 +1,70 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gzip
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask
+
+import bundles
+from assets import asset_url, init_assets
+from bundles import build_bundles, bundle_url, direction_variant, minify_css, minify_js
+
+
+class TestBundles(unittest.TestCase):
+    def test_minify_css_keeps_strings(self):
+        css = "/* theme */\n.a  >  .b {\n  content: 'a  /* b */';\n  margin: 0 auto;\n}\n"
+        self.assertEqual(minify_css(css), ".a>.b{content:'a  /* b */';margin:0 auto}")
+
+    def test_rtl_variant_mirrors_unscoped_rules(self):
+        css = minify_css(".t{text-align:left;margin:1px 2px 3px 4px;padding-left:5px}"
+                         "[dir=\"rtl\"] .x{float:left}[dir=ltr] .y{float:left}"
+                         "@media (max-width:768px){.m{right:0}}")
+        self.assertEqual(direction_variant(css, 'ltr'),
+                         ".t{text-align:left;margin:1px 2px 3px 4px;padding-left:5px}"
+                         "[dir=ltr] .y{float:left}@media (max-width:768px){.m{right:0}}")
+        self.assertEqual(direction_variant(css, 'rtl'),
+                         ".t{text-align:right;margin:1px 4px 3px 2px;padding-right:5px}"
+                         "[dir=\"rtl\"] .x{float:left}@media (max-width:768px){.m{left:0}}")
+
+    def test_minify_js_drops_comment_lines_only(self):
+        js = "// header\nvar a = 'http://x';\n\n    a();\n"
+        self.assertEqual(minify_js(js), "var a = 'http://x';\na();")
+
+    def test_build_writes_variants_and_gzip(self):
+        static = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static)
+        with open(os.path.join(static, 'a.css'), 'w') as f:
+            f.write('.a { float: left; }')
+        with open(os.path.join(static, 'a.js'), 'w') as f:
+            f.write('run();')
+
+        written = build_bundles(static, {'shop': {'css': ('a.css',), 'js': ('a.js',)}})
+        self.assertEqual(sorted(written), ['dist/shop.js', 'dist/shop.ltr.css', 'dist/shop.rtl.css'])
+        with gzip.open(os.path.join(static, 'dist/shop.rtl.css.gz')) as f:
+            self.assertEqual(f.read(), b'.a{float:right}')
+
+    def test_fallback_build_gets_hashed_urls(self):
+        static = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static)
+        with open(os.path.join(static, 'a.css'), 'w') as f:
+            f.write('.a { float: left; }')
+        original = bundles.BUNDLES
+        bundles.BUNDLES = {'shop': {'css': ('a.css',)}}
+        self.addCleanup(setattr, bundles, 'BUNDLES', original)
+        app = Flask(__name__, static_folder=static)
+        init_assets(app)
+
+        with app.test_request_context('/'):
+            self.assertTrue(asset_url('a.css').startswith('/assets/'))  # manifest loaded before the build
+            url = bundle_url('shop', rtl=True)
+            self.assertRegex(url, r'^/assets/dist/shop\.rtl\.\w+\.css$')
+            self.assertEqual(bundle_url('shop', rtl=True), url)
+        self.assertEqual([name for name in os.listdir(os.path.join(static, 'dist')) if name.endswith('.tmp')], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
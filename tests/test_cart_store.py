@@ -0,0 +1,57 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import unittest
+
+from cart_store import (add_item, cart_items, clear_cart, ensure_cart_items, item_count, merge_items,
+                        price_cart, session_add, session_set, set_quantity)
+
+
+class TestCartStore(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, name_en TEXT, price REAL, "
+                        "stock_quantity REAL)")
+        self.db.executemany("INSERT INTO products VALUES (?, ?, ?, ?)",
+                            [(1, 'Dates', 2.5, 10), (2, 'Honey', 4.0, 1)])
+        self.db.execute("CREATE TABLE cart (id INTEGER PRIMARY KEY, user_id INTEGER, product_id INTEGER, "
+                        "quantity INTEGER)")
+        self.db.execute("INSERT INTO cart (user_id, product_id, quantity) VALUES (9, 1, 1)")
+        ensure_cart_items(self.db)
+
+    def test_legacy_rows_are_carried_over(self):
+        self.assertEqual(cart_items(self.db, 9), [{'product_id': 1, 'quantity': 1}])
+
+    def test_add_update_clear(self):
+        add_item(self.db, 7, 1, 2)
+        add_item(self.db, 7, 1, 1)
+        add_item(self.db, 7, 2, 1)
+        self.assertEqual(item_count(self.db, 7), 2)
+        self.assertEqual(cart_items(self.db, 7)[0], {'product_id': 1, 'quantity': 3})
+
+        set_quantity(self.db, 7, 2, 0)
+        self.assertEqual(item_count(self.db, 7), 1)
+        clear_cart(self.db, 7)
+        self.assertEqual(item_count(self.db, 7), 0)
+
+    def test_price_cart_stored_and_session(self):
+        merge_items(self.db, 7, [{'product_id': 1, 'quantity': 2}, {'product_id': 2, 'quantity': 3}])
+        lines, total = price_cart(self.db, user_id=7)
+        self.assertEqual(total, 17.0)
+        self.assertEqual([(line['product']['name_en'], line['in_stock']) for line in lines],
+                         [('Dates', True), ('Honey', False)])
+
+        items = session_add([], 2, 1)
+        items = session_add(items, 1, 4)
+        items = session_add(items, 99, 1)  # deleted product is dropped
+        lines, total = price_cart(self.db, items=items)
+        self.assertEqual(total, 14.0)
+        self.assertEqual([line['product']['id'] for line in lines], [2, 1])
+        self.assertEqual(price_cart(self.db, items=session_set(items, 2, 0))[1], 10.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
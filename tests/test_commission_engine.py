@@ -0,0 +1,85 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import unittest
+
+from commission_engine import (commission_setting, ensure_commission_settings, set_commission_setting, settle_day,
+                               settle_orders)
+from referral_stats import ensure_referral_stats
+from referral_tree import add_referral, ensure_referral_tree
+from wallet import current_balance, ensure_wallet_ledger
+
+SCHEMA = '''
+    CREATE TABLE users (id INTEGER PRIMARY KEY, wallet_balance REAL DEFAULT 0, total_commission REAL DEFAULT 0,
+                        direct_referrals INTEGER DEFAULT 0, indirect_referrals INTEGER DEFAULT 0,
+                        total_referrals INTEGER DEFAULT 0, is_active INTEGER DEFAULT 1);
+    CREATE TABLE referrals (id INTEGER PRIMARY KEY, referrer_id INTEGER, referred_id INTEGER, level INTEGER);
+    CREATE TABLE products (id INTEGER PRIMARY KEY, vendor_id INTEGER);
+    CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER, total_price REAL, created_at TIMESTAMP);
+    CREATE TABLE order_items (id INTEGER PRIMARY KEY, order_id INTEGER, product_id INTEGER, total_price REAL);
+    CREATE TABLE commissions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, order_id INTEGER,
+                              referred_user_id INTEGER, amount REAL, commission_rate REAL, type TEXT,
+                              description TEXT, status TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+'''
+
+
+class TestCommissionEngine(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        ensure_referral_tree(self.db)
+        ensure_commission_settings(self.db)
+        ensure_wallet_ledger(self.db)
+        ensure_referral_stats(self.db)
+        # Vendors 10 and 11; referral chain 1 -> 2 -> 3 -> 4 -> 5 (5 buys)
+        self.db.executemany("INSERT INTO users (id) VALUES (?)", [(i,) for i in (1, 2, 3, 4, 5, 10, 11)])
+        for parent, child in [(1, 2), (2, 3), (3, 4), (4, 5)]:
+            add_referral(self.db, parent, child)
+        self.db.executemany("INSERT INTO products VALUES (?, ?)", [(1, 10), (2, 11), (3, None)])
+        self.db.executemany("INSERT INTO orders VALUES (?, ?, ?, ?)",
+                            [(1, 5, 100.0, '2026-03-01 09:00:00'), (2, 5, 40.0, '2026-03-01 23:59:59'),
+                             (3, 2, 50.0, '2026-03-02 00:00:00')])
+        self.db.executemany("INSERT INTO order_items (order_id, product_id, total_price) VALUES (?, ?, ?)",
+                            [(1, 1, 60.0), (1, 2, 30.0), (1, 3, 10.0), (2, 1, 40.0), (3, 2, 50.0)])
+
+    def wallets(self):
+        return {row[0]: round(row[1], 4) for row in self.db.execute(
+            "SELECT id, wallet_balance FROM users WHERE wallet_balance > 0")}
+
+    def test_one_order(self):
+        rows, credited = settle_orders(self.db, [1])
+        self.assertEqual(rows, 5)  # two vendors + three paid referral levels
+        self.assertEqual(sorted(credited), [2, 3, 4, 10, 11])
+        self.assertEqual(self.wallets(), {10: 6.0, 11: 3.0, 4: 5.0, 3: 2.5, 2: 1.25})
+        self.assertEqual(round(current_balance(self.db, 10), 4), 6.0)
+        self.assertEqual(
+            [tuple(row) for row in self.db.execute(
+                "SELECT user_id, commission_rate, description FROM commissions WHERE type = 'referral' ORDER BY id")],
+            [(4, 0.05, 'Level 1 referral commission from order #1'),
+             (3, 0.025, 'Level 2 referral commission from order #1'),
+             (2, 0.0125, 'Level 3 referral commission from order #1')])
+
+        # Settling again posts nothing
+        self.assertEqual(settle_orders(self.db, [1]), (0, []))
+        self.assertEqual(self.wallets()[10], 6.0)
+
+    def test_rates_come_from_settings(self):
+        set_commission_setting(self.db, 'vendor_rate', 0.2)
+        self.assertEqual(commission_setting(self.db, 'vendor_rate'), 0.2)
+        settle_orders(self.db, [3])
+        self.assertEqual(self.wallets(), {11: 10.0, 1: 2.5})
+
+    def test_settle_day_batch(self):
+        settle_orders(self.db, [2])
+        orders, rows, credited = settle_day(self.db, '2026-03-01')
+        self.assertEqual((orders, rows), (2, 5))  # order 2 was already settled
+        self.assertEqual(self.db.execute("SELECT COUNT(DISTINCT order_id) FROM commissions").fetchone()[0], 2)
+        self.assertEqual(self.wallets()[10], 10.0)
+        self.assertFalse(self.db.in_transaction)
+
+
+if __name__ == '__main__':
+    unittest.main()
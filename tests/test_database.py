@@ -0,0 +1,74 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gc
+import tempfile
+import threading
+import unittest
+
+from database import ConnectionManager
+
+
+class TestConnectionManager(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.manager = ConnectionManager(os.path.join(self.tmp.name, 'test.db'))
+
+    def tearDown(self):
+        self.manager.close_idle()
+        self.tmp.cleanup()
+
+    def test_pragmas_and_reuse(self):
+        conn = self.manager.connect()
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        self.assertEqual(conn.execute("PRAGMA busy_timeout").fetchone()[0], 5000)
+        self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)
+        conn.execute("CREATE TABLE t (x)")
+        conn.execute("INSERT INTO t VALUES (1)")
+        conn.close()
+
+        again = self.manager.connect()
+        self.assertIs(again, conn)
+        # Uncommitted work is rolled back when a connection is returned
+        self.assertEqual(again.execute("SELECT COUNT(*) FROM t").fetchone()[0], 0)
+        again.close()
+
+        stats = self.manager.stats()
+        self.assertEqual((stats['opened'], stats['reused'], stats['checked_out']), (1, 1, 0))
+
+    def test_threads_get_their_own_connections(self):
+        seen = []
+        def worker():
+            conn = self.manager.connect()
+            seen.append(id(conn))
+            conn.execute("SELECT 1")
+            conn.close()
+            self.manager.close_idle()
+        threads = [threading.Thread(target=worker) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.manager.stats()['opened'], 3)
+        self.assertEqual(self.manager.stats()['checked_out'], 0)
+
+    def test_leaks_are_detected(self):
+        kept = self.manager.connect()
+        self.assertEqual(len(self.manager.leaks(older_than=0)), 1)
+        self.assertEqual(self.manager.reclaim_thread(), 1)
+        self.assertEqual(self.manager.stats()['checked_out'], 0)
+        self.assertIs(self.manager.connect(), kept)
+        kept.close()
+
+        def forget():
+            self.manager.connect().execute("SELECT 1")
+        self.manager.close_idle()
+        forget()
+        gc.collect()
+        stats = self.manager.stats()
+        self.assertEqual((stats['leaked'], stats['checked_out']), (2, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import unittest
+
+from cart_store import ensure_cart_items
+from db_indexes import INDEX_MIGRATIONS, apply_index_migrations, full_scans
+from jobs import ensure_jobs_table
+from product_listing import ensure_product_listing
+from referral_stats import ensure_referral_stats
+from referral_tree import ensure_referral_tree
+from wallet import ensure_wallet_ledger
+
+SCHEMA = '''
+    CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT, email TEXT, referred_by TEXT,
+                        total_spent REAL, created_at TIMESTAMP);
+    CREATE TABLE vendors (id INTEGER PRIMARY KEY, shop_name TEXT);
+    CREATE TABLE categories (id INTEGER PRIMARY KEY, name_ar TEXT, name_en TEXT);
+    CREATE TABLE products (id INTEGER PRIMARY KEY, name_ar TEXT, name_en TEXT, vendor_id INTEGER,
+                           created_at TIMESTAMP);
+    CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER, total_price REAL, created_at TIMESTAMP);
+    CREATE TABLE order_items (id INTEGER PRIMARY KEY, order_id INTEGER, product_id INTEGER,
+                              quantity REAL, total_price REAL);
+    CREATE TABLE referrals (id INTEGER PRIMARY KEY, referrer_id INTEGER, referred_id INTEGER,
+                            level INTEGER, commission_rate REAL);
+    CREATE TABLE commissions (id INTEGER PRIMARY KEY, user_id INTEGER, order_id INTEGER, referred_user_id INTEGER,
+                              amount REAL, type TEXT, status TEXT, created_at TIMESTAMP);
+    CREATE TABLE withdrawals (id INTEGER PRIMARY KEY, user_id INTEGER, amount REAL, created_at TIMESTAMP);
+    CREATE TABLE cart (id INTEGER PRIMARY KEY, user_id INTEGER, product_id INTEGER, quantity INTEGER);
+    CREATE TABLE wishlist (id INTEGER PRIMARY KEY, user_id INTEGER, product_id INTEGER);
+'''
+
+
+class TestIndexMigrations(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.executescript(SCHEMA)
+        ensure_product_listing(self.db)
+        ensure_cart_items(self.db)
+        ensure_jobs_table(self.db)
+        ensure_referral_tree(self.db)
+        ensure_wallet_ledger(self.db)
+        ensure_referral_stats(self.db)
+
+    def test_hot_queries_use_indexes(self):
+        self.assertTrue(full_scans(self.db))
+        applied, skipped = apply_index_migrations(self.db)
+        self.assertEqual(len(applied), len(INDEX_MIGRATIONS))
+        self.assertEqual(skipped, [])
+        self.assertEqual(full_scans(self.db), [])
+
+    def test_migrations_are_recorded_and_retried(self):
+        self.db.execute("DROP TABLE wishlist")
+        applied, skipped = apply_index_migrations(self.db)
+        self.assertEqual(skipped, ['idx_wishlist_user'])
+        self.assertIn(('products:wishlist_count', 'error: no such table: wishlist'), full_scans(self.db))
+
+        self.db.execute("CREATE TABLE wishlist (id INTEGER PRIMARY KEY, user_id INTEGER, product_id INTEGER)")
+        self.assertEqual(apply_index_migrations(self.db), (['idx_wishlist_user'], []))
+        self.assertEqual(apply_index_migrations(self.db), ([], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
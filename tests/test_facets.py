@@ -0,0 +1,51 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import unittest
+
+from facets import ensure_facet_triggers, get_facets, invalidate_facets
+
+
+class TestFacetCache(unittest.TestCase):
+    def setUp(self):
+        invalidate_facets()
+        self.db = sqlite3.connect(':memory:')
+        self.db.execute("CREATE TABLE categories (id INTEGER PRIMARY KEY, name_ar TEXT, name_en TEXT, "
+                        "icon TEXT, status TEXT DEFAULT 'active')")
+        self.db.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, category_id INTEGER, sub_category TEXT, "
+                        "origin TEXT, brand TEXT, status TEXT DEFAULT 'active', stock_quantity REAL)")
+        self.db.executemany("INSERT INTO categories (id, name_ar, name_en) VALUES (?, ?, ?)",
+                            [(1, 'تمور', 'Dates'), (2, 'أرز', 'Rice')])
+        self.db.executemany("INSERT INTO products (category_id, sub_category, origin, brand) VALUES (?, ?, ?, ?)",
+                            [(1, 'Sukkari', 'KSA', 'Bateel'), (1, 'Ajwa', 'KSA', 'Bateel'),
+                             (2, None, 'India', 'Tilda'), (2, None, 'India', '')])
+        ensure_facet_triggers(self.db)
+
+    def test_counts_in_one_pass(self):
+        facets = get_facets(self.db, 'en')
+        self.assertEqual([(c['name_en'], c['product_count']) for c in facets['categories']],
+                         [('Dates', 2), ('Rice', 2)])
+        self.assertEqual(facets['brands'], [{'value': 'Bateel', 'count': 2}, {'value': 'Tilda', 'count': 1}])
+        self.assertEqual([s['value'] for s in facets['sub_categories']['1']], ['Ajwa', 'Sukkari'])
+        self.assertEqual([c['id'] for c in get_facets(self.db, 'ar')['categories']], [2, 1])
+
+    def test_cache_follows_catalog_writes(self):
+        first = get_facets(self.db, 'en')
+        self.assertIs(get_facets(self.db, 'en'), first)
+
+        # Stock changes do not touch facets
+        self.db.execute("UPDATE products SET stock_quantity = 5")
+        self.assertIs(get_facets(self.db, 'en'), first)
+
+        self.db.execute("UPDATE products SET brand = 'Al Madina' WHERE id = 1")
+        brands = {b['value']: b['count'] for b in get_facets(self.db, 'en')['brands']}
+        self.assertEqual(brands, {'Al Madina': 1, 'Bateel': 1, 'Tilda': 1})
+
+        self.db.execute("UPDATE categories SET status = 'inactive' WHERE id = 2")
+        self.assertEqual([c['id'] for c in get_facets(self.db, 'en')['categories']], [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
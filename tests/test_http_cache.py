@@ -0,0 +1,110 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask
+
+from database import connection_manager
+from http_cache import cached_json
+from migrations import apply_migrations
+
+
+class TestCachedJson(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        payload = {'products': [{'id': i, 'name': f'تمر {i}'} for i in range(50)]}
+
+        @app.route('/listing')
+        def listing():
+            return cached_json(payload)
+
+        self.client = app.test_client()
+
+    def test_etag_and_not_modified(self):
+        response = self.client.get('/listing')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()['products']), 50)
+        etag = response.headers['ETag']
+
+        again = self.client.get('/listing', headers={'If-None-Match': etag})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.data, b'')
+
+    def test_gzip_when_accepted(self):
+        response = self.client.get('/listing', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(len(json.loads(gzip.decompress(response.data))['products']), 50)
+
+        plain = self.client.get('/listing')
+        self.assertNotEqual(plain.headers['ETag'], response.headers['ETag'])
+        self.assertEqual(self.client.get('/listing', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']}).status_code, 304)
+
+
+class TestProductFilterEndpoint(unittest.TestCase):
+    def setUp(self):
+        from app import app
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # Idle connections keep their file, so drop them whenever the path changes
+        original = connection_manager.path
+        connection_manager.close_idle()
+        connection_manager.path = os.path.join(directory, 'shop.db')
+        self.addCleanup(setattr, connection_manager, 'path', original)
+        self.addCleanup(connection_manager.close_idle)
+
+        db = connection_manager.connect()
+        apply_migrations(db)
+        db.execute("INSERT INTO categories (id, name_ar, name_en) VALUES (2, 'تمور', 'Dates')")
+        # Odd ids in category 2, even in 1; product 39 is out of stock
+        db.executemany('''
+            INSERT INTO products (id, name_en, name_ar, price, sale_price, stock_quantity, status, category_id)
+            VALUES (?, ?, ?, ?, ?, ?, 'active', ?)
+        ''', [(i, f'Dates {i}', f'تمر {i}', 2.0 + i, 1.5 + i, 0 if i == 39 else 10, 2 if i % 2 else 1)
+              for i in range(1, 41)])
+        db.commit()
+        db.close()
+        self.client = app.test_client()
+
+    def test_filters_compact_payload_etag_and_gzip(self):
+        url = '/api/products/filter?category=2&min_price=10&sort_by=price_high&limit=48'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertTrue(data['success'])
+        self.assertEqual([card['id'] for card in data['products']], list(range(37, 8, -2)))
+        self.assertIsNone(data['next'])
+
+        # Only the card fields, no whitespace between tokens
+        self.assertEqual(set(data['products'][0]), {'id', 'name', 'vendor', 'price', 'retail_price',
+                                                    'discount_percent', 'stock', 'image', 'rating',
+                                                    'reviews', 'url'})
+        self.assertEqual(data['products'][0]['name'], 'تمر 37')
+        self.assertEqual(response.data, json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode())
+
+        etag = response.headers['ETag']
+        again = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.data, b'')
+
+        zipped = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(zipped.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(zipped.data), response.data)
+        self.assertNotEqual(zipped.headers['ETag'], etag)
+
+        # A different filter is a different body and tag
+        other = self.client.get('/api/products/filter?category=1&limit=48', headers={'If-None-Match': etag})
+        self.assertEqual(other.status_code, 200)
+        self.assertEqual(len(other.get_json()['products']), 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
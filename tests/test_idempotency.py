@@ -0,0 +1,163 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from flask import Flask, jsonify, redirect, request, session
+
+import idempotency
+from idempotency import ensure_idempotency_keys, idempotent, purge_expired, reserve
+
+
+class TestIdempotentRoutes(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'keys.db')
+        db = self.connect()
+        ensure_idempotency_keys(db)
+        db.commit()
+        db.close()
+        self.calls = []
+
+        app = Flask(__name__)
+        app.secret_key = 'test'
+        app.testing = True
+
+        @app.route('/login/<int:user_id>')
+        def login(user_id):
+            session['user_id'] = user_id
+            return 'ok'
+
+        @app.route('/withdraw', methods=['POST'])
+        @idempotent(connect=self.connect)
+        def withdraw():
+            self.calls.append(request.json['amount'])
+            if request.json['amount'] < 0:
+                raise ValueError('boom')
+            return jsonify({'success': True, 'withdrawal': len(self.calls)})
+
+        self.hold = None
+
+        @app.route('/checkout', methods=['GET', 'POST'])
+        @idempotent(connect=self.connect, result_endpoint='orders')
+        def checkout():
+            self.calls.append(request.form.get('shipping_address'))
+            if self.hold:
+                self.hold.wait(5)
+            return redirect(f'/orders/{len(self.calls)}')
+
+        @app.route('/orders')
+        def orders():
+            return 'orders'
+
+        self.app = app
+
+        self.client = app.test_client()
+        self.client.get('/login/7')
+
+    def connect(self):
+        db = sqlite3.connect(self.path)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def test_repeat_replays_first_response(self):
+        first = self.client.post('/withdraw', json={'amount': 10}, headers={'Idempotency-Key': 'k1'})
+        again = self.client.post('/withdraw', json={'amount': 10}, headers={'Idempotency-Key': 'k1'})
+        self.assertEqual(first.get_json(), {'success': True, 'withdrawal': 1})
+        self.assertEqual(again.get_json(), first.get_json())
+        self.assertEqual(again.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.calls, [10])
+
+        # Other keys, other users and keyless requests are not affected
+        self.client.post('/withdraw', json={'amount': 10}, headers={'Idempotency-Key': 'k2'})
+        self.client.post('/withdraw', json={'amount': 10})
+        self.client.get('/login/8')
+        self.client.post('/withdraw', json={'amount': 10}, headers={'Idempotency-Key': 'k1'})
+        self.assertEqual(len(self.calls), 4)
+
+    def test_form_key_and_redirect(self):
+        form = {'shipping_address': 'Kuwait City', 'idempotency_key': 'form-1'}
+        first = self.client.post('/checkout', data=form)
+        again = self.client.post('/checkout', data=form)
+        self.assertEqual(again.status_code, 302)
+        self.assertEqual(again.headers['Location'], first.headers['Location'])
+        self.assertEqual(self.calls, ['Kuwait City'])
+        self.client.get('/checkout')
+        self.assertEqual(len(self.calls), 2)
+
+    def double_click(self, form):
+        """Two concurrent posts of one form; returns (first, second) responses"""
+        self.hold = threading.Event()
+        responses = {}
+
+        def post(name):
+            client = self.app.test_client()
+            client.get('/login/7')
+            responses[name] = client.post('/checkout', data=form)
+
+        first = threading.Thread(target=post, args=('first',))
+        first.start()
+        while not self.calls:
+            time.sleep(0.01)
+        second = threading.Thread(target=post, args=('second',))
+        second.start()
+        return first, second, responses
+
+    def test_double_clicked_form_replays_first_response(self):
+        first, second, responses = self.double_click({'shipping_address': 'Salmiya', 'idempotency_key': 'dbl'})
+        time.sleep(0.3)  # the repeat is now waiting on the first request
+        self.hold.set()
+        first.join()
+        second.join()
+        self.assertEqual(self.calls, ['Salmiya'])
+        self.assertEqual(responses['second'].status_code, 302)
+        self.assertEqual(responses['second'].headers['Location'], responses['first'].headers['Location'])
+        self.assertEqual(responses['second'].headers['Idempotent-Replayed'], 'true')
+
+    def test_double_clicked_form_redirects_when_first_is_slow(self):
+        wait = idempotency.REPLAY_WAIT
+        idempotency.REPLAY_WAIT = 0.2
+        self.addCleanup(setattr, idempotency, 'REPLAY_WAIT', wait)
+        first, second, responses = self.double_click({'shipping_address': 'Jahra', 'idempotency_key': 'slow'})
+        second.join()
+        self.hold.set()
+        first.join()
+        self.assertEqual(self.calls, ['Jahra'])
+        self.assertEqual(responses['second'].status_code, 303)
+        self.assertTrue(responses['second'].headers['Location'].endswith('/orders'))
+
+    def test_mismatch_in_progress_and_errors(self):
+        self.client.post('/withdraw', json={'amount': 10}, headers={'Idempotency-Key': 'k1'})
+        response = self.client.post('/withdraw', json={'amount': 99}, headers={'Idempotency-Key': 'k1'})
+        self.assertEqual(response.status_code, 422)
+
+        db = self.connect()
+        db.execute("UPDATE idempotency_keys SET status = 'in_progress' WHERE key = 'k1'")
+        db.commit()
+        response = self.client.post('/withdraw', json={'amount': 10}, headers={'Idempotency-Key': 'k1'})
+        self.assertEqual(response.status_code, 409)
+
+        # A request that raised keeps no key, so the retry runs
+        with self.assertRaises(ValueError):
+            self.client.post('/withdraw', json={'amount': -1}, headers={'Idempotency-Key': 'k3'})
+        self.assertIsNone(reserve(db, '7', 'k3', 'y'))
+        db.close()
+        self.assertEqual(self.calls, [10, -1])
+
+    def test_expired_keys(self):
+        db = self.connect()
+        self.assertIsNone(reserve(db, '7', 'old', 'x', now=time.time() - 120))
+        self.assertIsNone(reserve(db, '7', 'old', 'y'))  # stuck in progress: taken over
+        self.assertEqual(purge_expired(db, now=time.time() + 120), 1)
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
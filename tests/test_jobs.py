@@ -0,0 +1,166 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import time
+import unittest
+
+import jobs
+from jobs import claim, enqueue, ensure_jobs_table, job_counts, job_handler, replay, run_job, run_pending
+from orders import refresh_order_stats
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.row_factory = sqlite3.Row
+        ensure_jobs_table(self.db)
+        self.db.execute("CREATE TABLE ledger (note TEXT)")
+        self.db.commit()
+        self.addCleanup(jobs.HANDLERS.pop, 'note', None)
+        self.calls = 0
+
+        @job_handler('note')
+        def note(db, payload):
+            self.calls += 1
+            db.execute("INSERT INTO ledger (note) VALUES (?)", (payload['text'],))
+            if payload.get('fail'):
+                raise RuntimeError('smtp down')
+
+    def notes(self):
+        return [row[0] for row in self.db.execute("SELECT note FROM ledger")]
+
+    def test_dedupe_and_run(self):
+        self.assertIsNotNone(enqueue(self.db, 'note', {'text': 'a'}, dedupe_key='order:1'))
+        self.assertIsNone(enqueue(self.db, 'note', {'text': 'a'}, dedupe_key='order:1'))
+        enqueue(self.db, 'note', {'text': 'later'}, delay=60)
+        self.db.commit()
+
+        self.assertEqual(run_pending(self.db, 'w1'), {'done': 1})
+        self.assertEqual(self.notes(), ['a'])
+        self.assertEqual(job_counts(self.db), {'done': 1, 'pending': 1})
+
+    def test_after_commit_callback_runs_only_once_committed(self):
+        seen = []
+        self.addCleanup(jobs.HANDLERS.pop, 'cached', None)
+
+        @job_handler('cached')
+        def cached(db, payload):
+            db.execute("INSERT INTO ledger (note) VALUES ('c')")
+            if payload.get('fail'):
+                raise RuntimeError('boom')
+            return lambda: seen.append(self.db.in_transaction)
+
+        enqueue(self.db, 'cached', {'fail': True}, max_attempts=1)
+        enqueue(self.db, 'cached')
+        self.db.commit()
+        self.assertEqual(run_pending(self.db, 'w1'), {'failed': 1, 'done': 1})
+        self.assertEqual(seen, [False])
+
+    def test_failure_retries_with_backoff_then_fails(self):
+        job_id = enqueue(self.db, 'note', {'text': 'x', 'fail': True}, max_attempts=2)
+        self.db.commit()
+
+        self.assertEqual(run_job(self.db, claim(self.db, 'w1'), 'w1'), 'pending')
+        self.assertEqual(self.notes(), [])  # the handler's writes rolled back
+        job = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        self.assertGreater(job['run_after'], time.time() + jobs.RETRY_BASE - 5)
+        self.assertIn('smtp down', job['last_error'])
+        self.assertIsNone(claim(self.db, 'w1'))
+
+        self.assertEqual(run_job(self.db, claim(self.db, 'w1', now=job['run_after'] + 1), 'w1'), 'failed')
+        self.assertEqual(job_counts(self.db), {'failed': 1})
+
+        self.db.execute("UPDATE jobs SET payload = ? WHERE id = ?", ('{"text": "x"}', job_id))
+        self.assertEqual(replay(self.db, failed=True), 1)
+        self.assertEqual(run_pending(self.db, 'w1'), {'done': 1})
+        self.assertEqual(self.notes(), ['x'])
+
+    def test_expired_lease_is_reclaimed_and_stale_run_discarded(self):
+        enqueue(self.db, 'note', {'text': 'once'})
+        self.db.commit()
+        first = claim(self.db, 'w1')
+        self.assertIsNone(claim(self.db, 'w2'))
+
+        second = claim(self.db, 'w2', now=time.time() + jobs.LEASE_SECONDS + 1)
+        self.assertEqual(second['attempts'], 2)
+        self.assertEqual(run_job(self.db, second, 'w2'), 'done')
+        self.assertEqual(run_job(self.db, first, 'w1'), 'lost')
+        self.assertEqual(self.notes(), ['once'])
+        self.assertEqual(self.calls, 2)
+
+    def test_unknown_kind_is_retried_not_lost(self):
+        enqueue(self.db, 'missing')
+        self.db.commit()
+        self.assertEqual(run_pending(self.db, 'w1'), {'pending': 1})
+
+
+class TestWorkerHandlers(unittest.TestCase):
+    def test_worker_app_registers_every_queued_kind(self):
+        import app  # the module flask jobs-worker runs under
+        for kind in ('order_commissions', 'order_stats', 'payout_email', 'purge_idempotency_keys',
+                     'wallet_snapshots'):
+            self.assertIn(kind, jobs.HANDLERS)
+
+    def test_order_commissions_use_the_worker_connection(self):
+        import app  # registers the order_commissions handler
+        from commission_engine import ensure_commission_settings
+        from referral_stats import ensure_referral_stats
+        from referral_tree import add_referral, ensure_referral_tree
+        from wallet import ensure_wallet_ledger
+
+        db = sqlite3.connect(':memory:')
+        db.row_factory = sqlite3.Row
+        db.executescript('''
+            CREATE TABLE users (id INTEGER PRIMARY KEY, wallet_balance REAL DEFAULT 0,
+                                total_commission REAL DEFAULT 0, direct_referrals INTEGER DEFAULT 0,
+                                indirect_referrals INTEGER DEFAULT 0, total_referrals INTEGER DEFAULT 0);
+            CREATE TABLE referrals (id INTEGER PRIMARY KEY, referrer_id INTEGER, referred_id INTEGER, level INTEGER);
+            CREATE TABLE products (id INTEGER PRIMARY KEY, vendor_id INTEGER);
+            CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER, total_price REAL, created_at TIMESTAMP);
+            CREATE TABLE order_items (id INTEGER PRIMARY KEY, order_id INTEGER, product_id INTEGER, total_price REAL);
+            CREATE TABLE commissions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, order_id INTEGER,
+                                      referred_user_id INTEGER, amount REAL, commission_rate REAL, type TEXT,
+                                      description TEXT, status TEXT, created_at TIMESTAMP);
+            INSERT INTO users (id) VALUES (1), (2);
+            INSERT INTO products VALUES (1, NULL);
+            INSERT INTO orders VALUES (1, 2, 100.0, '2026-03-01');
+            INSERT INTO order_items (order_id, product_id, total_price) VALUES (1, 1, 100.0);
+        ''')
+        for setup in (ensure_jobs_table, ensure_referral_tree, ensure_commission_settings, ensure_wallet_ledger,
+                      ensure_referral_stats):
+            setup(db)
+        add_referral(db, 1, 2)
+        enqueue(db, 'order_commissions', {'order_id': 1})
+        db.commit()
+
+        # No app context: the handler must write through the connection it is given
+        self.assertEqual(run_pending(db, 'w1'), {'done': 1})
+        self.assertEqual([tuple(row) for row in db.execute("SELECT user_id, amount FROM commissions")], [(1, 5.0)])
+        self.assertEqual(db.execute("SELECT wallet_balance FROM users WHERE id = 1").fetchone()[0], 5.0)
+
+
+class TestOrderStats(unittest.TestCase):
+    def test_recount_is_idempotent(self):
+        db = sqlite3.connect(':memory:')
+        db.row_factory = sqlite3.Row
+        db.executescript('''
+            CREATE TABLE users (id INTEGER PRIMARY KEY, total_orders INTEGER, total_spent REAL);
+            CREATE TABLE products (id INTEGER PRIMARY KEY, total_sales INTEGER DEFAULT 0);
+            CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER, total_price REAL);
+            CREATE TABLE order_items (id INTEGER PRIMARY KEY, order_id INTEGER, product_id INTEGER);
+            INSERT INTO users VALUES (1, 0, 0);
+            INSERT INTO products (id) VALUES (1), (2);
+            INSERT INTO orders VALUES (1, 1, 5.0), (2, 1, 2.5);
+            INSERT INTO order_items (order_id, product_id) VALUES (1, 1), (1, 2), (2, 1);
+        ''')
+        for _ in range(2):
+            self.assertEqual(refresh_order_stats(db, 2), 1)
+        self.assertEqual(tuple(db.execute("SELECT total_orders, total_spent FROM users").fetchone()), (2, 7.5))
+        self.assertEqual([row[0] for row in db.execute("SELECT total_sales FROM products ORDER BY id")], [2, 0])
+        self.assertIsNone(refresh_order_stats(db, 99))
+
+
+if __name__ == '__main__':
+    unittest.main()
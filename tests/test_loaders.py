@@ -0,0 +1,48 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import unittest
+
+from loaders import fetch_by_ids, load_product_images
+
+
+class TestBatchLoaders(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript('''
+            CREATE TABLE products (id INTEGER PRIMARY KEY, name_en TEXT);
+            CREATE TABLE product_images (
+                id INTEGER PRIMARY KEY, product_id INTEGER, image_url TEXT, is_main INTEGER
+            );
+            INSERT INTO products VALUES (1, 'Rice'), (2, 'Dates'), (3, 'Tea');
+            INSERT INTO product_images (product_id, image_url, is_main) VALUES
+                (1, 'rice_side.jpg', 0), (1, 'rice.jpg', 1), (2, 'dates.jpg', 1);
+        ''')
+        self.statements = []
+        self.db.set_trace_callback(self.statements.append)
+
+    def test_images_attached_with_one_query(self):
+        products = [{'id': 1}, {'id': 2}, {'id': 3}]
+        load_product_images(self.db, products)
+
+        self.assertEqual(products[0]['images'], ['rice.jpg', 'rice_side.jpg'])
+        self.assertEqual(products[1]['images'], ['dates.jpg'])
+        self.assertEqual(products[2]['images'], [])
+        self.assertEqual(len(self.statements), 1)
+
+    def test_fetch_by_ids(self):
+        found = fetch_by_ids(self.db, 'products', [3, 1, 3, 99])
+        self.assertEqual(sorted(found), [1, 3])
+        self.assertEqual(found[3]['name_en'], 'Tea')
+        self.assertEqual(len(self.statements), 1)
+
+    def test_empty_page_runs_no_query(self):
+        self.assertEqual(load_product_images(self.db, []), [])
+        self.assertEqual(self.statements, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
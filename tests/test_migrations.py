@@ -0,0 +1,61 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import unittest
+
+import migrations
+from db_indexes import full_scans
+from migrations import (LATEST_VERSION, apply_migrations, pending_migrations, refresh_schema,
+                        schema_version, table_columns)
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.row_factory = sqlite3.Row
+
+    def test_fresh_database_reaches_latest_version(self):
+        applied = apply_migrations(self.db)
+        self.assertEqual(len(applied), len(migrations.MIGRATIONS))
+        self.assertEqual(schema_version(self.db), LATEST_VERSION)
+        self.assertEqual(pending_migrations(self.db), [])
+        self.assertEqual(apply_migrations(self.db), [])
+        self.assertIn('product_listing', migrations.get_schema(self.db))
+        self.assertEqual(self.db.execute("SELECT COUNT(*) FROM admin_users").fetchone()[0], 1)
+        # Every hot query compiles against the migrated schema and uses an index
+        self.assertEqual(full_scans(self.db), [])
+
+    def test_legacy_tables_are_upgraded_in_place(self):
+        self.db.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT, email TEXT, password TEXT)")
+        self.db.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER, total_price REAL)")
+        self.db.execute("INSERT INTO orders (user_id, total_price) VALUES (1, 5.0)")
+        self.db.commit()
+
+        apply_migrations(self.db)
+        self.assertIn('created_at', table_columns(self.db, 'users'))
+        self.assertIsNotNone(self.db.execute("SELECT created_at FROM orders").fetchone()[0])
+
+    def test_target_stops_early(self):
+        self.assertEqual(apply_migrations(self.db, target=2), ['baseline_tables', 'users_orders_created_at'])
+        self.assertEqual(schema_version(self.db), 2)
+
+    def test_failed_step_is_not_recorded(self):
+        def broken(db):
+            db.execute("CREATE TABLE half_done (id INTEGER)")
+            db.execute("SELECT * FROM no_such_table")
+
+        original = migrations.MIGRATIONS
+        migrations.MIGRATIONS = original + ((LATEST_VERSION + 1, 'broken', broken),)
+        try:
+            with self.assertRaises(sqlite3.OperationalError):
+                apply_migrations(self.db)
+        finally:
+            migrations.MIGRATIONS = original
+        self.assertEqual(schema_version(self.db), LATEST_VERSION)
+        self.assertNotIn('half_done', refresh_schema(self.db))
+
+
+if __name__ == '__main__':
+    unittest.main()
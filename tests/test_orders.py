@@ -0,0 +1,114 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from cart_store import add_item, ensure_cart_items, item_count
+from orders import CheckoutError, OutOfStock, place_order
+
+SCHEMA = '''
+    CREATE TABLE users (id INTEGER PRIMARY KEY, total_orders INTEGER DEFAULT 0, total_spent REAL DEFAULT 0);
+    CREATE TABLE products (id INTEGER PRIMARY KEY, price REAL, stock_quantity REAL, total_sales INTEGER DEFAULT 0);
+    CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER, total_price REAL, shipping_address TEXT,
+                         notes TEXT, status TEXT);
+    CREATE TABLE order_items (id INTEGER PRIMARY KEY, order_id INTEGER, product_id INTEGER, quantity REAL,
+                              unit_price REAL, total_price REAL);
+'''
+
+
+class TestPlaceOrder(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'shop.db')
+        db = self.connect()
+        db.executescript(SCHEMA)
+        ensure_cart_items(db)
+        db.executemany("INSERT INTO users (id) VALUES (?)", [(i,) for i in range(1, 41)])
+        db.executemany("INSERT INTO products (id, price, stock_quantity) VALUES (?, ?, ?)",
+                       [(1, 2.0, 5), (2, 3.0, 100)])
+        db.commit()
+        db.close()
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def test_stored_cart_becomes_order(self):
+        db = self.connect()
+        add_item(db, 1, 1, 2)
+        add_item(db, 1, 2, 1)
+        db.commit()
+
+        order_id, total = place_order(db, 1, 'Kuwait City')
+        self.assertEqual(total, 7.0)
+        self.assertEqual(db.execute("SELECT COUNT(*) FROM order_items WHERE order_id = ?",
+                                    (order_id,)).fetchone()[0], 2)
+        self.assertEqual(db.execute("SELECT stock_quantity FROM products WHERE id = 1").fetchone()[0], 3)
+        self.assertEqual(item_count(db, 1), 0)
+        db.close()
+
+    def test_short_line_rejects_whole_order(self):
+        db = self.connect()
+        with self.assertRaises(OutOfStock) as raised:
+            place_order(db, 1, 'Salmiya', items=[{'product_id': 2, 'quantity': 1},
+                                                  {'product_id': 1, 'quantity': 6}])
+        self.assertEqual(raised.exception.product_ids, [1])
+        self.assertEqual(db.execute("SELECT COUNT(*) FROM orders").fetchone()[0], 0)
+        self.assertEqual(db.execute("SELECT stock_quantity FROM products WHERE id = 2").fetchone()[0], 100)
+        with self.assertRaises(CheckoutError):
+            place_order(db, 1, 'Salmiya', items=[])
+        db.close()
+
+    def test_failure_in_callback_rolls_back(self):
+        db = self.connect()
+
+        def broken(order_id):
+            raise sqlite3.OperationalError('commission table missing')
+
+        with self.assertRaises(sqlite3.OperationalError):
+            place_order(db, 1, 'Hawalli', items=[{'product_id': 1, 'quantity': 1}], on_placed=broken)
+        self.assertEqual(db.execute("SELECT stock_quantity FROM products WHERE id = 1").fetchone()[0], 5)
+        db.close()
+
+    def test_concurrent_buyers_never_oversell(self):
+        buyers = 40
+        results = []
+        start = threading.Barrier(buyers)
+
+        def buy(user_id):
+            db = self.connect()
+            try:
+                start.wait()
+                place_order(db, user_id, 'Farwaniya', items=[{'product_id': 1, 'quantity': 1},
+                                                              {'product_id': 2, 'quantity': 1}])
+                results.append('ok')
+            except OutOfStock:
+                results.append('short')
+            finally:
+                db.close()
+
+        threads = [threading.Thread(target=buy, args=(user_id,)) for user_id in range(1, buyers + 1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        db = self.connect()
+        self.assertEqual(results.count('ok'), 5)
+        self.assertEqual(results.count('short'), buyers - 5)
+        self.assertEqual(db.execute("SELECT stock_quantity FROM products WHERE id = 1").fetchone()[0], 0)
+        self.assertEqual(db.execute("SELECT stock_quantity FROM products WHERE id = 2").fetchone()[0], 95)
+        self.assertEqual(db.execute("SELECT COUNT(*) FROM orders").fetchone()[0], 5)
+        self.assertEqual(db.execute("SELECT COUNT(*) FROM order_items").fetchone()[0], 10)
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
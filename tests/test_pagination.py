@@ -0,0 +1,59 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import unittest
+
+from pagination import decode_cursor, encode_cursor, keyset_condition, keyset_order_by, keyset_page
+
+
+class TestKeysetPagination(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, price REAL)")
+        # Duplicate prices make the id tie-breaker matter
+        self.db.executemany("INSERT INTO products (price) VALUES (?)",
+                            [(float(i // 3),) for i in range(25)])
+
+    def fetch(self, limit, cursor=None):
+        columns = ('price', 'id')
+        direction = cursor['direction'] if cursor else 'next'
+        sql, params = 'SELECT price, id FROM products', []
+        if cursor:
+            condition, params = keyset_condition(columns, True, cursor['values'], direction)
+            sql += f' WHERE {condition}'
+        sql += f' ORDER BY {keyset_order_by(columns, True, direction)} LIMIT ?'
+        rows = [list(r) for r in self.db.execute(sql, params + [limit + 1])]
+        return keyset_page(rows, limit, direction)
+
+    def test_walk_forward_and_back(self):
+        expected = [list(r) for r in self.db.execute("SELECT price, id FROM products ORDER BY price DESC, id DESC")]
+
+        pages, cursor = [], None
+        while True:
+            rows, has_more = self.fetch(10, cursor)
+            pages.append(rows)
+            if not has_more:
+                break
+            cursor = decode_cursor(encode_cursor('price_high', rows[-1], 'next'), sort='price_high')
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual([len(p) for p in pages], [10, 10, 5])
+
+        cursor = decode_cursor(encode_cursor('price_high', pages[2][0], 'prev'))
+        rows, has_more = self.fetch(10, cursor)
+        self.assertEqual(rows, pages[1])
+        self.assertTrue(has_more)
+
+    def test_bad_tokens_are_ignored(self):
+        self.assertIsNone(decode_cursor('not-a-cursor'))
+        self.assertIsNone(decode_cursor(encode_cursor('newest', [1, 2]), sort='price_low'))
+        self.assertEqual(decode_cursor(encode_cursor('newest', ['٢٠٢٦', 2]))['values'], ['٢٠٢٦', 2])
+        # Wrong arity or non-scalar values never reach the SQL
+        self.assertIsNone(decode_cursor(encode_cursor('newest', [1]), sort='newest', columns=2))
+        self.assertIsNone(decode_cursor(encode_cursor('newest', [[1], {'a': 2}]), sort='newest', columns=2))
+        self.assertEqual(decode_cursor(encode_cursor('newest', [None, 2.5]), columns=2)['values'], [None, 2.5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import unittest
+
+from product_listing import ensure_product_listing, rebuild_product_listing
+
+
+class TestProductListing(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("CREATE TABLE categories (id INTEGER PRIMARY KEY, name_ar TEXT, name_en TEXT)")
+        self.db.execute("CREATE TABLE vendors (id INTEGER PRIMARY KEY, shop_name TEXT)")
+        self.db.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, name_ar TEXT, name_en TEXT, "
+                        "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, vendor_id INTEGER)")
+        self.db.execute("INSERT INTO categories VALUES (1, 'تمور', 'Dates')")
+        self.db.execute("INSERT INTO vendors VALUES (1, 'Dates House')")
+        ensure_product_listing(self.db)
+        self.db.execute("INSERT INTO products (id, name_ar, name_en, category_id, vendor_id, status, "
+                        "stock_quantity, sale_price, retail_price) "
+                        "VALUES (1, 'سكري', 'Sukkari', 1, 1, 'active', 5, 3.0, 4.0)")
+
+    def card(self, product_id=1):
+        return dict(self.db.execute("SELECT * FROM product_listing WHERE id = ?", (product_id,)).fetchone())
+
+    def test_card_follows_source_rows(self):
+        card = self.card()
+        self.assertEqual((card['category_name_en'], card['vendor_name'], card['discount_percent']),
+                         ('Dates', 'Dates House', 25))
+
+        self.db.execute("UPDATE products SET sale_price = 2.0 WHERE id = 1")
+        self.db.execute("UPDATE categories SET name_en = 'Premium Dates' WHERE id = 1")
+        self.db.execute("UPDATE vendors SET shop_name = 'Bateel' WHERE id = 1")
+        self.db.execute("INSERT INTO product_images (product_id, image_url, is_main) VALUES (1, 'a.jpg', 0)")
+        self.db.execute("INSERT INTO product_images (product_id, image_url, is_main) VALUES (1, 'b.jpg', 1)")
+        self.db.execute("INSERT INTO product_reviews (product_id, rating, status) VALUES (1, 4, 'approved')")
+
+        card = self.card()
+        self.assertEqual(card['discount_percent'], 50)
+        self.assertEqual(card['category_name_en'], 'Premium Dates')
+        self.assertEqual((card['vendor_name'], card['vendor_rating']), ('Bateel', 4.0))
+        self.assertEqual(card['main_image'], 'b.jpg')
+        self.assertEqual((card['product_rating'], card['review_count']), (4.0, 1))
+
+        self.db.execute("DELETE FROM products WHERE id = 1")
+        self.assertIsNone(self.db.execute("SELECT 1 FROM product_listing WHERE id = 1").fetchone())
+
+    def test_rebuild_matches_triggers(self):
+        self.db.execute("INSERT INTO product_reviews (product_id, rating, status) VALUES (1, 5, 'approved')")
+        self.db.execute("INSERT INTO product_images (product_id, image_url) VALUES (1, 'a.jpg')")
+        incremental = self.card()
+        self.assertEqual(rebuild_product_listing(self.db), 1)
+        self.assertEqual(self.card(), incremental)
+
+    def test_listing_uses_partial_index(self):
+        plan = ' '.join(row[3] for row in self.db.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM product_listing p "
+            "WHERE p.status = 'active' AND p.stock_quantity > 0 AND p.category_id = ? "
+            "ORDER BY p.created_at DESC, p.id DESC LIMIT 12", (1,)))
+        self.assertIn('idx_listing_category_newest', plan)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import unittest
+
+import query_stats
+from query_stats import InstrumentedConnection, finish_request_stats, normalize_sql, start_request_stats
+
+
+class TestQueryStats(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:', factory=InstrumentedConnection)
+        self.db.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT)")
+        self.db.executemany("INSERT INTO products (name) VALUES (?)", [('a',), ('b',), ('c',)])
+
+    def tearDown(self):
+        finish_request_stats()
+
+    def test_normalize(self):
+        self.assertEqual(normalize_sql("SELECT *  FROM products\n WHERE id = 42 AND name = 'it''s'"),
+                         "SELECT * FROM products WHERE id = ? AND name = ?")
+        self.assertEqual(normalize_sql("SELECT * FROM t WHERE id IN (?, ?, ?)"),
+                         "SELECT * FROM t WHERE id IN (...)")
+
+    def test_request_totals_and_n_plus_one(self):
+        stats = start_request_stats('products')
+        for product_id in range(1, 4):
+            self.db.execute(f"SELECT name FROM products WHERE id = {product_id}").fetchone()
+        cur = self.db.cursor()
+        cur.execute("SELECT COUNT(*) FROM products")
+
+        self.assertEqual(stats.count, 4)
+        self.assertEqual(stats.by_statement["SELECT name FROM products WHERE id = ?"], 3)
+        self.assertEqual(len(stats.slowest()), 4)
+        self.assertIn('desc="4 queries"', stats.server_timing())
+
+        old = query_stats.N_PLUS_ONE_THRESHOLD
+        query_stats.N_PLUS_ONE_THRESHOLD = 2
+        try:
+            with self.assertLogs('sooqkabeer.sql', level='WARNING') as logs:
+                self.assertIs(finish_request_stats(), stats)
+        finally:
+            query_stats.N_PLUS_ONE_THRESHOLD = old
+        self.assertIn('3 x SELECT name FROM products WHERE id = ?', logs.output[0])
+
+        # Nothing is collected outside a request
+        self.db.execute("SELECT 1")
+        self.assertEqual(stats.count, 4)
+
+    def test_slow_query_log(self):
+        old = query_stats.SLOW_QUERY_MS
+        query_stats.SLOW_QUERY_MS = 0.0
+        try:
+            with self.assertLogs('sooqkabeer.slow_sql', level='WARNING') as logs:
+                self.db.execute("SELECT name FROM products WHERE id = 7")
+        finally:
+            query_stats.SLOW_QUERY_MS = old
+        self.assertIn('SELECT name FROM products WHERE id = ?', logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import unittest
+
+from ratings import ensure_rating_stats, rebuild_rating_stats
+
+
+class TestRatingStats(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.execute("CREATE TABLE vendors (id INTEGER PRIMARY KEY, shop_name TEXT)")
+        self.db.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, vendor_id INTEGER)")
+        self.db.execute("INSERT INTO vendors (id, shop_name) VALUES (1, 'Dates House')")
+        self.db.executemany("INSERT INTO products (id, vendor_id) VALUES (?, 1)", [(1,), (2,)])
+        ensure_rating_stats(self.db)
+
+    def stats(self, product_id):
+        return self.db.execute("SELECT review_count, average_rating FROM product_rating_stats "
+                               "WHERE product_id = ?", (product_id,)).fetchone()
+
+    def vendor_rating(self):
+        return self.db.execute("SELECT rating FROM vendors WHERE id = 1").fetchone()[0]
+
+    def review(self, product_id, rating, status='approved'):
+        return self.db.execute("INSERT INTO product_reviews (product_id, rating, status) VALUES (?, ?, ?)",
+                               (product_id, rating, status)).lastrowid
+
+    def test_insert_approve_delete(self):
+        self.review(1, 5)
+        pending = self.review(1, 1, status='pending')
+        self.assertEqual(self.stats(1), (1, 5.0))
+
+        self.db.execute("UPDATE product_reviews SET status = 'approved' WHERE id = ?", (pending,))
+        self.assertEqual(self.stats(1), (2, 3.0))
+
+        other = self.review(2, 4)
+        self.assertEqual(self.vendor_rating(), 10 / 3)
+
+        self.db.execute("UPDATE product_reviews SET rating = 2 WHERE id = ?", (other,))
+        self.assertEqual(self.stats(2), (1, 2.0))
+
+        self.db.execute("DELETE FROM product_reviews WHERE product_id = 1")
+        self.assertEqual(self.stats(1), (0, 0.0))
+        self.assertEqual(self.vendor_rating(), 2.0)
+
+    def test_product_moves_to_another_vendor(self):
+        self.db.execute("INSERT INTO vendors (id, shop_name) VALUES (2, 'Spice Souq')")
+        for product_id, rating in [(1, 4), (1, 5), (2, 3)]:
+            self.review(product_id, rating)
+
+        self.db.execute("UPDATE products SET vendor_id = 2 WHERE id = 1")
+        self.assertEqual(self.vendor_rating(), 3.0)
+        self.assertEqual(self.db.execute("SELECT rating FROM vendors WHERE id = 2").fetchone()[0], 4.5)
+        moved = self.db.execute("SELECT * FROM vendor_rating_stats ORDER BY vendor_id").fetchall()
+        self.assertEqual(moved, [(1, 1, 3.0), (2, 2, 9.0)])
+
+        self.db.execute("UPDATE products SET vendor_id = NULL WHERE id = 2")
+        self.assertEqual(self.vendor_rating(), 0)
+        rebuild_rating_stats(self.db)
+        self.assertEqual(self.db.execute("SELECT * FROM vendor_rating_stats WHERE review_count > 0 "
+                                         "ORDER BY vendor_id").fetchall(), [(2, 2, 9.0)])
+
+    def test_rebuild_matches_triggers(self):
+        for product_id, rating in [(1, 4), (1, 5), (2, 3)]:
+            self.review(product_id, rating)
+        self.review(2, 1, status='rejected')
+        incremental = self.db.execute("SELECT * FROM product_rating_stats ORDER BY product_id").fetchall()
+        vendor = self.vendor_rating()
+
+        self.assertEqual(rebuild_rating_stats(self.db), 2)
+        self.assertEqual(self.db.execute("SELECT * FROM product_rating_stats ORDER BY product_id").fetchall(),
+                         incremental)
+        self.assertEqual(self.vendor_rating(), vendor)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import csv
+import io
+import sqlite3
+import unittest
+
+from pagination import encode_cursor
+from referral_lists import (COMMISSION_COLUMNS, DOWNLINE_COLUMNS, commission_query, downline_query, iter_csv, page,
+                            page_size)
+from referral_tree import add_referral, ensure_referral_tree
+
+
+class TestReferralLists(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript('''
+            CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT, email TEXT, created_at TIMESTAMP,
+                                is_active INTEGER DEFAULT 1, total_orders INTEGER DEFAULT 0,
+                                total_spent REAL DEFAULT 0, total_commission REAL DEFAULT 0,
+                                direct_referrals INTEGER DEFAULT 0, indirect_referrals INTEGER DEFAULT 0,
+                                total_referrals INTEGER DEFAULT 0);
+            CREATE TABLE referrals (id INTEGER PRIMARY KEY, referrer_id INTEGER, referred_id INTEGER, level INTEGER);
+            CREATE TABLE commissions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, order_id INTEGER,
+                                      referred_user_id INTEGER, amount REAL, commission_rate REAL, type TEXT,
+                                      status TEXT, description TEXT, created_at TIMESTAMP);
+        ''')
+        ensure_referral_tree(self.db)
+        # User 1 refers 2..26 directly; 2 refers 27..31
+        self.db.executemany("INSERT INTO users (id, username, email) VALUES (?, ?, ?)",
+                            [(i, f'user{i}', f'user{i}@example.com') for i in range(1, 32)])
+        for child in range(2, 27):
+            add_referral(self.db, 1, child)
+        for child in range(27, 32):
+            add_referral(self.db, 2, child)
+        self.db.executemany("INSERT INTO commissions (user_id, referred_user_id, amount, type) VALUES (1, ?, ?, ?)",
+                            [(i, 1.0, 'referral' if i % 3 else 'signup_bonus') for i in range(2, 14)])
+
+    def walk(self, query, sort, limit):
+        ids, token = [], None
+        while True:
+            result = page(self.db, query, sort, token, limit)
+            ids.extend(row['id'] for row in result['items'])
+            token = result['next_cursor']
+            if token is None:
+                return ids
+
+    def test_downline_pages(self):
+        self.assertEqual(self.walk(downline_query(1), 'downline', 7), list(range(31, 1, -1)))
+        self.assertEqual(self.walk(downline_query(1, level=2), 'downline', 2), [31, 30, 29, 28, 27])
+        first = page(self.db, downline_query(1, level=1), 'downline', limit=3)
+        self.assertEqual([(row['id'], row['level']) for row in first['items']], [(26, 1), (25, 1), (24, 1)])
+        self.assertEqual(first['items'][0]['email'], 'user26@example.com')
+        # Indirect referrals are listed without their email
+        self.assertIsNone(page(self.db, downline_query(1, level=2), 'downline', limit=1)['items'][0]['email'])
+
+        # A cursor from another listing or a garbled one starts from the top
+        self.assertEqual(page(self.db, downline_query(1), 'downline', encode_cursor('commissions', [5]), 2)
+                         ['items'][0]['id'], 31)
+        self.assertEqual(page(self.db, downline_query(1), 'downline', 'not-a-cursor', 2)['items'][0]['id'], 31)
+
+    def test_commission_pages(self):
+        self.assertEqual(self.walk(commission_query(1), 'commissions', 5), list(range(12, 0, -1)))
+        self.assertEqual(self.walk(commission_query(1, 'signup_bonus'), 'commissions', 5), [11, 8, 5, 2])
+        self.assertEqual(page(self.db, commission_query(2), 'commissions'), {'items': [], 'next_cursor': None})
+        self.assertEqual((page_size('500'), page_size('0'), page_size('x')), (200, 1, 50))
+
+    def test_csv_streams_in_chunks(self):
+        self.db.execute("UPDATE users SET username = '=HYPERLINK(1)' WHERE id = 31")
+        chunks = list(iter_csv(self.db, downline_query(1), DOWNLINE_COLUMNS, chunk=10))
+        self.assertEqual(len(chunks), 4)  # 30 rows in chunks of 10, then the remainder
+        rows = list(csv.reader(io.StringIO(''.join(chunks))))
+        self.assertEqual(tuple(rows[0]), DOWNLINE_COLUMNS)
+        self.assertEqual(len(rows), 31)
+        self.assertEqual(rows[1][:4], ['31', "'=HYPERLINK(1)", '', '2'])
+        self.assertEqual(rows[-1][:4], ['2', 'user2', 'user2@example.com', '1'])
+
+        rows = list(csv.reader(io.StringIO(''.join(iter_csv(self.db, commission_query(1), COMMISSION_COLUMNS)))))
+        self.assertEqual([row[0] for row in rows[1:4]], ['12', '11', '10'])
+        self.assertEqual(rows[1][8], 'user13')
+
+
+if __name__ == '__main__':
+    unittest.main()
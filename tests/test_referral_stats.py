@@ -0,0 +1,81 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import unittest
+
+from commission_engine import ensure_commission_settings, settle_orders
+from referral_stats import (ensure_referral_stats, level_stats, monthly_stats, rebuild_referral_stats,
+                            record_commissions, record_signup, user_stats)
+from referral_tree import add_referral, ensure_referral_tree
+from wallet import ensure_wallet_ledger
+
+SCHEMA = '''
+    CREATE TABLE users (id INTEGER PRIMARY KEY, wallet_balance REAL DEFAULT 0, total_commission REAL DEFAULT 0,
+                        direct_referrals INTEGER DEFAULT 0, indirect_referrals INTEGER DEFAULT 0,
+                        total_referrals INTEGER DEFAULT 0, is_active INTEGER DEFAULT 1);
+    CREATE TABLE referrals (id INTEGER PRIMARY KEY, referrer_id INTEGER, referred_id INTEGER, level INTEGER);
+    CREATE TABLE products (id INTEGER PRIMARY KEY, vendor_id INTEGER);
+    CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER, total_price REAL, created_at TIMESTAMP);
+    CREATE TABLE order_items (id INTEGER PRIMARY KEY, order_id INTEGER, product_id INTEGER, total_price REAL);
+    CREATE TABLE commissions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, order_id INTEGER,
+                              referred_user_id INTEGER, amount REAL, commission_rate REAL, type TEXT,
+                              description TEXT, status TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+'''
+
+
+class TestReferralStats(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        for setup in (ensure_referral_tree, ensure_commission_settings, ensure_wallet_ledger,
+                      ensure_referral_stats):
+            setup(self.db)
+        # 1 -> 2 -> 3 and 1 -> 4 (inactive); 3 and 4 buy
+        self.db.executemany("INSERT INTO users (id, is_active) VALUES (?, ?)", [(1, 1), (2, 1), (3, 1), (4, 0)])
+        for parent, child in [(1, 2), (2, 3), (1, 4)]:
+            add_referral(self.db, parent, child)
+            record_signup(self.db, child)
+        self.db.execute("INSERT INTO products VALUES (1, NULL)")
+        self.db.executemany("INSERT INTO orders VALUES (?, ?, ?, ?)",
+                            [(1, 3, 100.0, '2026-03-01'), (2, 4, 20.0, '2026-03-02')])
+        self.db.executemany("INSERT INTO order_items (order_id, product_id, total_price) VALUES (?, 1, ?)",
+                            [(1, 100.0), (2, 20.0)])
+
+    def snapshot(self):
+        return ([tuple(row) for row in self.db.execute("SELECT * FROM referral_user_stats ORDER BY user_id")],
+                [tuple(row) for row in self.db.execute("SELECT * FROM referral_level_stats ORDER BY 1, 2")],
+                [tuple(row) for row in self.db.execute("SELECT * FROM referral_monthly_stats ORDER BY 1, 2")])
+
+    def test_signups_and_settlement_roll_up(self):
+        settle_orders(self.db, [1, 2])
+        settle_orders(self.db, [1, 2])  # already settled, nothing is counted twice
+
+        self.assertEqual(user_stats(self.db, 1),
+                         {'referrals': 3, 'direct_referrals': 2, 'active_referrals': 1, 'direct_sales': 20.0,
+                          'commission': 3.5, 'commissions': 2})
+        self.assertEqual(level_stats(self.db, 1), [
+            {'level': 1, 'referrals': 2, 'orders': 1, 'sales': 20.0, 'commission': 1.0, 'commissions': 1},
+            {'level': 2, 'referrals': 1, 'orders': 1, 'sales': 100.0, 'commission': 2.5, 'commissions': 1}])
+        self.assertEqual(user_stats(self.db, 3)['referrals'], 0)
+        month = self.db.execute("SELECT strftime('%Y-%m', 'now')").fetchone()[0]
+        self.assertEqual(monthly_stats(self.db, 2), [{'month': month, 'commission': 5.0, 'commissions': 1}])
+
+    def test_single_commission_and_rebuild(self):
+        settle_orders(self.db, [1])
+        self.db.execute('''
+            INSERT INTO commissions (user_id, referred_user_id, amount, type, created_at)
+            VALUES (1, 2, 5.0, 'signup_bonus', '2025-12-31 10:00:00')
+        ''')
+        record_commissions(self.db, self.db.execute("SELECT MAX(id) - 1 FROM commissions").fetchone()[0])
+        self.assertEqual(monthly_stats(self.db, 1)[-1], {'month': '2025-12', 'commission': 5.0, 'commissions': 1})
+
+        incremental = self.snapshot()
+        self.assertEqual(rebuild_referral_stats(self.db), 2)
+        self.assertEqual(self.snapshot(), incremental)
+
+
+if __name__ == '__main__':
+    unittest.main()
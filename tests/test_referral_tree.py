@@ -0,0 +1,61 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import unittest
+
+from referral_tree import (add_referral, commission_rates, downline_counts, ensure_referral_tree, paid_upline,
+                           set_commission_rate, subtree_sales, upline)
+
+
+class TestReferralTree(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript('''
+            CREATE TABLE users (id INTEGER PRIMARY KEY, direct_referrals INTEGER DEFAULT 0,
+                                indirect_referrals INTEGER DEFAULT 0, total_referrals INTEGER DEFAULT 0);
+            CREATE TABLE referrals (id INTEGER PRIMARY KEY, referrer_id INTEGER, referred_id INTEGER,
+                                    level INTEGER, commission_rate REAL);
+            CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER, total_price REAL);
+        ''')
+        self.db.executemany("INSERT INTO users (id) VALUES (?)", [(i,) for i in range(1, 8)])
+        # Legacy rows: 1 -> 2 -> 3, plus the old level 2 copy that the closure replaces
+        self.db.executemany("INSERT INTO referrals (referrer_id, referred_id, level) VALUES (?, ?, ?)",
+                            [(1, 2, 1), (2, 3, 1), (1, 3, 2)])
+        ensure_referral_tree(self.db)
+
+    def counters(self, user_id):
+        return tuple(self.db.execute("SELECT direct_referrals, indirect_referrals, total_referrals "
+                                     "FROM users WHERE id = ?", (user_id,)).fetchone())
+
+    def test_backfill_and_arbitrary_depth(self):
+        self.assertEqual(upline(self.db, 3), [(2, 1), (1, 2)])
+        for parent, child in [(3, 4), (4, 5), (5, 6)]:
+            add_referral(self.db, parent, child)
+        self.assertEqual(upline(self.db, 6), [(5, 1), (4, 2), (3, 3), (2, 4), (1, 5)])
+        self.assertEqual(upline(self.db, 6, max_depth=2), [(5, 1), (4, 2)])
+        self.assertEqual(downline_counts(self.db, 1), {1: 1, 2: 1, 3: 1, 4: 1, 5: 1})
+        self.assertEqual(self.counters(3), (1, 2, 3))
+        self.assertEqual(self.counters(1), (0, 3, 3))  # backfilled users keep their old counters
+
+        self.assertEqual(add_referral(self.db, 5, 6), 0)  # repeating a signup changes nothing
+        self.assertEqual(self.counters(3), (1, 2, 3))
+
+    def test_rates_and_sales(self):
+        add_referral(self.db, 3, 4)
+        self.assertEqual(paid_upline(self.db, 4), [(3, 1, 0.05), (2, 2, 0.025), (1, 3, 0.0125)])
+        set_commission_rate(self.db, 3, None)
+        set_commission_rate(self.db, 1, 0.08)
+        self.assertEqual(commission_rates(self.db), {1: 0.08, 2: 0.025})
+        self.assertEqual(paid_upline(self.db, 4), [(3, 1, 0.08), (2, 2, 0.025)])
+
+        self.db.executemany("INSERT INTO orders (user_id, total_price) VALUES (?, ?)",
+                            [(3, 10.0), (4, 5.0), (4, 2.5), (7, 100.0)])
+        self.assertEqual(subtree_sales(self.db, 1), (3, 17.5))
+        self.assertEqual(subtree_sales(self.db, 2, max_depth=1), (1, 10.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
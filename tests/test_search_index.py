@@ -0,0 +1,55 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import unittest
+
+from search_index import build_match_query, ensure_search_index, search_join
+
+
+class TestProductSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.execute('''
+            CREATE TABLE products (
+                id INTEGER PRIMARY KEY, name_ar TEXT, name_en TEXT,
+                desc_ar TEXT, desc_en TEXT, stock_quantity REAL
+            )
+        ''')
+        self.db.execute("INSERT INTO products (name_ar, name_en, desc_en) "
+                        "VALUES ('تمر سكري', 'Sukkari Dates', 'Fresh dates from Qassim')")
+        ensure_search_index(self.db)
+
+    def search(self, text):
+        sql = 'SELECT p.id FROM products p' + search_join() + ' ORDER BY fts.rank'
+        return [row[0] for row in self.db.execute(sql, (build_match_query(text),))]
+
+    def test_existing_rows_are_indexed(self):
+        self.assertEqual(self.search('dates'), [1])
+        self.assertEqual(self.search('تمر'), [1])
+
+    def test_triggers_keep_index_in_sync(self):
+        self.db.execute("INSERT INTO products (name_ar, name_en) VALUES ('أرز بسمتي', 'Basmati Rice')")
+        self.assertEqual(self.search('basm'), [2])
+
+        self.db.execute("UPDATE products SET name_en = 'Ajwa Dates' WHERE id = 2")
+        self.assertEqual(self.search('rice'), [])
+        self.assertEqual(self.search('ajwa'), [2])
+
+        self.db.execute("DELETE FROM products WHERE id = 1")
+        self.assertEqual(self.search('dates'), [2])
+
+    def test_names_rank_above_descriptions(self):
+        self.db.execute("INSERT INTO products (name_ar, name_en, desc_en) "
+                        "VALUES ('قهوة', 'Qassim Coffee', 'Arabic coffee')")
+        self.assertEqual(self.search('qassim'), [2, 1])
+
+    def test_user_input_is_quoted(self):
+        self.assertIsNone(build_match_query('   '))
+        self.assertEqual(build_match_query('Dates "OR'), '"dates"* "or"*')
+        self.assertEqual(self.search('dates AND'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
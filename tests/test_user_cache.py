@@ -0,0 +1,68 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import unittest
+from types import SimpleNamespace
+
+from user_cache import LazyUser, ProfileCache
+
+
+class TestProfileCache(unittest.TestCase):
+    def setUp(self):
+        self.loads = []
+
+    def load(self, user_id):
+        self.loads.append(user_id)
+        return SimpleNamespace(id=user_id, wallet_balance=len(self.loads))
+
+    def test_hits_until_invalidated(self):
+        cache = ProfileCache(ttl=60)
+        self.assertEqual(cache.get(1, self.load).wallet_balance, 1)
+        self.assertEqual(cache.get(1, self.load).wallet_balance, 1)
+        cache.invalidate(1)
+        self.assertEqual(cache.get(1, self.load).wallet_balance, 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_expired_entries_reload(self):
+        cache = ProfileCache(ttl=0)
+        cache.get(1, self.load)
+        cache.get(1, self.load)
+        self.assertEqual(self.loads, [1, 1])
+
+    def test_size_is_bounded(self):
+        cache = ProfileCache(ttl=60, max_entries=4)
+        for user_id in range(10):
+            cache.get(user_id, self.load)
+        self.assertLessEqual(len(cache._entries), 4)
+
+
+class TestLazyUser(unittest.TestCase):
+    def test_untouched_user_never_loads(self):
+        calls = []
+        user = LazyUser(7, lambda user_id: calls.append(user_id))
+        self.assertFalse(user.loaded)
+        self.assertEqual(calls, [])
+
+    def test_loads_once_per_request(self):
+        calls = []
+
+        def load(user_id):
+            calls.append(user_id)
+            return SimpleNamespace(username='sara')
+
+        user = LazyUser(7, load)
+        self.assertTrue(user)
+        self.assertEqual(user.username, 'sara')
+        self.assertEqual(user['username'], 'sara')
+        self.assertEqual(calls, [7])
+
+    def test_guest_is_falsy_without_loading(self):
+        user = LazyUser(None, lambda user_id: self.fail('guest lookup'))
+        self.assertFalse(user)
+        self.assertIsNone(user.username)
+        self.assertIsNone(user['username'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from view_counter import ViewCounter
+
+
+class TestViewCounter(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        with sqlite3.connect(self.path) as conn:
+            conn.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, views INTEGER DEFAULT 0)")
+            conn.executemany("INSERT INTO products (id) VALUES (?)", [(1,), (2,)])
+        self.statements = []
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.set_trace_callback(self.statements.append)
+        return conn
+
+    def views(self):
+        with sqlite3.connect(self.path) as conn:
+            return dict(conn.execute("SELECT id, views FROM products"))
+
+    def test_views_are_batched(self):
+        counter = ViewCounter(self.connect, flush_interval=None, max_pending=1000)
+        threads = [threading.Thread(target=lambda: [counter.record(1 + i % 2) for i in range(100)])
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.views(), {1: 0, 2: 0})
+
+        self.assertEqual(counter.flush(), 2)
+        self.assertEqual(self.views(), {1: 200, 2: 200})
+        self.assertEqual(sum(s.startswith('UPDATE') for s in self.statements), 2)
+        self.assertEqual(sum(s == 'COMMIT' for s in self.statements), 1)
+
+    def test_threshold_and_close(self):
+        counter = ViewCounter(self.connect, flush_interval=None, max_pending=3)
+        for _ in range(4):
+            counter.record(1)
+        self.assertEqual(self.views()[1], 3)
+        self.assertEqual(counter.pending(), {1: 1})
+
+        counter.close()
+        self.assertEqual(self.views()[1], 4)
+
+    def test_failed_flush_keeps_counts(self):
+        counter = ViewCounter(lambda: sqlite3.connect(os.path.join(self.path, 'missing.db')),
+                              flush_interval=None)
+        counter.record(2)
+        self.assertEqual(counter.flush(), 0)
+        self.assertEqual(counter.pending(), {2: 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
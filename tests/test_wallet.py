@@ -0,0 +1,107 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from wallet import (InsufficientFunds, create_withdrawal, credit, current_balance, debit, drifted,
+                    ensure_wallet_ledger, take_snapshots)
+
+SCHEMA = '''
+    CREATE TABLE users (id INTEGER PRIMARY KEY, wallet_balance REAL DEFAULT 0);
+    CREATE TABLE withdrawals (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, amount REAL,
+                              method TEXT, account_details TEXT, status TEXT);
+'''
+
+
+class TestWallet(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'shop.db')
+        db = self.connect()
+        db.executescript(SCHEMA)
+        db.executemany("INSERT INTO users (id, wallet_balance) VALUES (?, ?)", [(1, 12.5), (2, 0)])
+        ensure_wallet_ledger(db)
+        db.commit()
+        self.db = db
+        self.addCleanup(db.close)
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def cached(self, user_id):
+        return self.db.execute("SELECT wallet_balance FROM users WHERE id = ?", (user_id,)).fetchone()[0]
+
+    def test_opening_balance_credit_and_debit(self):
+        self.assertEqual(current_balance(self.db, 1), 12.5)
+        credit(self.db, 2, 10.0, 'commission', 'commission', 7)
+        debit(self.db, 2, 4.0, 'withdrawal')
+        self.assertEqual(current_balance(self.db, 2), 6.0)
+        self.assertEqual(self.cached(2), 6.0)
+
+        with self.assertRaises(InsufficientFunds):
+            debit(self.db, 2, 6.5, 'withdrawal')
+        with self.assertRaises(InsufficientFunds):
+            debit(self.db, 2, -1.0, 'withdrawal')
+        self.assertEqual(current_balance(self.db, 2), 6.0)
+        self.assertEqual(drifted(self.db), [])
+
+    def test_ledger_is_append_only(self):
+        credit(self.db, 2, 1.0, 'bonus')
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.execute("UPDATE wallet_ledger SET amount = 100")
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.execute("DELETE FROM wallet_ledger")
+
+    def test_balance_reads_snapshot_plus_tail(self):
+        credit(self.db, 1, 7.5, 'bonus')
+        self.assertEqual(take_snapshots(self.db), 1)
+        self.assertEqual(take_snapshots(self.db), 0)  # nothing new since
+        debit(self.db, 1, 5.0, 'withdrawal')
+        self.assertEqual(current_balance(self.db, 1), 15.0)
+        take_snapshots(self.db)
+        self.assertEqual(self.db.execute("SELECT balance FROM wallet_snapshots WHERE user_id = 1 "
+                                         "ORDER BY ledger_id DESC").fetchall()[0][0], 15.0)
+        credit(self.db, 1, 1.0, 'bonus')
+        self.assertEqual(current_balance(self.db, 1), 16.0)
+
+    def test_concurrent_withdrawals_never_overdraw(self):
+        workers = 20
+        results = []
+        start = threading.Barrier(workers)
+
+        def withdraw():
+            db = self.connect()
+            try:
+                start.wait()
+                create_withdrawal(db, 1, 5.0, 'bank', 'KW00')
+                db.commit()
+                results.append('ok')
+            except InsufficientFunds:
+                db.rollback()
+                results.append('short')
+            finally:
+                db.close()
+
+        threads = [threading.Thread(target=withdraw) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count('ok'), 2)
+        self.assertEqual(results.count('short'), workers - 2)
+        self.assertEqual(current_balance(self.db, 1), 2.5)
+        self.assertEqual(self.cached(1), 2.5)
+        self.assertEqual(self.db.execute("SELECT COUNT(*) FROM withdrawals").fetchone()[0], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+Current-User Cache for SooqKabeer
+Filename: user_cache.py
+Short-TTL in-process cache of user profiles and a lazily evaluated
+current-user object, so templates that never touch current_user never
+query the users table
+"""
+
+import threading
+import time
+
+# Seconds a cached profile is trusted. Writes in this process invalidate
+# immediately; the TTL bounds staleness from other worker processes.
+PROFILE_TTL = 30.0
+
+
+class ProfileCache:
+    """{user_id: (expires_at, profile)} with TTL expiry and explicit invalidation"""
+
+    def __init__(self, ttl=PROFILE_TTL, max_entries=2048):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, load):
+        """Cached profile for `user_id`, calling load(user_id) on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        profile = load(user_id)
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._evict(now)
+            self._entries[user_id] = (now + self.ttl, profile)
+        return profile
+
+    def _evict(self, now):
+        expired = [key for key, (expires, _) in self._entries.items() if expires <= now]
+        for key in expired or list(self._entries)[:len(self._entries) // 4 or 1]:
+            del self._entries[key]
+
+    def invalidate(self, *user_ids):
+        """Drop the cached profiles of users whose row was just written"""
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class LazyUser:
+    """Stand-in for the logged-in user that loads it on first use
+
+    Truthiness, attribute and item access resolve the profile once
+    (`current_user['x']` reads the same field as `current_user.x`); a
+    template that never mentions current_user costs nothing.
+    """
+
+    def __init__(self, user_id, load):
+        self._user_id = user_id
+        self._load = load
+        self._resolved = False
+        self._user = None
+
+    def _resolve(self):
+        if not self._resolved:
+            self._user = self._load(self._user_id) if self._user_id is not None else None
+            self._resolved = True
+        return self._user
+
+    @property
+    def loaded(self):
+        return self._resolved
+
+    def __bool__(self):
+        return self._resolve() is not None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        user = self._resolve()
+        return getattr(user, name) if user is not None else None
+
+    def __getitem__(self, key):
+        user = self._resolve()
+        return getattr(user, key) if user is not None else None
+
+
+profile_cache = ProfileCache()
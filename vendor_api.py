@@ -2,23 +2,25 @@
 import hashlib
 import secrets
 import smtplib
-import sqlite3
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from functools import wraps
 from flask import Blueprint, request, jsonify, session, flash
 from datetime import datetime
+from database import connection_manager
+from jobs import enqueue, job_handler
+from idempotency import idempotent
 
 #=== IMPORTANT: Define the Blueprint first to fix NameError ===#
+# Not registered on the app yet: its routes need the transactions and
+# vendor_payout_methods tables, which no migration creates. app.py imports
+# this module only for the payout_email job handler.
 vendor_api = Blueprint('vendor_api', __name__)
 
 #=== Database Settings ===#
-DATABASE = 'sooqkabeer.db'
-
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Shared pooled connections; close() hands the connection back
+    return connection_manager.connect()
 
 #=== Vendor Security Decorator ===#
 def vendor_required(f):
@@ -88,10 +90,17 @@ def send_payout_email(vendor_email, vendor_name, amount, ref_no):
         print(f"Email Error: {str(e)}")
         return False
 
+@job_handler('payout_email')
+def payout_email_job(db, payload):
+    """Send the payout confirmation; a failed send is retried by the worker"""
+    if not send_payout_email(payload['email'], payload['name'], payload['amount'], payload['ref_no']):
+        raise RuntimeError(f"Payout email for {payload['ref_no']} was not sent")
+
 @vendor_api.route('/api/vendor/request-payout', methods=['POST'])
 @vendor_required
+@idempotent(owner=lambda: session.get('vendor_id') and f"vendor:{session['vendor_id']}")
 def request_payout():
-    """Handles payout requests and sends email notification"""
+    """Handles payout requests and queues the email notification"""
     vendor_id = session.get('vendor_id')
     vendor_email = session.get('vendor_email') # Ensure this is in session
     vendor_name = session.get('vendor_name')
@@ -115,16 +124,18 @@ def request_payout():
             INSERT INTO transactions (vendor_id, type, amount, status, reference_no)
             VALUES (?, 'payout', ?, 'pending', ?)
         """, (vendor_id, amount, ref_no))
+
+        # Email goes out from the job worker, committed with the transaction
+        enqueue(conn, 'payout_email', {'email': vendor_email, 'name': vendor_name,
+                                       'amount': amount, 'ref_no': ref_no},
+                dedupe_key=f'payout_email:{ref_no}')
         
         conn.commit()
         conn.close()
-
-        # Send Email Notification
-        send_payout_email(vendor_email, vendor_name, amount, ref_no)
         
         return jsonify({
             'status': 'success',
-            'message': 'Payout request submitted and email sent',
+            'message': 'Payout request submitted; confirmation email will follow',
             'reference': ref_no
         })
     except Exception as e:
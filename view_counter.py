@@ -0,0 +1,94 @@
+"""
+Buffered Product View Counter for SooqKabeer
+Filename: view_counter.py
+Collects product view increments in memory and writes them to
+products.views in one batched transaction on a timer or size threshold
+"""
+
+import atexit
+import sqlite3
+import threading
+from collections import Counter
+
+
+class ViewCounter:
+    """Per-process write-behind buffer for products.views
+
+    `connect` returns a new sqlite3 connection; it is called on every flush
+    so the flush never shares a request's connection or thread.
+    """
+
+    def __init__(self, connect, flush_interval=10.0, max_pending=200):
+        self.connect = connect
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = Counter()
+        self._pending_total = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self, product_id, count=1):
+        """Count a view; flushes inline once max_pending views are buffered"""
+        with self._lock:
+            self._pending[product_id] += count
+            self._pending_total += count
+            full = self._pending_total >= self.max_pending
+        self._ensure_timer()
+        if full:
+            self.flush()
+
+    def pending(self):
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self):
+        """Write buffered views in one transaction; returns rows updated"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, Counter()
+                self._pending_total = 0
+            if not batch:
+                return 0
+
+            try:
+                conn = self.connect()
+                try:
+                    with conn:
+                        conn.executemany("UPDATE products SET views = COALESCE(views, 0) + ? WHERE id = ?",
+                                         [(count, product_id) for product_id, count in batch.items()])
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                # Keep the counts for the next attempt
+                with self._lock:
+                    self._pending.update(batch)
+                    self._pending_total += sum(batch.values())
+                print(f"✗ View counter flush failed: {str(e)}")
+                return 0
+            return len(batch)
+
+    def _ensure_timer(self):
+        if self._thread is not None or self.flush_interval is None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='view-counter', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """Stop the timer and write whatever is still buffered"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval)
+        self.flush()
+
+    def register_shutdown(self):
+        """Flush on interpreter exit (normal exit, SIGTERM handled by the server)"""
+        atexit.register(self.close)
+        return self
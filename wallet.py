@@ -0,0 +1,182 @@
+"""
+Wallet Ledger for SooqKabeer
+Filename: wallet.py
+Append-only wallet_ledger of signed entries, with periodic per-user
+balance snapshots. A balance is the latest snapshot plus the entries
+after it. A debit is one INSERT ... SELECT guarded by that balance, so
+concurrent withdrawals cannot overdraw. users.wallet_balance is kept in
+step by trigger for the pages that display it.
+"""
+
+import time
+
+from jobs import enqueue, job_handler
+
+# How often the wallet_snapshots job runs
+SNAPSHOT_INTERVAL = 24 * 3600
+
+
+class InsufficientFunds(Exception):
+    """The wallet balance does not cover the debit; nothing was written"""
+
+    def __init__(self, user_id, amount):
+        self.user_id = user_id
+        self.amount = amount
+        super().__init__('Insufficient balance')
+
+
+def ensure_wallet_ledger(db):
+    fresh = db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'wallet_ledger'"
+                       ).fetchone() is None
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS wallet_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            kind TEXT NOT NULL,
+            ref_type TEXT,
+            ref_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_wallet_ledger_user ON wallet_ledger(user_id, id)")
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS wallet_snapshots (
+            user_id INTEGER NOT NULL,
+            ledger_id INTEGER NOT NULL,
+            balance REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, ledger_id)
+        ) WITHOUT ROWID
+    ''')
+    if 'wallet_balance' not in {row[1] for row in db.execute("PRAGMA table_info(users)")}:
+        db.execute("ALTER TABLE users ADD COLUMN wallet_balance REAL DEFAULT 0")
+    if fresh:
+        # Existing balances become each user's opening entry
+        db.execute('''
+            INSERT INTO wallet_ledger (user_id, amount, kind)
+            SELECT id, wallet_balance, 'opening' FROM users WHERE COALESCE(wallet_balance, 0) != 0
+        ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS wallet_ledger_balance AFTER INSERT ON wallet_ledger
+        BEGIN
+            UPDATE users SET wallet_balance = COALESCE(wallet_balance, 0) + NEW.amount WHERE id = NEW.user_id;
+        END
+    ''')
+    for action in ('UPDATE', 'DELETE'):
+        db.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS wallet_ledger_no_{action.lower()} BEFORE {action} ON wallet_ledger
+            BEGIN
+                SELECT RAISE(ABORT, 'wallet_ledger is append-only');
+            END
+        ''')
+
+
+# Latest snapshot plus the entries after it; binds :user_id
+_BALANCE = '''
+    COALESCE((SELECT balance FROM wallet_snapshots WHERE user_id = :user_id
+              ORDER BY ledger_id DESC LIMIT 1), 0)
+    + COALESCE((SELECT SUM(amount) FROM wallet_ledger WHERE user_id = :user_id AND id > COALESCE(
+                    (SELECT MAX(ledger_id) FROM wallet_snapshots WHERE user_id = :user_id), 0)), 0)
+'''
+
+
+def current_balance(db, user_id):
+    return db.execute(f"SELECT {_BALANCE}", {'user_id': user_id}).fetchone()[0]
+
+
+#=== Entries ===#
+def credit(db, user_id, amount, kind, ref_type=None, ref_id=None):
+    """Append a credit in the caller's transaction; returns the entry id"""
+    return db.execute('''
+        INSERT INTO wallet_ledger (user_id, amount, kind, ref_type, ref_id) VALUES (?, ?, ?, ?, ?)
+    ''', (user_id, amount, kind, ref_type, ref_id)).lastrowid
+
+
+def debit(db, user_id, amount, kind, ref_type=None, ref_id=None):
+    """Append a debit only if the balance covers it; returns the entry id
+
+    The check and the insert are one statement, so it holds under
+    concurrent writers. Raises InsufficientFunds when nothing was written.
+    """
+    cursor = db.execute(f'''
+        INSERT INTO wallet_ledger (user_id, amount, kind, ref_type, ref_id)
+        SELECT :user_id, -:amount, :kind, :ref_type, :ref_id
+        WHERE :amount > 0 AND ({_BALANCE}) >= :amount
+    ''', {'user_id': user_id, 'amount': amount, 'kind': kind, 'ref_type': ref_type, 'ref_id': ref_id})
+    if not cursor.rowcount:
+        raise InsufficientFunds(user_id, amount)
+    return cursor.lastrowid
+
+
+def credit_commissions(db, after):
+    """One ledger credit per commission row with id above `after`; returns how many"""
+    return db.execute('''
+        INSERT INTO wallet_ledger (user_id, amount, kind, ref_type, ref_id)
+        SELECT user_id, amount, COALESCE(type, 'commission'), 'commission', id
+        FROM commissions WHERE id > ? AND amount != 0
+        ORDER BY id
+    ''', (after,)).rowcount
+
+
+def create_withdrawal(db, user_id, amount, method=None, account_details=None):
+    """Record a pending withdrawal and hold its amount; returns the withdrawal id
+
+    Runs in the caller's transaction; on InsufficientFunds the caller rolls
+    back, which also drops the withdrawal row.
+    """
+    withdrawal_id = db.execute('''
+        INSERT INTO withdrawals (user_id, amount, method, account_details, status)
+        VALUES (?, ?, ?, ?, 'pending')
+    ''', (user_id, amount, method, account_details)).lastrowid
+    debit(db, user_id, amount, 'withdrawal', 'withdrawal', withdrawal_id)
+    return withdrawal_id
+
+
+def history(db, user_id, limit=20):
+    return db.execute('''
+        SELECT * FROM wallet_ledger WHERE user_id = ? ORDER BY id DESC LIMIT ?
+    ''', (user_id, limit)).fetchall()
+
+
+#=== Snapshots ===#
+def take_snapshots(db):
+    """Snapshot every wallet with entries since its last snapshot; returns how many"""
+    return db.execute('''
+        INSERT INTO wallet_snapshots (user_id, ledger_id, balance)
+        WITH latest AS (
+            SELECT user_id, MAX(ledger_id) AS ledger_id FROM wallet_snapshots GROUP BY user_id
+        )
+        SELECT l.user_id, MAX(l.id),
+               COALESCE(s.balance, 0) + SUM(l.amount)
+        FROM wallet_ledger l
+        LEFT JOIN latest ON latest.user_id = l.user_id
+        LEFT JOIN wallet_snapshots s ON s.user_id = latest.user_id AND s.ledger_id = latest.ledger_id
+        WHERE l.id > COALESCE(latest.ledger_id, 0)
+        GROUP BY l.user_id
+    ''').rowcount
+
+
+def drifted(db):
+    """[(user_id, users.wallet_balance, ledger balance)] where the two disagree"""
+    return [tuple(row) for row in db.execute('''
+        WITH ledger AS (SELECT user_id, SUM(amount) AS balance FROM wallet_ledger GROUP BY user_id)
+        SELECT u.id, COALESCE(u.wallet_balance, 0), COALESCE(ledger.balance, 0)
+        FROM users u LEFT JOIN ledger ON ledger.user_id = u.id
+        WHERE ABS(COALESCE(u.wallet_balance, 0) - COALESCE(ledger.balance, 0)) > 0.0005
+    ''')]
+
+
+def schedule_snapshots(db, now=None):
+    """Queue the next wallet_snapshots run (once per interval slot)"""
+    now = time.time() if now is None else now
+    slot = int(now // SNAPSHOT_INTERVAL) + 1
+    enqueue(db, 'wallet_snapshots', dedupe_key=f'wallet_snapshots:{slot}',
+            delay=slot * SNAPSHOT_INTERVAL - now)
+
+
+@job_handler('wallet_snapshots')
+def wallet_snapshots_job(db, payload):
+    """Snapshot changed wallets, then queue the next run"""
+    take_snapshots(db)
+    schedule_snapshots(db)